@@ -1,10 +1,33 @@
+import argparse
 import asyncio
+import json
 import logging
+import os
+import sys
+import time
+from urllib.parse import urlparse
 from colorama import init, Fore, Style
 from config import load_config, modify_config
+from file_downloader import set_segment_options
+from http_client import configure_http, close_session, shared_session
+from download_scheduler import scheduler
+from page_cache import configure_page_cache
+from disk_writer import configure_disk_writer
+from rate_limiter import configure_bandwidth
+from concurrency_controller import AUTO, configure_auto_concurrency
+from retry_policy import configure_retry, get_retry_policy
+from progress import ProgressLogHandler, configure_progress
+from metrics import configure_metrics, exporter
+from tracing import configure_tracing, analyze_trace
+from content_index import configure_dedup
 from scraper.tv_show_scraper import TVShowScraper
 from scraper.movie_scraper import MovieScraper
 from scraper.anime_scraper import AnimeScraper
+from batch_runner import BatchRunner, run_batch, load_job_file, JobFileError, EXIT_BAD_JOB_FILE
+from download_daemon import run_daemon
+from follow_sync import FollowSync, run_sync, print_follows
+from catalog import catalog, configure_catalog
+from folder_navigator import FolderNavigator
 
 # Initialize colorama
 init(autoreset=True)
@@ -25,9 +48,10 @@ class ColoredFormatter(logging.Formatter):
         formatter = logging.Formatter(log_fmt)
         return formatter.format(record)
 
-handler = logging.StreamHandler()
+handler = ProgressLogHandler()
 handler.setFormatter(ColoredFormatter())
-logging.basicConfig(level=logging.INFO, handlers=[handler])
+# force replaces the plain handler file_downloader installs when it is imported
+logging.basicConfig(level=logging.INFO, handlers=[handler], force=True)
 
 async def download_content(scraper, search_query, concurrency):
     if isinstance(scraper, AnimeScraper):
@@ -35,10 +59,32 @@ async def download_content(scraper, search_query, concurrency):
     else:
         await scraper.search_and_download(search_query, concurrency)
 
+def apply_download_options(config):
+    downloads = config.get('downloads', {})
+    set_segment_options(
+        segments=downloads.get('segments', 1),
+        min_size=downloads.get('min_segment_size_mb', 16) * 1024 * 1024
+    )
+    configure_http(config.get('http', {}))
+    configure_disk_writer(config.get('disk', {}))
+    scheduler.max_bytes_in_flight = config.get('scheduler', {}).get('max_bytes_in_flight_mb', 0) * 1024 * 1024
+    scheduler.size_estimate = config.get('scheduler', {}).get('unknown_size_mb', 1024) * 1024 * 1024
+    configure_bandwidth(config.get('bandwidth', {}))
+    configure_auto_concurrency(config.get('auto_concurrency', {}))
+    configure_retry(config.get('retry', {}))
+    configure_page_cache(config.get('page_cache', {}))
+    configure_progress(config.get('progress', {}))
+    configure_metrics(config.get('metrics', {}))
+    configure_tracing(config.get('tracing', {}))
+    configure_dedup(config.get('dedup', {}), config.get('download_paths', {}).values())
+    configure_catalog(config.get('catalog', {}))
+
 async def main():
     config = load_config()
     if not config:
         return
+    apply_download_options(config)
+    await exporter.start()
 
     while True:
         print(f"\n{Fore.YELLOW}Main Menu:{Style.RESET_ALL}")
@@ -47,14 +93,16 @@ async def main():
         print(f"{Fore.CYAN}3. Search and download Anime{Style.RESET_ALL}")
         print(f"{Fore.CYAN}4. View download history{Style.RESET_ALL}")
         print(f"{Fore.CYAN}5. Modify configuration{Style.RESET_ALL}")
-        print(f"{Fore.CYAN}6. Quit{Style.RESET_ALL}")
+        print(f"{Fore.CYAN}6. Browse folders{Style.RESET_ALL}")
+        print(f"{Fore.CYAN}7. Quit{Style.RESET_ALL}")
 
-        choice = input(f"\n{Fore.YELLOW}Enter your choice (1-6): {Style.RESET_ALL}").strip()
+        choice = input(f"\n{Fore.YELLOW}Enter your choice (1-7): {Style.RESET_ALL}").strip()
 
         if choice in ['1', '2', '3']:
-            concurrency = 1
-            if choice in ['1', '2']:
-                concurrency_input = input(f"{Fore.YELLOW}Enter concurrency level (1 for sequential, 2+ for concurrent downloads): {Style.RESET_ALL}").strip()
+            concurrency_input = input(f"{Fore.YELLOW}Enter concurrency level (1 for sequential, 2+ for concurrent downloads, 'auto' to adapt): {Style.RESET_ALL}").strip().lower()
+            if concurrency_input == AUTO:
+                concurrency = AUTO
+            else:
                 try:
                     concurrency = int(concurrency_input)
                     if concurrency < 1:
@@ -73,6 +121,9 @@ async def main():
                 scraper = AnimeScraper(config['base_url'], config['download_paths']['Anime'])
 
             await download_content(scraper, search_query, concurrency)
+            retry_stats = get_retry_policy().stats()
+            if retry_stats:
+                logging.info(f"Retry counters: {', '.join(f'{key}={value}' for key, value in sorted(retry_stats.items()))}")
 
         elif choice == '4':
             print(f"\n{Fore.YELLOW}Select history to view:{Style.RESET_ALL}")
@@ -93,12 +144,146 @@ async def main():
                 print(f"{Fore.RED}Invalid choice.{Style.RESET_ALL}")
         elif choice == '5':
             config = modify_config(config)
+            apply_download_options(config)
         elif choice == '6':
+            print(f"\n{Fore.YELLOW}Save downloaded files under:{Style.RESET_ALL}")
+            categories = list(config['download_paths'])
+            for i, category in enumerate(categories, 1):
+                print(f"{Fore.CYAN}{i}. {category}{Style.RESET_ALL}")
+            category_choice = input(f"\n{Fore.YELLOW}Enter your choice (1-{len(categories)}): {Style.RESET_ALL}").strip()
+            if category_choice.isdigit() and 1 <= int(category_choice) <= len(categories):
+                # The anime scraper's folder-tree download suits any category
+                scraper = AnimeScraper(config['base_url'], config['download_paths'][categories[int(category_choice) - 1]])
+                await FolderNavigator(scraper, urlparse(config['base_url']).path or "/").run()
+            else:
+                print(f"{Fore.RED}Invalid choice.{Style.RESET_ALL}")
+        elif choice == '7':
             break
         else:
             print(f"{Fore.RED}Invalid choice. Please try again.{Style.RESET_ALL}")
 
+    await exporter.stop()
+    await close_session()
     print(f"{Fore.GREEN}Program terminated. Goodbye!{Style.RESET_ALL}")
 
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Search and download TV shows, movies and anime. Runs the interactive menu unless a job is given.")
+    parser.add_argument("start_url", nargs="?", default="", help="base URL to use instead of the one in config.json")
+    parser.add_argument("--job_file", help="JSON job file to run without prompts")
+    parser.add_argument("--daemon", action="store_true", help="run the persistent download queue and its local control API")
+    parser.add_argument("--tv_show_name", default="", help="download every season of the first TV show matching this name")
+    parser.add_argument("--download_dir", default="", help="root directory for downloads; each category gets a subdirectory")
+    parser.add_argument("--max_workers", default="", help=f"concurrent transfers, or '{AUTO}' (overrides the job file)")
+    parser.add_argument("--max_pages", default="", help="accepted for compatibility with the Docker image; not used")
+    parser.add_argument("--summary", help="write the JSON summary to this file instead of stdout")
+    parser.add_argument("--follow", metavar="SHOW", help="subscribe to the TV show matching this name; --sync then downloads its new episodes")
+    parser.add_argument("--select", help="with --follow, the search result to pick: a 1-based number or part of its name")
+    parser.add_argument("--backfill", action="store_true", help="with --follow, also download episodes that are already listed")
+    parser.add_argument("--unfollow", metavar="SHOW", help="drop the subscription to this show")
+    parser.add_argument("--follows", action="store_true", help="list followed shows")
+    parser.add_argument("--sync", action="store_true", help="check followed shows and download new episodes")
+    parser.add_argument("--build_catalog", action="store_true", help="crawl the site into the local catalog, or refresh it")
+    parser.add_argument("--catalog_search", metavar="QUERY", help="search the local catalog")
+    parser.add_argument("--analyze_trace", metavar="TRACE_FILE", help="print the critical path and phase latencies of a trace file, then exit")
+    return parser.parse_args(argv)
+
+async def run_daemon_mode(args):
+    config = load_config()
+    if not config:
+        return EXIT_BAD_JOB_FILE
+    apply_download_options(config)
+    await exporter.start()
+    try:
+        await run_daemon(config, args.download_dir or None, args.start_url or None)
+    finally:
+        await exporter.stop()
+        await close_session()
+    return 0
+
+async def run_follow_mode(args):
+    config = load_config()
+    if not config:
+        return EXIT_BAD_JOB_FILE
+    apply_download_options(config)
+    try:
+        if args.sync:
+            await exporter.start()
+            try:
+                return await run_sync(config, args.download_dir or None, args.start_url or None, args.summary)
+            finally:
+                await exporter.stop()
+        follow_sync = FollowSync(config, config.get('follow', {}), args.download_dir or None, args.start_url or None)
+        if args.follow:
+            select = int(args.select) if args.select and args.select.isdigit() else args.select
+            return 0 if await follow_sync.follow(args.follow, select, args.backfill) else 1
+        if args.unfollow:
+            if follow_sync.unfollow(args.unfollow) is None:
+                logging.error(f"Not following a show matching {args.unfollow!r}")
+                return 1
+            return 0
+        print_follows(follow_sync.store)
+        return 0
+    finally:
+        await close_session()
+
+async def run_catalog_mode(args):
+    config = load_config()
+    if not config:
+        return EXIT_BAD_JOB_FILE
+    apply_download_options(config)
+    if args.catalog_search:
+        if not os.path.exists(catalog.db_path):
+            logging.error(f"No catalog at {catalog.db_path}; build one with --build_catalog")
+            return 1
+        started = time.perf_counter()
+        results = catalog.search(args.catalog_search)
+        for result in results:
+            size = f" ({result['size'] / (1024 * 1024):.1f} MB)" if result['size'] else ""
+            print(f"{'📁' if result['is_dir'] else '📄'} {result['name']}{size}  {result['path']}")
+        print(f"{len(results)} results in {(time.perf_counter() - started) * 1000:.1f} ms")
+        return 0
+    base_url = args.start_url or config['base_url']
+    scraper = BatchRunner(config, {"jobs": []}, args.download_dir or None, base_url).scraper_for("TV Shows")
+    try:
+        async with shared_session() as session:
+            stats = await catalog.crawl(session, scraper.fetch_text, base_url)
+    finally:
+        await close_session()
+    print(json.dumps(stats, indent=2))
+    return 1 if stats["failed"] else 0
+
+async def run_headless(args):
+    config = load_config()
+    if not config:
+        return EXIT_BAD_JOB_FILE
+    apply_download_options(config)
+    try:
+        if args.job_file:
+            spec = load_job_file(args.job_file)
+        else:
+            spec = {"jobs": [{"category": "TV Shows", "query": args.tv_show_name, "seasons": "all"}]}
+        if args.max_workers:
+            spec["concurrency"] = AUTO if args.max_workers.lower() == AUTO else int(args.max_workers)
+    except (JobFileError, ValueError) as e:
+        logging.error(str(e))
+        return EXIT_BAD_JOB_FILE
+    await exporter.start()
+    try:
+        return await run_batch(config, spec, args.download_dir or None, args.start_url or None, args.summary)
+    finally:
+        await exporter.stop()
+        await close_session()
+
 if __name__ == "__main__":
+    args = parse_args()
+    if args.analyze_trace:
+        sys.exit(analyze_trace(args.analyze_trace))
+    if args.daemon:
+        sys.exit(asyncio.run(run_daemon_mode(args)))
+    if args.build_catalog or args.catalog_search:
+        sys.exit(asyncio.run(run_catalog_mode(args)))
+    if args.follow or args.unfollow or args.follows or args.sync:
+        sys.exit(asyncio.run(run_follow_mode(args)))
+    if args.job_file or args.tv_show_name:
+        sys.exit(asyncio.run(run_headless(args)))
     asyncio.run(main())
\ No newline at end of file
@@ -0,0 +1,262 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from urllib.parse import quote
+from http_client import shared_session
+from concurrency_controller import AUTO, concurrency_control
+from retry_policy import get_retry_policy
+from tracing import tracer
+from transfer_control import control_console
+from content_index import deduplicator
+from scraper.tv_show_scraper import TVShowScraper
+from scraper.movie_scraper import MovieScraper
+from scraper.anime_scraper import AnimeScraper
+
+SCRAPERS = {
+    "TV Shows": TVShowScraper,
+    "Movies": MovieScraper,
+    "Anime": AnimeScraper
+}
+
+EXIT_OK = 0
+EXIT_FAILURES = 1
+EXIT_BAD_JOB_FILE = 2
+
+class JobFileError(Exception):
+    pass
+
+def load_job_file(path):
+    try:
+        with open(path, 'r') as f:
+            spec = json.load(f)
+    except (OSError, ValueError) as e:
+        raise JobFileError(f"Cannot read job file {path}: {e}")
+    if isinstance(spec, list):
+        spec = {"jobs": spec}
+    validate_job_spec(spec)
+    return spec
+
+def validate_job(job, number=1):
+    if not isinstance(job, dict) or not job.get("query"):
+        raise JobFileError(f"Job {number} needs a \"query\"")
+    if job.get("category", "TV Shows") not in SCRAPERS:
+        raise JobFileError(f"Job {number} has unknown category {job.get('category')!r}; expected one of {', '.join(SCRAPERS)}")
+
+def validate_job_spec(spec):
+    jobs = spec.get("jobs")
+    if not isinstance(jobs, list) or not jobs:
+        raise JobFileError("Job file must contain a non-empty \"jobs\" list")
+    for i, job in enumerate(jobs, 1):
+        validate_job(job, i)
+    concurrency = spec.get("concurrency", 1)
+    if concurrency != AUTO and (not isinstance(concurrency, int) or concurrency < 1):
+        raise JobFileError(f"Invalid concurrency {concurrency!r}; use a positive number or \"{AUTO}\"")
+
+def parse_selector(selector, count):
+    # "all", a 1-based number, a list of numbers, or a string such as "1-3,5"
+    if selector is None or selector == "all":
+        return list(range(count))
+    parts = selector if isinstance(selector, list) else str(selector).split(',')
+    indexes = []
+    for part in parts:
+        part = str(part).strip()
+        if '-' in part:
+            first, last = part.split('-', 1)
+            numbers = range(int(first), int(last) + 1)
+        else:
+            numbers = [int(part)]
+        for number in numbers:
+            if 1 <= number <= count:
+                if number - 1 not in indexes:
+                    indexes.append(number - 1)
+            else:
+                logging.warning(f"Selection {number} is out of range (1-{count})")
+    return indexes
+
+def pick_result(results, select):
+    # A 1-based position, or a name matched exactly first and then as a substring
+    if not results:
+        return None
+    if select is None:
+        return results[0]
+    if isinstance(select, int):
+        return results[select - 1] if 1 <= select <= len(results) else None
+    wanted = str(select).lower()
+    for result in results:
+        if result['name'].lower() == wanted:
+            return result
+    for result in results:
+        if wanted in result['name'].lower():
+            return result
+    return None
+
+class BatchRunner:
+    def __init__(self, config, spec, download_dir=None, base_url=None):
+        self.config = config
+        self.spec = spec
+        self.download_dir = download_dir
+        self.base_url = base_url or config['base_url']
+        self.scrapers = {}
+        self.jobs = []
+        self.transfers = []
+
+    def scraper_for(self, category):
+        if category not in self.scrapers:
+            if self.download_dir:
+                path = os.path.join(self.download_dir, category)
+                deduplicator.add_roots([path])
+            else:
+                path = self.config['download_paths'][category]
+            self.scrapers[category] = SCRAPERS[category](self.base_url, path)
+        return self.scrapers[category]
+
+    async def run(self):
+        started = time.time()
+        async with tracer.span("batch", jobs=len(self.spec["jobs"])), concurrency_control(self.spec.get("concurrency", 1)), shared_session() as session:
+            # Every job is resolved to its file list first, so transfers from all jobs share one queue
+            self.jobs = await asyncio.gather(*[
+                self.resolve_job(session, i, job) for i, job in enumerate(self.spec["jobs"], 1)
+            ])
+            logging.info(f"Resolved {len(self.transfers)} files from {len(self.jobs)} jobs")
+            # Transfers can be listed, paused, skipped or cancelled by typing while they run
+            with control_console():
+                results = await asyncio.gather(*[self.run_transfer(session, transfer) for transfer in self.transfers])
+        return self.summary(results, started)
+
+    async def resolve_job(self, session, number, job):
+        category = job.get("category", "TV Shows")
+        report = {"job": number, "category": category, "query": job["query"], "status": "resolved", "files": 0}
+        try:
+            with tracer.span("job", job=number, category=category, query=job["query"]) as span:
+                selected, transfers = await self.resolve(session, job)
+            report["selected"] = selected['name']
+        except Exception as e:
+            logging.error(f"Job {number} ({job['query']}) failed: {e}")
+            report["status"] = "failed"
+            report["error"] = str(e)
+            return report
+
+        for transfer in transfers:
+            transfer["job"] = number
+            # Transfers run after the job span has ended, so they link to it by id rather than as children
+            transfer["job_span"] = span.id
+        self.transfers.extend(transfers)
+        report["files"] = len(transfers)
+        return report
+
+    async def resolve(self, session, job):
+        # Returns the chosen search result and the files the job selects from it
+        category = job.get("category", "TV Shows")
+        scraper = self.scraper_for(category)
+        search_url = f"{self.base_url}/s/{quote(job['query'])}"
+        listing = await scraper.fetch_page(session, search_url)
+        selected = pick_result(scraper.extract_links(listing) if listing else [], job.get("select"))
+        if selected is None:
+            raise LookupError(f"No search result matching {job.get('select', 1)!r} for {job['query']!r}")
+
+        if category == "TV Shows":
+            transfers = await self.resolve_tv_show(session, scraper, selected, job)
+        elif category == "Movies":
+            transfers = await self.resolve_movie(session, scraper, selected, job)
+        else:
+            transfers = await self.resolve_anime(session, scraper, selected, job)
+        return selected, transfers
+
+    async def fetch_listing(self, session, scraper, url):
+        listing = await scraper.fetch_page(session, url)
+        if not listing:
+            raise LookupError(f"Failed to fetch {url}")
+        return listing
+
+    async def resolve_tv_show(self, session, scraper, show, job):
+        show_name = scraper.sanitize_filename(show['name'])
+        seasons = scraper.extract_links(await self.fetch_listing(session, scraper, show['url']))
+        selected_seasons = [seasons[i] for i in parse_selector(job.get("seasons"), len(seasons))]
+        listings = await asyncio.gather(*[self.fetch_listing(session, scraper, season['url']) for season in selected_seasons])
+        transfers = []
+        for season, listing in zip(selected_seasons, listings):
+            episodes = scraper.extract_file_links(listing)
+            season_path = os.path.join(scraper.download_dir, show_name, scraper.sanitize_filename(season['name']))
+            for i in parse_selector(job.get("episodes"), len(episodes)):
+                file_name = scraper.sanitize_filename(episodes[i]['name'])
+                transfers.append(self.transfer(scraper, episodes[i]['url'], os.path.join(season_path, file_name), show_name, season['name'], file_name, episodes[i].get('size')))
+        return transfers
+
+    async def resolve_movie(self, session, scraper, movie, job):
+        movie_name = scraper.sanitize_filename(movie['name'])
+        files = scraper.extract_file_links(await self.fetch_listing(session, scraper, movie['url']))
+        movie_path = os.path.join(scraper.download_dir, movie_name)
+        transfers = []
+        for i in parse_selector(job.get("files"), len(files)):
+            file_name = scraper.sanitize_filename(files[i]['name'])
+            transfers.append(self.transfer(scraper, files[i]['url'], os.path.join(movie_path, file_name), movie_name, '', file_name, files[i].get('size')))
+        return transfers
+
+    async def resolve_anime(self, session, scraper, anime, job):
+        # "folder" is a list of subfolder names below the search result; everything under it is downloaded
+        url = anime['url']
+        names = [anime['name']]
+        for folder in job.get("folder", []):
+            subfolder = pick_result(scraper.extract_links(await self.fetch_listing(session, scraper, url)), folder)
+            if subfolder is None:
+                raise LookupError(f"No folder {folder!r} under {' > '.join(names)}")
+            url = subfolder['url']
+            names.append(subfolder['name'])
+
+        root = os.path.join(scraper.download_dir, *names)
+        transfers = []
+        visited = {url}
+        level = [(url, root)]
+        while level:
+            listings = await asyncio.gather(*[self.fetch_listing(session, scraper, folder_url) for folder_url, _ in level])
+            next_level = []
+            for (_, path), listing in zip(level, listings):
+                item_name = os.path.relpath(path, scraper.download_dir)
+                for file in scraper.extract_file_links(listing):
+                    file_name = scraper.sanitize_filename(file['name'])
+                    transfers.append(self.transfer(scraper, file['url'], os.path.join(path, file_name), item_name, '', file_name, file.get('size')))
+                for link in scraper.extract_links(listing):
+                    if link['url'] not in visited:
+                        visited.add(link['url'])
+                        next_level.append((link['url'], os.path.join(path, scraper.sanitize_filename(link['name']))))
+            level = next_level
+        return transfers
+
+    def transfer(self, scraper, url, path, item, season, file, size=None):
+        # size is the listed size, if known, which the scheduler counts against its byte budget
+        return {"scraper": scraper, "url": url, "path": path, "item": item, "season": season, "file": file, "size": size}
+
+    async def run_transfer(self, session, transfer):
+        with tracer.span("file", job=transfer["job"], job_span=transfer.get("job_span"), item=transfer["item"],
+                         season=transfer["season"], file=transfer["file"]) as span:
+            result = await transfer["scraper"].transfer_file(session, transfer["url"], transfer["path"], transfer["item"], transfer["season"], transfer.get("size"))
+            span.set(status=result["status"])
+        return {"job": transfer["job"], **result}
+
+    def summary(self, results, started):
+        counts = {"downloaded": 0, "skipped": 0, "failed": 0}
+        for result in results:
+            counts[result["status"]] += 1
+        failed_jobs = sum(1 for job in self.jobs if job["status"] == "failed")
+        return {
+            "ok": counts["failed"] == 0 and failed_jobs == 0,
+            "started_at": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(started)),
+            "duration_seconds": round(time.time() - started, 3),
+            "jobs": self.jobs,
+            "transfers": counts,
+            "downloaded_mb": round(sum(result.get("size_mb", 0) for result in results), 3),
+            "retry_counters": get_retry_policy().stats(),
+            "files": results
+        }
+
+async def run_batch(config, spec, download_dir=None, base_url=None, summary_path=None):
+    summary = await BatchRunner(config, spec, download_dir, base_url).run()
+    output = json.dumps(summary, indent=2)
+    if summary_path:
+        with open(summary_path, 'w') as f:
+            f.write(output)
+    else:
+        print(output)
+    return EXIT_OK if summary["ok"] else EXIT_FAILURES
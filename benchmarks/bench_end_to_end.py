@@ -0,0 +1,193 @@
+import argparse
+import asyncio
+import json
+import os
+import platform
+import resource
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from fake_site import add_site_arguments, site_arguments, site_options
+
+SCENARIOS = {
+    # download_file on its own, against the large range-capable files
+    "download": None,
+    # The scraper flows, driven through the batch runner's job format
+    "tv_show": {"category": "TV Shows", "query": "bench", "seasons": "all"},
+    "movie": {"category": "Movies", "query": "bench", "files": "all"},
+    "anime": {"category": "Anime", "query": "bench"}
+}
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def wait_for_port(port, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.5):
+                return True
+        except OSError:
+            time.sleep(0.1)
+    return False
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+async def run_downloads(base_url, concurrency, download_dir, options):
+    from file_downloader import download_file
+    from http_client import shared_session
+    from download_scheduler import scheduler
+    from concurrency_controller import concurrency_control
+
+    size = options["large_file_size_mb"] * 1024 * 1024
+
+    async def fetch(session, i):
+        async with scheduler.slot(size):
+            return await download_file(session, f"{base_url}/f/large/large{i}.bin", os.path.join(download_dir, f"large{i}.bin"), size)
+
+    async with concurrency_control(concurrency), shared_session() as session:
+        await asyncio.gather(*[fetch(session, i) for i in range(options["large_files"])])
+
+async def run_scenario(args):
+    # Runs in its own process, so ru_maxrss is the peak of this scenario alone
+    from app import apply_download_options
+    from batch_runner import BatchRunner
+    from metrics import metrics
+    from http_client import close_session
+
+    config = {
+        "base_url": args.base_url,
+        "downloads": {"segments": args.segments},
+        # Every run has to reach the server; cached listings would hide the fetch cost
+        "page_cache": {"enabled": False},
+        # Likewise, files from an earlier run must be downloaded again rather than linked
+        "dedup": {"enabled": False},
+        "progress": {"mode": "lines"}
+    }
+    apply_download_options(config)
+    download_dir = tempfile.mkdtemp(prefix="vadscrape-bench-")
+    concurrency = args.concurrency if args.concurrency == "auto" else int(args.concurrency)
+    started = time.perf_counter()
+    try:
+        if args.run == "download":
+            await run_downloads(args.base_url, concurrency, download_dir, site_options(args))
+        else:
+            spec = {"concurrency": concurrency, "jobs": [SCENARIOS[args.run]]}
+            await BatchRunner(config, spec, download_dir, args.base_url).run()
+        wall_time = time.perf_counter() - started
+    finally:
+        await close_session()
+        shutil.rmtree(download_dir, ignore_errors=True)
+
+    downloaded = metrics.bytes_downloaded.total()
+    fetches, fetch_time = metrics.listing_fetch.totals()
+    parses, parse_time = metrics.listing_parse.totals()
+    first_bytes, first_byte_time = metrics.first_byte.totals()
+    return {
+        "scenario": args.run,
+        "concurrency": args.concurrency,
+        "wall_seconds": round(wall_time, 3),
+        "downloaded_mb": round(downloaded / (1024 * 1024), 3),
+        "throughput_mbps": round(downloaded / (1024 * 1024) / wall_time, 3) if wall_time > 0 else 0,
+        "files_ok": metrics.downloads.total(result="ok"),
+        "files_failed": metrics.downloads.total(result="failed"),
+        "listing_fetches": fetches,
+        "listing_fetch_ms_mean": round(fetch_time / fetches * 1000, 3) if fetches else 0,
+        "parse_ms_total": round(parse_time * 1000, 3),
+        "parses": parses,
+        "first_byte_ms_mean": round(first_byte_time / first_bytes * 1000, 3) if first_bytes else 0,
+        "retries": metrics.retries.total(),
+        "peak_rss_mb": round(peak_rss_mb(), 1)
+    }
+
+def run_child(args, scenario, concurrency, base_url):
+    command = [sys.executable, os.path.abspath(__file__), "--run", scenario, "--concurrency", str(concurrency),
+               "--base-url", base_url, "--segments", str(args.segments)] + site_arguments(site_options(args))
+    result = subprocess.run(command, capture_output=True, text=True)
+    if result.returncode != 0:
+        print(result.stderr, file=sys.stderr)
+        return {"scenario": scenario, "concurrency": concurrency, "error": f"exit code {result.returncode}"}
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description="Time search, listing and download flows against a local stand-in server")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help=f"comma-separated, from {', '.join(SCENARIOS)}")
+    parser.add_argument("--concurrency", default="1,4,8", help="comma-separated levels; 'auto' is allowed")
+    parser.add_argument("--segments", type=int, default=1, help="connections per file")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    parser.add_argument("--output", help="also write the JSON results to this file")
+    parser.add_argument("--run", choices=list(SCENARIOS), help=argparse.SUPPRESS)
+    parser.add_argument("--base-url", help=argparse.SUPPRESS)
+    add_site_arguments(parser)
+    args = parser.parse_args()
+
+    if args.run:
+        import logging
+        logging.getLogger().setLevel(logging.WARNING)
+        print(json.dumps(asyncio.run(run_scenario(args))))
+        return 0
+
+    scenarios = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+    unknown = [name for name in scenarios if name not in SCENARIOS]
+    if unknown:
+        print(f"Unknown scenarios: {', '.join(unknown)}", file=sys.stderr)
+        return 2
+    levels = [level.strip() for level in args.concurrency.split(',') if level.strip()]
+
+    port = free_port()
+    server_command = [sys.executable, os.path.join(ROOT, "benchmarks", "fake_site.py"), "--port", str(port)] + site_arguments(site_options(args))
+    server = subprocess.Popen(server_command)
+    try:
+        if not wait_for_port(port):
+            print("Fake site did not start", file=sys.stderr)
+            return 1
+        base_url = f"http://127.0.0.1:{port}"
+        results = []
+        for scenario in scenarios:
+            for level in levels:
+                result = run_child(args, scenario, level, base_url)
+                results.append(result)
+                if not args.json:
+                    print(f"{scenario:<10}{level:>6}{result.get('wall_seconds', 0):>10.2f}s{result.get('throughput_mbps', 0):>10.1f} MB/s"
+                          f"{result.get('parse_ms_total', 0):>10.1f} ms parse{result.get('peak_rss_mb', 0):>9.1f} MB RSS"
+                          f"{'  ' + result['error'] if 'error' in result else ''}", file=sys.stderr)
+    finally:
+        server.terminate()
+        server.wait()
+
+    report = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "site": site_options(args),
+        "segments": args.segments,
+        "results": results
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    if args.json:
+        print(output)
+    return 1 if any("error" in result for result in results) else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
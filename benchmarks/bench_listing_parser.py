@@ -0,0 +1,100 @@
+import argparse
+import json
+import os
+import sys
+import time
+from urllib.parse import urljoin
+
+from bs4 import BeautifulSoup
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from scraper.listing_parser import parse_listing
+
+BASE_URL = "https://vadapav.mov"
+
+FIXTURES = {
+    "small_folder": (20, 40),
+    "large_season": (5, 2000),
+    "huge_franchise": (3000, 20000)
+}
+
+def build_listing_html(folders, files):
+    rows = ['<div class="centerflex name-div"><a href="/">Parent Directory</a></div>']
+    for i in range(folders):
+        rows.append(
+            f'<div class="directory-entry"><div class="centerflex name-div">'
+            f'<svg class="icon"></svg><a href="/d{i:05d}/"> Folder {i} <span>(2019)</span> </a></div></div>'
+        )
+    for i in range(files):
+        rows.append(
+            f'<div class="file-row"><a class="file-entry wrap" href="/f{i:06d}">'
+            f'Show.S01E{i:04d}.1080p.WEB-DL.mkv</a><div class="size">1.2 GB</div></div>'
+        )
+    return f"<!DOCTYPE html><html><head><title>Index</title></head><body><main>{''.join(rows)}</main></body></html>"
+
+def soup_listing(html):
+    # The extraction the scrapers used before listing_parser, kept as the baseline
+    soup = BeautifulSoup(html, 'html.parser')
+    links = []
+    for element in soup.find_all('div', class_='centerflex name-div'):
+        link = element.find('a', href=True)
+        if link:
+            name = link.get_text(separator=' ', strip=True)
+            if name.lower() != "parent directory":
+                links.append({'name': name, 'url': urljoin(BASE_URL, link['href'])})
+    files = [
+        {'name': element.get_text(separator=' ', strip=True), 'url': urljoin(BASE_URL, element['href'])}
+        for element in soup.find_all('a', class_='file-entry wrap')
+    ]
+    return links, files
+
+def lxml_listing(html):
+    listing = parse_listing(html, BASE_URL)
+    return listing.links, listing.files
+
+def same_entries(soup_result, lxml_result):
+    # The baseline predates listed file sizes, so only names and URLs are compared
+    def key(result):
+        return [[(entry['name'], entry['url']) for entry in entries] for entries in result]
+    return key(soup_result) == key(lxml_result)
+
+def time_parser(parser, html, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        parser(html)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare listing extraction with BeautifulSoup and lxml")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    results = {}
+    for name, (folders, files) in FIXTURES.items():
+        html = build_listing_html(folders, files)
+        if not same_entries(soup_listing(html), lxml_listing(html)):
+            print(f"Parsers disagree on fixture {name}", file=sys.stderr)
+            return 1
+        soup_time = time_parser(soup_listing, html, args.repeat)
+        lxml_time = time_parser(lxml_listing, html, args.repeat)
+        results[name] = {
+            "entries": folders + files,
+            "html_kb": len(html) / 1024,
+            "soup_ms": soup_time * 1000,
+            "lxml_ms": lxml_time * 1000,
+            "speedup": soup_time / lxml_time if lxml_time > 0 else 0
+        }
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print(f"{'fixture':<16}{'entries':>9}{'html KB':>10}{'soup ms':>10}{'lxml ms':>10}{'speedup':>9}")
+        for name, result in results.items():
+            print(f"{name:<16}{result['entries']:>9}{result['html_kb']:>10.0f}{result['soup_ms']:>10.1f}{result['lxml_ms']:>10.1f}{result['speedup']:>8.1f}x")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,167 @@
+import argparse
+import asyncio
+import hashlib
+import random
+import re
+from email.utils import formatdate
+from urllib.parse import quote, unquote
+
+from aiohttp import web
+
+# Stands in for the real site: /s/<query> search pages, /d/... folders made of
+# "centerflex name-div" entries and /f/... files behind "file-entry wrap"
+# links. Every folder has the same shape, so a search result works as a TV
+# show (subfolders are seasons), a movie (its own files) or an anime tree.
+
+DEFAULT_SITE_OPTIONS = {
+    "results": 3,
+    "folders": 3,
+    "depth": 2,
+    "files": 4,
+    "file_size_mb": 8,
+    "latency_ms": 20.0,
+    # Per connection; 0 is unlimited
+    "bandwidth_mbps": 0.0,
+    "large_files": 4,
+    "large_file_size_mb": 64
+}
+
+CHUNK_SIZE = 256 * 1024
+PATTERN_SIZE = 1024 * 1024
+LAST_MODIFIED = formatdate(1700000000, usegmt=True)
+
+def file_pattern(name):
+    # Each file repeats its own random megabyte, so contents differ between files and are cheap to serve
+    return random.Random(name).getrandbits(PATTERN_SIZE * 8).to_bytes(PATTERN_SIZE, 'little')
+
+def listing_html(dirs, files):
+    rows = ['<div class="centerflex name-div"><a href="/">Parent Directory</a></div>']
+    for name, href in dirs:
+        rows.append(f'<div class="directory-entry"><div class="centerflex name-div"><svg class="icon"></svg><a href="{href}"> {name} </a></div></div>')
+    for name, href in files:
+        rows.append(f'<div class="file-row"><a class="file-entry wrap" href="{href}">{name}</a><div class="size">1.2 GB</div></div>')
+    return f"<!DOCTYPE html><html><head><title>Index</title></head><body><main>{''.join(rows)}</main></body></html>"
+
+class FakeSite:
+    def __init__(self, **options):
+        self.options = dict(DEFAULT_SITE_OPTIONS, **{key: value for key, value in options.items() if value is not None})
+        self.patterns = {}
+        self.requests = {"search": 0, "listing": 0, "file": 0, "head": 0}
+
+    def app(self):
+        app = web.Application()
+        app.router.add_get('/s/{query}', self.search)
+        app.router.add_get('/d/{path:.*}', self.listing)
+        app.router.add_get('/f/{path:.*}', self.file)
+        app.router.add_get('/stats', self.stats)
+        return app
+
+    async def delay(self):
+        if self.options["latency_ms"]:
+            await asyncio.sleep(self.options["latency_ms"] / 1000)
+
+    def listing_response(self, request, html):
+        # Listings are deterministic, so a hash of the page is a stable ETag for conditional requests
+        etag = '"' + hashlib.md5(html.encode()).hexdigest() + '"'
+        if request.headers.get('If-None-Match') == etag:
+            return web.Response(status=304, headers={'ETag': etag})
+        return web.Response(text=html, content_type='text/html', headers={'ETag': etag})
+
+    async def search(self, request):
+        self.requests["search"] += 1
+        await self.delay()
+        query = request.match_info['query']
+        dirs = [(f"{query} {i}", f"/d/{quote(query)}-{i}/") for i in range(self.options["results"])]
+        return self.listing_response(request, listing_html(dirs, []))
+
+    async def listing(self, request):
+        self.requests["listing"] += 1
+        await self.delay()
+        parts = [part for part in request.match_info['path'].split('/') if part]
+        if parts == ["large"]:
+            files = [(f"large{i}.bin", f"/f/large/large{i}.bin") for i in range(self.options["large_files"])]
+            return self.listing_response(request, listing_html([], files))
+        base = "/" + "/".join(parts) + "/" if parts else "/"
+        dirs = []
+        if len(parts) < self.options["depth"]:
+            dirs = [(f"Season {i + 1}", f"/d{base}s{i + 1}/") for i in range(self.options["folders"])]
+        files = [(f"E{i + 1:03d}.mkv", f"/f{base}E{i + 1:03d}.mkv") for i in range(self.options["files"])]
+        return self.listing_response(request, listing_html(dirs, files))
+
+    def file_size(self, path):
+        if path.startswith("large/"):
+            return self.options["large_file_size_mb"] * 1024 * 1024
+        return self.options["file_size_mb"] * 1024 * 1024
+
+    async def file(self, request):
+        path = unquote(request.match_info['path'])
+        size = self.file_size(path)
+        etag = '"' + hashlib.md5(path.encode()).hexdigest() + '"'
+        headers = {'Accept-Ranges': 'bytes', 'ETag': etag, 'Last-Modified': LAST_MODIFIED}
+        await self.delay()
+        if request.method == 'HEAD':
+            self.requests["head"] += 1
+            return web.Response(headers=dict(headers, **{'Content-Length': str(size)}))
+
+        self.requests["file"] += 1
+        start, end, status = 0, size - 1, 200
+        match = re.match(r'bytes=(\d+)-(\d*)$', request.headers.get('Range', ''))
+        if match:
+            start = int(match.group(1))
+            end = min(int(match.group(2)), size - 1) if match.group(2) else size - 1
+            if start >= size:
+                return web.Response(status=416, headers={'Content-Range': f'bytes */{size}'})
+            status = 206
+            headers['Content-Range'] = f'bytes {start}-{end}/{size}'
+        headers['Content-Length'] = str(end - start + 1)
+
+        if path not in self.patterns:
+            self.patterns[path] = file_pattern(path)
+        pattern = self.patterns[path]
+        response = web.StreamResponse(status=status, headers=headers)
+        await response.prepare(request)
+        rate = self.options["bandwidth_mbps"] * 1024 * 1024
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        sent = 0
+        position = start
+        try:
+            while position <= end:
+                offset = position % PATTERN_SIZE
+                length = min(CHUNK_SIZE, end - position + 1, PATTERN_SIZE - offset)
+                await response.write(pattern[offset:offset + length])
+                position += length
+                sent += length
+                if rate:
+                    ahead = sent / rate - (loop.time() - started)
+                    if ahead > 0:
+                        await asyncio.sleep(ahead)
+            await response.write_eof()
+        except ConnectionError:
+            # Segmented downloads drop the open-ended probe once their range is read
+            pass
+        return response
+
+    async def stats(self, request):
+        return web.json_response(self.requests)
+
+def add_site_arguments(parser):
+    for key, value in DEFAULT_SITE_OPTIONS.items():
+        parser.add_argument(f"--{key.replace('_', '-')}", type=type(value), default=None, help=f"default {value}")
+
+def site_options(args):
+    return {key: DEFAULT_SITE_OPTIONS[key] if getattr(args, key) is None else getattr(args, key) for key in DEFAULT_SITE_OPTIONS}
+
+def site_arguments(options):
+    return [argument for key, value in options.items() for argument in (f"--{key.replace('_', '-')}", str(value))]
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve a local stand-in for the video site")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8766)
+    add_site_arguments(parser)
+    args = parser.parse_args()
+    web.run_app(FakeSite(**site_options(args)).app(), host=args.host, port=args.port, print=None, access_log=None)
+
+if __name__ == "__main__":
+    main()
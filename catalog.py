@@ -0,0 +1,338 @@
+import asyncio
+import hashlib
+import logging
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+from urllib.parse import urljoin, urlparse
+from scraper.listing_parser import Listing, parse_listing
+from tracing import tracer
+
+DEFAULT_CATALOG_SETTINGS = {
+    # Answer searches from the catalog once it has been built
+    "enabled": False,
+    "database": "catalog.db",
+    # Where the crawl starts, relative to base_url
+    "root": "/",
+    "concurrency": 4,
+    # Directories checked more recently than this are not revalidated by a refresh (0 checks them all)
+    "refresh_hours": 0,
+    "search_limit": 100
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    id INTEGER PRIMARY KEY,
+    parent INTEGER,
+    path TEXT NOT NULL UNIQUE,
+    name TEXT NOT NULL,
+    is_dir INTEGER NOT NULL,
+    size INTEGER,
+    depth INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_parent ON entries (parent);
+CREATE TABLE IF NOT EXISTS directories (
+    entry_id INTEGER PRIMARY KEY,
+    etag TEXT,
+    last_modified TEXT,
+    digest TEXT,
+    checked_at REAL,
+    changed_at REAL
+);
+"""
+
+# Trigram tokens let any 3+ character substring of a name match through the index
+FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS names USING fts5(name, content='entries', content_rowid='id', tokenize='trigram');
+CREATE TRIGGER IF NOT EXISTS entries_insert AFTER INSERT ON entries BEGIN
+    INSERT INTO names (rowid, name) VALUES (new.id, new.name);
+END;
+CREATE TRIGGER IF NOT EXISTS entries_delete AFTER DELETE ON entries BEGIN
+    INSERT INTO names (names, rowid, name) VALUES ('delete', old.id, old.name);
+END;
+CREATE TRIGGER IF NOT EXISTS entries_update AFTER UPDATE OF name ON entries BEGIN
+    INSERT INTO names (names, rowid, name) VALUES ('delete', old.id, old.name);
+    INSERT INTO names (rowid, name) VALUES (new.id, new.name);
+END;
+"""
+
+# Ids of a folder and everything below it, following parent links
+SUBTREE_IDS = ("WITH RECURSIVE subtree(id) AS (SELECT ? UNION ALL "
+               "SELECT entries.id FROM entries JOIN subtree ON entries.parent = subtree.id) SELECT id FROM subtree")
+SUBTREE = ("WITH RECURSIVE subtree(id) AS (SELECT id FROM entries WHERE path = ? UNION ALL "
+           "SELECT entries.id FROM entries JOIN subtree ON entries.parent = subtree.id) SELECT id FROM subtree")
+
+def listing_digest(links, files):
+    digest = hashlib.sha1()
+    for entry in sorted(links + files, key=lambda entry: entry['url']):
+        digest.update(f"{entry['url']}\0{entry['name']}\0{entry.get('size')}\n".encode())
+    return digest.hexdigest()
+
+class Catalog:
+    # Local copy of the site's directory tree: one row per file or folder,
+    # keyed on its URL path, with an FTS5 trigram index on names. Like the
+    # history store, each call opens its own short-lived connection.
+    def __init__(self, settings=None):
+        self.settings = dict(DEFAULT_CATALOG_SETTINGS)
+        self.fts = None
+        self.configure(settings)
+
+    def configure(self, settings):
+        self.settings.update({key: value for key, value in (settings or {}).items() if key in DEFAULT_CATALOG_SETTINGS})
+        self.db_path = os.path.expanduser(self.settings["database"])
+        self.fts = None
+
+    @property
+    def enabled(self):
+        return self.settings["enabled"] and os.path.exists(self.db_path)
+
+    @contextmanager
+    def connect(self):
+        if self.fts is None:
+            self.initialize()
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA synchronous=NORMAL")
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def initialize(self):
+        os.makedirs(os.path.dirname(self.db_path) or '.', exist_ok=True)
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            with conn:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.executescript(SCHEMA)
+            try:
+                with conn:
+                    conn.executescript(FTS_SCHEMA)
+                self.fts = True
+            except sqlite3.OperationalError as e:
+                # SQLite before 3.34 has no trigram tokenizer; searches fall back to LIKE
+                logging.warning(f"Catalog name index unavailable ({e}); searches will scan every name")
+                self.fts = False
+        finally:
+            conn.close()
+
+    # Queries
+
+    def count(self):
+        with self.connect() as conn:
+            return conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    def entry(self, path):
+        with self.connect() as conn:
+            row = conn.execute("SELECT * FROM entries WHERE path = ?", (path,)).fetchone()
+            return dict(row) if row else None
+
+    def children(self, path):
+        # Folders first, then files, each by name; None when the folder is not in the catalog
+        with self.connect() as conn:
+            parent = conn.execute("SELECT id FROM entries WHERE path = ? AND is_dir = 1", (path,)).fetchone()
+            if parent is None:
+                return None
+            rows = conn.execute("SELECT * FROM entries WHERE parent = ? ORDER BY is_dir DESC, name", (parent[0],))
+            return [dict(row) for row in rows]
+
+    def search(self, query, below=None, dirs_only=False, limit=None):
+        # Shallow matches first, so a show's folder comes before its episodes.
+        # Paths on the site need not nest, so "below" follows parent links.
+        limit = limit or self.settings["search_limit"]
+        scope, params = "", []
+        if below is not None:
+            scope = f"AND entries.id IN ({SUBTREE}) AND entries.path != ?"
+            params = [below, below]
+        if dirs_only:
+            scope += " AND entries.is_dir = 1"
+        with self.connect() as conn:
+            if self.fts and len(query) >= 3:
+                phrase = '"' + query.replace('"', '""') + '"'
+                rows = conn.execute(
+                    f"SELECT entries.* FROM names JOIN entries ON entries.id = names.rowid "
+                    f"WHERE names MATCH ? {scope} ORDER BY entries.depth, rank LIMIT ?", [phrase] + params + [limit])
+            else:
+                escaped = query.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+                rows = conn.execute(
+                    f"SELECT entries.* FROM entries WHERE entries.name LIKE ? ESCAPE '\\' {scope} "
+                    f"ORDER BY entries.depth, entries.name LIMIT ?", [f"%{escaped}%"] + params + [limit])
+            return [dict(row) for row in rows]
+
+    def search_listing(self, query, base_url):
+        # A search page answered locally, in the same shape parse_listing gives the scrapers
+        if not self.enabled:
+            return None
+        started = time.perf_counter()
+        links = [{'name': row['name'], 'url': urljoin(base_url, row['path'])} for row in self.search(query, dirs_only=True)]
+        logging.info(f"Catalog search for {query!r}: {len(links)} folders in {(time.perf_counter() - started) * 1000:.1f} ms")
+        return Listing(links, [])
+
+    # Crawling
+
+    def directory(self, path):
+        with self.connect() as conn:
+            row = conn.execute("SELECT entries.id, entries.depth, directories.* FROM entries "
+                               "LEFT JOIN directories ON directories.entry_id = entries.id WHERE entries.path = ?", (path,)).fetchone()
+            return dict(row) if row else None
+
+    def ancestors(self, entry_id):
+        with self.connect() as conn:
+            return {row[0] for row in conn.execute(
+                "WITH RECURSIVE chain(id, parent, path) AS (SELECT id, parent, path FROM entries WHERE id = ? "
+                "UNION ALL SELECT entries.id, entries.parent, entries.path FROM entries JOIN chain ON entries.id = chain.parent) "
+                "SELECT path FROM chain", (entry_id,))}
+
+    def trail(self, entry_id, below):
+        # The folders between below and the entry, outermost first, as (path, name)
+        with self.connect() as conn:
+            rows = conn.execute(
+                "WITH RECURSIVE chain(id, parent, path, name, level) AS (SELECT id, parent, path, name, 0 FROM entries WHERE id = ? "
+                "UNION ALL SELECT entries.id, entries.parent, entries.path, entries.name, chain.level + 1 FROM entries "
+                "JOIN chain ON entries.id = chain.parent WHERE chain.path != ?) "
+                "SELECT path, name FROM chain WHERE level > 0 AND path != ? ORDER BY level DESC", (entry_id, below, below)).fetchall()
+        return [(row[0], row[1]) for row in rows]
+
+    def child_directories(self, entry_id):
+        with self.connect() as conn:
+            return [row[0] for row in conn.execute("SELECT path FROM entries WHERE parent = ? AND is_dir = 1", (entry_id,))]
+
+    def ensure_root(self, path):
+        with self.connect() as conn:
+            conn.execute("INSERT OR IGNORE INTO entries (parent, path, name, is_dir, depth) VALUES (NULL, ?, ?, 1, 0)", (path, path))
+
+    def mark_checked(self, entry_id, headers=None):
+        with self.connect() as conn:
+            conn.execute("INSERT INTO directories (entry_id, checked_at) VALUES (?, ?) "
+                         "ON CONFLICT (entry_id) DO UPDATE SET checked_at = excluded.checked_at", (entry_id, time.time()))
+            if headers is not None:
+                conn.execute("UPDATE directories SET etag = ?, last_modified = ? WHERE entry_id = ?",
+                             (headers.get("ETag"), headers.get("Last-Modified"), entry_id))
+
+    def store_listing(self, directory, entries, digest, headers):
+        # Replaces a folder's children with a new listing. Rows that are still
+        # listed keep their ids, and with them the validators of subfolders;
+        # folders that disappeared take their whole subtree with them.
+        # Returns (added, removed).
+        parent_id = directory["id"]
+        with self.connect() as conn:
+            existing = {row["path"]: dict(row) for row in conn.execute("SELECT id, path, name, is_dir, size FROM entries WHERE parent = ?", (parent_id,))}
+            listed = {entry["path"] for entry in entries}
+            removed = 0
+            for path, row in existing.items():
+                if path in listed:
+                    continue
+                if row["is_dir"]:
+                    subtree = [subtree_row[0] for subtree_row in conn.execute(SUBTREE_IDS, (row["id"],))]
+                    conn.executemany("DELETE FROM directories WHERE entry_id = ?", [(entry_id,) for entry_id in subtree])
+                    conn.executemany("DELETE FROM entries WHERE id = ?", [(entry_id,) for entry_id in subtree])
+                    removed += len(subtree)
+                else:
+                    removed += conn.execute("DELETE FROM entries WHERE id = ?", (row["id"],)).rowcount
+            added = 0
+            for entry in entries:
+                row = existing.get(entry["path"])
+                if row is None:
+                    # A folder linked from two places stays with the first parent that listed it
+                    added += conn.execute("INSERT OR IGNORE INTO entries (parent, path, name, is_dir, size, depth) VALUES (?, ?, ?, ?, ?, ?)",
+                                          (parent_id, entry["path"], entry["name"], entry["is_dir"], entry["size"], directory["depth"] + 1)).rowcount
+                elif (row["name"], row["size"]) != (entry["name"], entry["size"]):
+                    conn.execute("UPDATE entries SET name = ?, size = ? WHERE id = ?", (entry["name"], entry["size"], row["id"]))
+            now = time.time()
+            conn.execute("INSERT OR REPLACE INTO directories (entry_id, etag, last_modified, digest, checked_at, changed_at) "
+                         "VALUES (?, ?, ?, ?, ?, ?)",
+                         (parent_id, headers.get("ETag"), headers.get("Last-Modified"), digest, now, now))
+        return added, removed
+
+    async def crawl(self, session, fetch_text, base_url):
+        # Walks the tree from the root with a bounded pool of workers. Each folder
+        # is revalidated with its stored ETag / Last-Modified; a 304, or a body
+        # that lists the same entries, leaves its rows untouched. Subfolders are
+        # always visited, since a change deep in the tree does not show in its parents.
+        root = urlparse(urljoin(base_url, self.settings["root"])).path or "/"
+        await asyncio.to_thread(self.ensure_root, root)
+        stats = {"folders": 0, "unchanged": 0, "changed": 0, "fresh": 0, "failed": 0, "added": 0, "removed": 0, "requests": 0}
+        fresh_after = time.time() - self.settings["refresh_hours"] * 3600 if self.settings["refresh_hours"] else None
+        queue = asyncio.Queue()
+        queue.put_nowait(root)
+        seen = {root}
+
+        async def visit(path):
+            directory = await asyncio.to_thread(self.directory, path)
+            stats["folders"] += 1
+            if fresh_after is not None and (directory.get("checked_at") or 0) > fresh_after:
+                stats["fresh"] += 1
+                return await asyncio.to_thread(self.child_directories, directory["id"])
+            conditional_headers = {}
+            if directory.get("etag"):
+                conditional_headers["If-None-Match"] = directory["etag"]
+            if directory.get("last_modified"):
+                conditional_headers["If-Modified-Since"] = directory["last_modified"]
+            stats["requests"] += 1
+            result = await fetch_text(session, urljoin(base_url, path), conditional_headers)
+            if result is None:
+                stats["failed"] += 1
+                return await asyncio.to_thread(self.child_directories, directory["id"])
+            status, text, headers = result
+            if text is None:
+                stats["unchanged"] += 1
+                await asyncio.to_thread(self.mark_checked, directory["id"])
+                return await asyncio.to_thread(self.child_directories, directory["id"])
+            listing = parse_listing(text, base_url)
+            links, files = listing.links, listing.files
+            digest = listing_digest(links, files)
+            if digest == directory.get("digest"):
+                stats["unchanged"] += 1
+                await asyncio.to_thread(self.mark_checked, directory["id"], headers)
+                return await asyncio.to_thread(self.child_directories, directory["id"])
+            stats["changed"] += 1
+            # Links back up the tree are not children
+            ancestors = await asyncio.to_thread(self.ancestors, directory["id"])
+            entries = []
+            for link in links:
+                link_path = urlparse(link['url']).path
+                if link_path not in ancestors and urljoin(base_url, link_path).startswith(base_url):
+                    entries.append({"path": link_path, "name": link['name'], "is_dir": 1, "size": None})
+            for file in files:
+                entries.append({"path": urlparse(file['url']).path, "name": file['name'], "is_dir": 0, "size": file['size']})
+            added, removed = await asyncio.to_thread(self.store_listing, directory, entries, digest, headers)
+            stats["added"] += added
+            stats["removed"] += removed
+            return [entry["path"] for entry in entries if entry["is_dir"]]
+
+        async def worker():
+            while True:
+                path = await queue.get()
+                try:
+                    for child in await visit(path):
+                        if child not in seen:
+                            seen.add(child)
+                            queue.put_nowait(child)
+                except Exception as e:
+                    stats["failed"] += 1
+                    logging.error(f"Catalog crawl failed at {path}: {e}")
+                finally:
+                    queue.task_done()
+
+        started = time.monotonic()
+        with tracer.span("catalog_crawl", root=root):
+            workers = [asyncio.create_task(worker()) for _ in range(max(1, self.settings["concurrency"]))]
+            try:
+                await queue.join()
+            finally:
+                for task in workers:
+                    task.cancel()
+                await asyncio.gather(*workers, return_exceptions=True)
+        stats["seconds"] = round(time.monotonic() - started, 3)
+        stats["entries"] = await asyncio.to_thread(self.count)
+        return stats
+
+catalog = Catalog()
+
+def configure_catalog(settings):
+    catalog.configure(settings)
+
+def get_catalog():
+    return catalog
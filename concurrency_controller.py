@@ -0,0 +1,160 @@
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
+from download_scheduler import scheduler
+
+AUTO = 'auto'
+
+DEFAULT_AUTO_CONCURRENCY_SETTINGS = {
+    "min_active": 1,
+    "max_active": 16,
+    "start_active": 2,
+    "interval_seconds": 5,
+    # Throughput must beat the best seen so far by this fraction to count as an improvement
+    "gain_threshold": 0.05,
+    # Falling this fraction below the best while every slot is busy counts as congestion
+    "drop_tolerance": 0.25,
+    "decrease_factor": 0.5,
+    # Flat intervals before probing one slot higher anyway
+    "probe_intervals": 3,
+    # Weight of the newest sample in the smoothed throughput
+    "smoothing": 0.5
+}
+
+class ConcurrencyController:
+    # Additive increase / multiplicative decrease on the scheduler's transfer
+    # limit. Every interval the bytes counted by the download loops become a
+    # throughput sample, compared with the best throughput seen and the limit
+    # that reached it: one more slot while it keeps improving, back to that
+    # limit when extra slots add nothing, a cut on 429s, stalls or a sharp drop,
+    # and no change when there is no queued work to add.
+    def __init__(self, settings=None):
+        self.settings = dict(DEFAULT_AUTO_CONCURRENCY_SETTINGS)
+        self.configure(settings)
+        self.limit = self.settings["start_active"]
+        self.bytes = 0
+        self.congestion = None
+        self.best_throughput = 0
+        self.best_limit = self.limit
+        self.smoothed = 0
+        self.flat_intervals = 0
+        self.task = None
+
+    def configure(self, settings):
+        self.settings.update({key: value for key, value in (settings or {}).items() if key in DEFAULT_AUTO_CONCURRENCY_SETTINGS})
+
+    @property
+    def running(self):
+        return self.task is not None
+
+    def record_bytes(self, amount):
+        self.bytes += amount
+
+    def record_congestion(self, reason):
+        if self.running and self.congestion is None:
+            self.congestion = reason
+
+    async def start(self):
+        if self.running:
+            return
+        self.limit = max(self.settings["min_active"], min(self.settings["max_active"], self.settings["start_active"]))
+        self.bytes = 0
+        self.congestion = None
+        self.best_throughput = 0
+        self.best_limit = self.limit
+        self.smoothed = 0
+        self.flat_intervals = 0
+        await scheduler.set_limits(max_active=self.limit)
+        logging.info(f"Auto concurrency: starting with {self.limit} transfers")
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if not self.running:
+            return
+        self.task.cancel()
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+        self.task = None
+
+    async def _run(self):
+        last_sample = time.monotonic()
+        while True:
+            await asyncio.sleep(self.settings["interval_seconds"])
+            now = time.monotonic()
+            throughput = self.bytes / (now - last_sample)
+            self.bytes = 0
+            last_sample = now
+            await self.adjust(throughput)
+
+    def saturated(self):
+        # More work is queued than the current limit admits
+        return scheduler.active >= scheduler.max_active and bool(scheduler.waiting)
+
+    def decide(self, throughput, saturated):
+        limit = self.limit
+        settings = self.settings
+        decreased = max(settings["min_active"], int(limit * settings["decrease_factor"]))
+        if self.congestion:
+            return decreased, f"{self.congestion}, backing off"
+        if not saturated:
+            return limit, "no queued transfers"
+        if self.best_throughput and throughput < self.best_throughput * (1 - settings["drop_tolerance"]):
+            return decreased, "throughput fell"
+        if throughput > self.best_throughput * (1 + settings["gain_threshold"]):
+            return min(settings["max_active"], limit + 1), "throughput improving"
+        if limit > self.best_limit:
+            return self.best_limit, f"no gain above {self.best_limit} transfers"
+        if self.flat_intervals + 1 >= settings["probe_intervals"]:
+            return min(settings["max_active"], limit + 1), "throughput flat, probing"
+        return limit, "throughput flat"
+
+    async def adjust(self, sample):
+        weight = self.settings["smoothing"]
+        self.smoothed = sample if not self.smoothed else weight * sample + (1 - weight) * self.smoothed
+        throughput = self.smoothed
+        old_limit = self.limit
+        new_limit, reason = self.decide(throughput, self.saturated())
+        speed = throughput / (1024 * 1024)
+        if reason == "throughput improving":
+            self.best_throughput = throughput
+            self.best_limit = old_limit
+        elif new_limit < old_limit and new_limit != self.best_limit:
+            # Conditions changed; start measuring again at the lower limit rather than chase the old peak
+            self.best_throughput = 0
+            self.best_limit = new_limit
+            self.smoothed = 0
+        self.congestion = None
+
+        if new_limit != old_limit:
+            logging.info(f"Auto concurrency: {old_limit} -> {new_limit} transfers ({reason}, {speed:.2f} MB/s)")
+            self.flat_intervals = 0
+            self.limit = new_limit
+            await scheduler.set_limits(max_active=new_limit)
+        else:
+            logging.debug(f"Auto concurrency: holding at {old_limit} transfers ({reason}, {speed:.2f} MB/s)")
+            if reason == "throughput flat":
+                self.flat_intervals += 1
+
+controller = ConcurrencyController()
+
+def configure_auto_concurrency(settings):
+    controller.configure(settings)
+
+def get_controller():
+    return controller
+
+@asynccontextmanager
+async def concurrency_control(concurrency):
+    # A number fixes the transfer limit; AUTO lets the controller manage it for the run
+    if concurrency == AUTO:
+        await controller.start()
+        try:
+            yield
+        finally:
+            await controller.stop()
+    else:
+        await scheduler.set_limits(max_active=concurrency)
+        yield
@@ -21,6 +21,104 @@ def create_config():
             "TV Shows": os.path.expanduser("~/Videos/TV Shows"),
             "Movies": os.path.expanduser("~/Videos/Movies"),
             "Anime": os.path.expanduser("~/Videos/Anime")
+        },
+        "downloads": {
+            "segments": 1,
+            "min_segment_size_mb": 16
+        },
+        "http": {
+            "limit": 64,
+            "limit_per_host": 16,
+            "keepalive_timeout": 60,
+            "dns_cache_ttl": 300,
+            "connect_timeout": 30,
+            "request_timeout": 300,
+            "read_timeout": 60
+        },
+        "disk": {
+            "writer_threads": 4,
+            "queue_size_mb": 16,
+            "coalesce_mb": 8,
+            "fsync_interval_mb": 64
+        },
+        "scheduler": {
+            "max_bytes_in_flight_mb": 0,
+            "unknown_size_mb": 1024
+        },
+        "bandwidth": {
+            "global_limit_mbps": 0,
+            "per_host_limit_mbps": 0,
+            "schedule": []
+        },
+        "auto_concurrency": {
+            "min_active": 1,
+            "max_active": 16,
+            "start_active": 2,
+            "interval_seconds": 5
+        },
+        "retry": {
+            "base_delay": 1,
+            "max_delay": 300,
+            "breaker_threshold": 5,
+            "breaker_cooldown": 30
+        },
+        "daemon": {
+            "database": "download_queue.db",
+            "host": "127.0.0.1",
+            "port": 8780,
+            "concurrency": 2,
+            "listing_workers": 2
+        },
+        "page_cache": {
+            "enabled": True,
+            "directory": ".cache/pages",
+            "memory_entries": 256,
+            "default_ttl": 600,
+            "max_age_days": 7,
+            "ttl_rules": [
+                {"pattern": "/s/", "ttl": 300}
+            ]
+        },
+        "progress": {
+            "mode": "auto",
+            "refresh_interval": 0.5,
+            "summary_interval": 10,
+            "max_rows": 8
+        },
+        "metrics": {
+            "listen": False,
+            "host": "127.0.0.1",
+            "port": 9108,
+            "file": "",
+            "write_interval": 15
+        },
+        "tracing": {
+            "enabled": False,
+            "file": "trace.jsonl"
+        },
+        "dedup": {
+            "enabled": False,
+            "index_file": ".cache/content_index.db",
+            "extra_roots": [],
+            "link": "auto",
+            "min_size_mb": 1,
+            "samples": 4,
+            "sample_kb": 64,
+            "rescan_minutes": 60
+        },
+        "follow": {
+            "database": "follows.db",
+            "recheck_seasons": 1,
+            "interval_minutes": 0,
+            "concurrency": 2
+        },
+        "catalog": {
+            "enabled": False,
+            "database": "catalog.db",
+            "root": "/",
+            "concurrency": 4,
+            "refresh_hours": 0,
+            "search_limit": 100
         }
     }
     save_config(config)
@@ -35,6 +133,8 @@ def modify_config(config):
     print(f"Base URL: {config['base_url']}")
     for category, path in config['download_paths'].items():
         print(f"{category}: {path}")
+    print(f"Download segments: {config.get('downloads', {}).get('segments', 1)}")
+    print(f"Bandwidth limit: {config.get('bandwidth', {}).get('global_limit_mbps', 0) or 'unlimited'} MB/s")
 
     while True:
         print(f"\n{Fore.YELLOW}Options:{Style.RESET_ALL}")
@@ -42,9 +142,11 @@ def modify_config(config):
         print(f"{Fore.CYAN}2. Modify existing category{Style.RESET_ALL}")
         print(f"{Fore.CYAN}3. Add new category{Style.RESET_ALL}")
         print(f"{Fore.CYAN}4. Remove category{Style.RESET_ALL}")
-        print(f"{Fore.CYAN}5. Save and exit{Style.RESET_ALL}")
+        print(f"{Fore.CYAN}5. Change download segments per file{Style.RESET_ALL}")
+        print(f"{Fore.CYAN}6. Change bandwidth limit{Style.RESET_ALL}")
+        print(f"{Fore.CYAN}7. Save and exit{Style.RESET_ALL}")
 
-        choice = input(f"\n{Fore.YELLOW}Enter your choice (1-5): {Style.RESET_ALL}").strip()
+        choice = input(f"\n{Fore.YELLOW}Enter your choice (1-7): {Style.RESET_ALL}").strip()
 
         if choice == '1':
             config['base_url'] = input(f"{Fore.YELLOW}Enter new base URL: {Style.RESET_ALL}").strip()
@@ -66,6 +168,20 @@ def modify_config(config):
             else:
                 print(f"{Fore.RED}Category not found.{Style.RESET_ALL}")
         elif choice == '5':
+            segments = input(f"{Fore.YELLOW}Enter number of parallel segments per file (1 to disable): {Style.RESET_ALL}").strip()
+            if segments.isdigit() and int(segments) >= 1:
+                config.setdefault('downloads', {})['segments'] = int(segments)
+            else:
+                print(f"{Fore.RED}Invalid number of segments.{Style.RESET_ALL}")
+        elif choice == '6':
+            limit = input(f"{Fore.YELLOW}Enter total bandwidth limit in MB/s (0 for unlimited): {Style.RESET_ALL}").strip()
+            try:
+                if float(limit) < 0:
+                    raise ValueError
+                config.setdefault('bandwidth', {})['global_limit_mbps'] = float(limit)
+            except ValueError:
+                print(f"{Fore.RED}Invalid bandwidth limit.{Style.RESET_ALL}")
+        elif choice == '7':
             save_config(config)
             break
         else:
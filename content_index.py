@@ -0,0 +1,315 @@
+import asyncio
+import errno
+import hashlib
+import logging
+import os
+import shutil
+import sqlite3
+import time
+from contextlib import contextmanager
+from retry_policy import retry_policy
+from disk_writer import run_in_writer
+from tracing import tracer
+
+DEFAULT_DEDUP_SETTINGS = {
+    # Opt-in: a match is linked into place rather than fetched
+    "enabled": False,
+    "index_file": ".cache/content_index.db",
+    # Scanned in addition to every download_paths entry
+    "extra_roots": [],
+    # "auto" tries a reflink, then a hardlink; "copy" also works across filesystems
+    "link": "auto",
+    "min_size_mb": 1,
+    "samples": 4,
+    "sample_kb": 64,
+    "rescan_minutes": 60
+}
+
+LINK_MODES = ("auto", "reflink", "hardlink", "copy")
+
+# Linux ioctl that shares a file's extents with another (btrfs, XFS, bcachefs)
+FICLONE = 0x40049409
+
+# Left behind by interrupted downloads; never complete content
+PARTIAL_SUFFIXES = (".tmp", ".manifest", ".link")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    digest TEXT
+);
+CREATE INDEX IF NOT EXISTS files_size ON files (size);
+"""
+
+def sample_offsets(size, samples, sample_size):
+    # Evenly spaced blocks from the first byte to the last, so a file that differs
+    # in its header, tail or body almost always changes the digest
+    if size <= sample_size * samples:
+        return [(0, size)]
+    step = (size - sample_size) // (samples - 1)
+    return [(i * step, sample_size) for i in range(samples)]
+
+def digest_samples(size, blocks, samples, sample_size):
+    digest = hashlib.sha256(str(size).encode())
+    for block in blocks:
+        digest.update(block)
+    # The sampling parameters are part of the key, so changing them never matches old digests
+    return f"{samples}x{sample_size}:{digest.hexdigest()}"
+
+def local_digest(path, size, samples, sample_size):
+    blocks = []
+    with open(path, 'rb') as f:
+        for offset, length in sample_offsets(size, samples, sample_size):
+            f.seek(offset)
+            blocks.append(f.read(length))
+    return digest_samples(size, blocks, samples, sample_size)
+
+def reflink(source, target):
+    import fcntl
+    with open(source, 'rb') as src, open(target, 'wb') as dst:
+        fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+
+def link_file(source, target, mode):
+    # Returns how the copy was made. The new name appears atomically, so a
+    # half-made link never looks like a finished download.
+    temp_path = f"{target}.link"
+    attempts = ["reflink", "hardlink"] if mode == "auto" else [mode]
+    for method in attempts:
+        try:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            if method == "reflink":
+                reflink(source, temp_path)
+            elif method == "hardlink":
+                os.link(source, temp_path)
+            else:
+                shutil.copyfile(source, temp_path)
+            os.replace(temp_path, target)
+            return method
+        except (OSError, ImportError) as e:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            if method != attempts[-1]:
+                continue
+            if isinstance(e, OSError) and e.errno not in (errno.EXDEV, errno.EPERM, errno.ENOTSUP, errno.EOPNOTSUPP, errno.EINVAL, errno.ENOTTY):
+                logging.warning(f"Cannot link {source} to {target}: {e}")
+    return None
+
+class ContentIndex:
+    # Every finished file under the download roots, keyed on size. Digests of
+    # local files are computed lazily, the first time a remote file of the
+    # same size turns up, and kept until the file's size or mtime changes.
+    # Like the history store, each call opens its own short-lived connection.
+    def __init__(self, db_path):
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        with self.connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+
+    @contextmanager
+    def connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA synchronous=NORMAL")
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def scan(self, roots, min_size):
+        # Brings the index in line with the roots using stat() only; digests survive when nothing changed
+        started = time.monotonic()
+        seen = {}
+        for root in roots:
+            for directory, _, names in os.walk(root):
+                for name in names:
+                    if name.endswith(PARTIAL_SUFFIXES) or ".tmp.part" in name:
+                        continue
+                    path = os.path.join(directory, name)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    if stat.st_size >= min_size:
+                        seen[path] = (stat.st_size, stat.st_mtime)
+        with self.connect() as conn:
+            known = {row["path"]: (row["size"], row["mtime"]) for row in conn.execute("SELECT path, size, mtime FROM files")}
+            prefixes = tuple(os.path.join(root, '') for root in roots)
+            gone = [(path,) for path in known if path.startswith(prefixes) and path not in seen]
+            changed = [(path, size, mtime) for path, (size, mtime) in seen.items() if known.get(path) != (size, mtime)]
+            conn.executemany("DELETE FROM files WHERE path = ?", gone)
+            conn.executemany("INSERT OR REPLACE INTO files (path, size, mtime, digest) VALUES (?, ?, ?, NULL)", changed)
+        logging.info(f"Content index: {len(seen)} files under {len(roots)} roots, {len(changed)} new or changed, "
+                     f"{len(gone)} removed ({time.monotonic() - started:.1f}s)")
+
+    def add(self, path, digest=None):
+        try:
+            stat = os.stat(path)
+            with self.connect() as conn:
+                conn.execute("INSERT OR REPLACE INTO files (path, size, mtime, digest) VALUES (?, ?, ?, ?)",
+                             (path, stat.st_size, stat.st_mtime, digest))
+        except (OSError, sqlite3.Error) as e:
+            logging.error(f"Error adding {path} to the content index: {e}")
+
+    def has_size(self, size):
+        with self.connect() as conn:
+            return conn.execute("SELECT 1 FROM files WHERE size = ? LIMIT 1", (size,)).fetchone() is not None
+
+    def find(self, size, digest, samples, sample_size):
+        # The first indexed file that still exists unchanged and has this digest
+        with self.connect() as conn:
+            rows = [dict(row) for row in conn.execute("SELECT * FROM files WHERE size = ?", (size,))]
+        for row in rows:
+            try:
+                stat = os.stat(row["path"])
+            except OSError:
+                stat = None
+            if stat is None or (stat.st_size, stat.st_mtime) != (row["size"], row["mtime"]):
+                with self.connect() as conn:
+                    conn.execute("DELETE FROM files WHERE path = ?", (row["path"],))
+                if stat is not None and stat.st_size == size:
+                    row.update(mtime=stat.st_mtime, digest=None)
+                else:
+                    continue
+            if row["digest"] is None or not row["digest"].startswith(f"{samples}x{sample_size}:"):
+                try:
+                    row["digest"] = local_digest(row["path"], size, samples, sample_size)
+                except OSError:
+                    continue
+                self.add(row["path"], row["digest"])
+            if row["digest"] == digest:
+                return row["path"]
+        return None
+
+class Deduplicator:
+    def __init__(self, settings=None):
+        self.settings = dict(DEFAULT_DEDUP_SETTINGS)
+        self.roots = []
+        self.index = None
+        self.scanned_at = None
+        self.scan_lock = None
+        self.linked = 0
+        self.saved_bytes = 0
+        self.configure(settings)
+
+    def configure(self, settings, roots=None):
+        self.settings.update({key: value for key, value in (settings or {}).items() if key in DEFAULT_DEDUP_SETTINGS})
+        if self.settings["link"] not in LINK_MODES:
+            logging.warning(f"Unknown dedup link mode {self.settings['link']!r}; using auto")
+            self.settings["link"] = "auto"
+        if roots is not None:
+            self.roots = sorted({os.path.abspath(os.path.expanduser(root)) for root in list(roots) + list(self.settings["extra_roots"])})
+        self.index = None
+        self.scanned_at = None
+
+    def add_roots(self, roots):
+        # For download directories chosen at run time; a new root is scanned before the next lookup
+        new = {os.path.abspath(os.path.expanduser(root)) for root in roots} - set(self.roots)
+        if new:
+            self.roots = sorted(set(self.roots) | new)
+            self.scanned_at = None
+
+    @property
+    def sample_size(self):
+        return self.settings["sample_kb"] * 1024
+
+    async def ensure_index(self):
+        if self.index is None:
+            self.index = await asyncio.to_thread(ContentIndex, os.path.expanduser(self.settings["index_file"]))
+        if self.scan_lock is None:
+            self.scan_lock = asyncio.Lock()
+        async with self.scan_lock:
+            stale = self.scanned_at is None or time.monotonic() - self.scanned_at > self.settings["rescan_minutes"] * 60
+            if stale:
+                roots = [root for root in self.roots if os.path.isdir(root)]
+                await asyncio.to_thread(self.index.scan, roots, self.settings["min_size_mb"] * 1024 * 1024)
+                self.scanned_at = time.monotonic()
+        return self.index
+
+    async def fetch_range(self, session, url, offset, length, headers):
+        # Returns (block, total size), or None when the server ignores ranges
+        await retry_policy.before_request(url)
+        range_headers = dict(headers, Range=f"bytes={offset}-{offset + length - 1}")
+        async with session.get(url, headers=range_headers) as response:
+            if response.status == 429:
+                # Pauses the host like any other 429; the transfer itself then waits it out
+                wait_time = retry_policy.on_throttle(url, response)
+                logging.warning(f"Rate limit exceeded during duplicate check. Waiting for {wait_time:.1f} seconds before downloading.")
+                return None
+            if response.status != 206:
+                return None
+            content_range = response.headers.get('Content-Range', '')
+            total = content_range.rpartition('/')[2]
+            if not total.isdigit():
+                return None
+            block = await response.read()
+            if len(block) != min(length, int(total) - offset):
+                return None
+            retry_policy.on_success(url)
+            return block, int(total)
+
+    async def remote_digest(self, session, url, size, headers):
+        samples, sample_size = self.settings["samples"], self.sample_size
+        blocks = []
+        for offset, length in sample_offsets(size, samples, sample_size):
+            fetched = await self.fetch_range(session, url, offset, length, headers)
+            if fetched is None or fetched[1] != size:
+                return None
+            blocks.append(fetched[0])
+        return digest_samples(size, blocks, samples, sample_size)
+
+    async def link_existing(self, session, url, path, size, headers):
+        # Once the exact remote size is known, either remembered from an earlier
+        # download or from the transfer's own first response: if a file with
+        # the same size and sampled digest is already in the library, link it
+        # into place and return its path. Adds no request when no indexed file
+        # has that size, and a few small range requests when one does.
+        if not self.settings["enabled"] or not size or os.path.exists(path) or os.path.exists(f"{path}.tmp"):
+            return None
+        if size < self.settings["min_size_mb"] * 1024 * 1024:
+            return None
+        try:
+            with tracer.span("dedup", file=os.path.basename(path)) as span:
+                index = await self.ensure_index()
+                if not await asyncio.to_thread(index.has_size, size):
+                    return None
+                digest = await self.remote_digest(session, url, size, headers)
+                if digest is None:
+                    return None
+                source = await asyncio.to_thread(index.find, size, digest, self.settings["samples"], self.sample_size)
+                if source is None or os.path.abspath(source) == os.path.abspath(path):
+                    return None
+                os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+                method = await run_in_writer(link_file, source, path, self.settings["link"])
+                if method is None:
+                    return None
+                span.set(method=method, size=size)
+                await asyncio.to_thread(index.add, os.path.abspath(path), digest)
+        except Exception as e:
+            logging.warning(f"Duplicate check failed for {url}: {e}")
+            return None
+        self.linked += 1
+        self.saved_bytes += size
+        logging.info(f"Already have {os.path.basename(path)} as {source}; {method} instead of downloading")
+        return path
+
+    async def add(self, path):
+        # Called after a finished download; the digest is left for the first lookup that needs it
+        if not self.settings["enabled"] or not os.path.exists(path):
+            return
+        if os.path.getsize(path) < self.settings["min_size_mb"] * 1024 * 1024:
+            return
+        index = await self.ensure_index()
+        await asyncio.to_thread(index.add, os.path.abspath(path))
+
+deduplicator = Deduplicator()
+
+def configure_dedup(settings, roots=None):
+    deduplicator.configure(settings, roots)
+
+def get_deduplicator():
+    return deduplicator
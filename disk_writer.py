@@ -0,0 +1,131 @@
+import asyncio
+import os
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+CHUNK_SIZE = 1024 * 1024
+
+DEFAULT_DISK_SETTINGS = {
+    "writer_threads": 4,
+    "queue_size_mb": 16,
+    "coalesce_mb": 8,
+    "fsync_interval_mb": 64
+}
+
+disk_settings = dict(DEFAULT_DISK_SETTINGS)
+_executor = None
+
+def configure_disk_writer(settings):
+    global _executor
+    disk_settings.update({key: value for key, value in (settings or {}).items() if key in DEFAULT_DISK_SETTINGS})
+    if _executor is not None:
+        _executor.shutdown(wait=False)
+        _executor = None
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=disk_settings["writer_threads"], thread_name_prefix="disk-writer")
+    return _executor
+
+async def run_in_writer(func, *args):
+    return await asyncio.get_running_loop().run_in_executor(get_executor(), func, *args)
+
+class AsyncFileWriter:
+    # Chunks go through a bounded queue to a writer thread. When the disk falls
+    # behind the queue fills up and write() blocks the network reader feeding it.
+    # An optional resume manifest hashes the data as it is written and is saved
+    # right after each fsync, so it never vouches for bytes that are not on disk.
+    def __init__(self, path, mode, manifest=None):
+        self.path = path
+        self.mode = mode
+        self.manifest = manifest
+        self.file = None
+        self.position = 0
+        self.error = None
+        self.queue = asyncio.Queue(maxsize=max(1, disk_settings["queue_size_mb"] * 1024 * 1024 // CHUNK_SIZE))
+        self.task = None
+
+    async def __aenter__(self):
+        self.file = await run_in_writer(open, self.path, self.mode, 0)
+        self.position = self.file.seek(0, os.SEEK_END)
+        self.task = asyncio.create_task(self._drain())
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    def tell(self):
+        return self.position
+
+    async def write(self, chunk):
+        if self.error:
+            raise self.error
+        await self.queue.put(chunk)
+        self.position += len(chunk)
+
+    async def close(self):
+        if self.task is None:
+            return
+        await self.queue.put(None)
+        # Queued chunks are still a valid prefix for resume, so flush them even when cancelled
+        await asyncio.shield(self.task)
+        self.task = None
+        if self.error:
+            raise self.error
+
+    async def _drain(self):
+        coalesce_size = disk_settings["coalesce_mb"] * 1024 * 1024
+        fsync_interval = disk_settings["fsync_interval_mb"] * 1024 * 1024
+        unsynced = 0
+        closing = False
+        while not closing:
+            batch = []
+            batch_size = 0
+            chunk = await self.queue.get()
+            while True:
+                if chunk is None:
+                    closing = True
+                    break
+                batch.append(chunk)
+                batch_size += len(chunk)
+                if batch_size >= coalesce_size or self.queue.empty():
+                    break
+                chunk = self.queue.get_nowait()
+
+            if self.error or not batch:
+                continue
+            unsynced += batch_size
+            sync = closing or unsynced >= fsync_interval
+            try:
+                await run_in_writer(self._write_batch, batch, sync)
+                if sync:
+                    unsynced = 0
+            except OSError as e:
+                logging.error(f"Error writing to {self.path}: {e}")
+                self.error = e
+
+        try:
+            await run_in_writer(self._finish, unsynced > 0 and not self.error)
+        except OSError as e:
+            self.error = self.error or e
+
+    def _write_batch(self, batch, sync):
+        payload = memoryview(b''.join(batch))
+        data = payload
+        while data:
+            written = self.file.write(data)
+            data = data[written:]
+        if self.manifest is not None:
+            self.manifest.update(payload)
+        if sync:
+            os.fsync(self.file.fileno())
+            if self.manifest is not None:
+                self.manifest.save()
+
+    def _finish(self, sync):
+        if sync:
+            os.fsync(self.file.fileno())
+        self.file.close()
+        if self.manifest is not None:
+            self.manifest.save()
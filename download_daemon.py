@@ -0,0 +1,471 @@
+import asyncio
+import json
+import logging
+import os
+import signal
+import sqlite3
+import time
+from contextlib import contextmanager
+from aiohttp import web
+from http_client import shared_session
+from download_scheduler import scheduler
+from concurrency_controller import concurrency_control
+from batch_runner import BatchRunner, JobFileError, validate_job
+from metrics import handle_metrics
+from tracing import tracer
+from transfer_control import transfers, ACTIONS
+
+DEFAULT_DAEMON_SETTINGS = {
+    "database": "download_queue.db",
+    "host": "127.0.0.1",
+    "port": 8780,
+    "concurrency": 2,
+    "listing_workers": 2
+}
+
+# Job states, in order. Failed and cancelled are the other terminal states.
+PENDING = "pending"
+LISTING = "listing"
+DOWNLOADING = "downloading"
+VERIFYING = "verifying"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED = (DONE, FAILED, CANCELLED)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY,
+    spec TEXT NOT NULL,
+    state TEXT NOT NULL DEFAULT 'pending',
+    priority INTEGER NOT NULL DEFAULT 0,
+    paused INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    created_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    job_id INTEGER NOT NULL REFERENCES jobs (id),
+    category TEXT NOT NULL,
+    url TEXT NOT NULL,
+    path TEXT NOT NULL,
+    item TEXT NOT NULL,
+    season TEXT NOT NULL DEFAULT '',
+    file TEXT NOT NULL,
+    size INTEGER,
+    state TEXT NOT NULL DEFAULT 'pending',
+    size_mb REAL,
+    error TEXT,
+    UNIQUE (job_id, url)
+);
+CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, priority);
+CREATE INDEX IF NOT EXISTS files_job_state ON files (job_id, state);
+"""
+
+def now():
+    return time.strftime("%Y-%m-%d %H:%M:%S")
+
+class JobQueue:
+    # Durable queue in SQLite, following HistoryStore: WAL mode and a
+    # short-lived connection per call. Every state change is committed before
+    # the work it describes starts, so a killed process loses nothing.
+    def __init__(self, db_path):
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        with self.connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+            # Queues created before listed sizes were kept
+            if "size" not in {row["name"] for row in conn.execute("PRAGMA table_info(files)")}:
+                conn.execute("ALTER TABLE files ADD COLUMN size INTEGER")
+
+    @contextmanager
+    def connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA synchronous=NORMAL")
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def enqueue(self, job, priority=0):
+        with self.connect() as conn:
+            cursor = conn.execute(
+                "INSERT INTO jobs (spec, priority, created_at, updated_at) VALUES (?, ?, ?, ?)",
+                (json.dumps(job), priority, now(), now())
+            )
+            return cursor.lastrowid
+
+    def recover(self):
+        # Work that was in flight when the process died goes back to the queue
+        with self.connect() as conn:
+            jobs = conn.execute("UPDATE jobs SET state = ?, updated_at = ? WHERE state = ?", (PENDING, now(), LISTING)).rowcount
+            jobs += conn.execute("UPDATE jobs SET state = ?, updated_at = ? WHERE state = ?", (DOWNLOADING, now(), VERIFYING)).rowcount
+            files = conn.execute("UPDATE files SET state = ? WHERE state IN (?, ?)", (PENDING, DOWNLOADING, VERIFYING)).rowcount
+        return jobs, files
+
+    def job(self, job_id):
+        with self.connect() as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            return self._job_dict(conn, row) if row else None
+
+    def jobs(self, include_finished=True):
+        query = "SELECT * FROM jobs"
+        if not include_finished:
+            query += f" WHERE state NOT IN ({', '.join('?' * len(FINISHED))})"
+        with self.connect() as conn:
+            rows = conn.execute(query + " ORDER BY priority DESC, id", () if include_finished else FINISHED).fetchall()
+            return [self._job_dict(conn, row) for row in rows]
+
+    def _job_dict(self, conn, row):
+        job = dict(row)
+        job["spec"] = json.loads(job["spec"])
+        job["paused"] = bool(job["paused"])
+        job["files"] = {state: count for state, count in conn.execute(
+            "SELECT state, COUNT(*) FROM files WHERE job_id = ? GROUP BY state", (row["id"],)
+        )}
+        return job
+
+    def set_state(self, job_id, state, error=None):
+        with self.connect() as conn:
+            conn.execute("UPDATE jobs SET state = ?, error = ?, updated_at = ? WHERE id = ?", (state, error, now(), job_id))
+
+    def update(self, job_id, **fields):
+        assignments = ', '.join(f"{key} = ?" for key in fields)
+        with self.connect() as conn:
+            return conn.execute(
+                f"UPDATE jobs SET {assignments}, updated_at = ? WHERE id = ?", (*fields.values(), now(), job_id)
+            ).rowcount
+
+    def next_job_to_list(self):
+        with self.connect() as conn:
+            row = conn.execute(
+                "SELECT id, spec FROM jobs WHERE state = ? AND paused = 0 ORDER BY priority DESC, id LIMIT 1", (PENDING,)
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute("UPDATE jobs SET state = ?, updated_at = ? WHERE id = ?", (LISTING, now(), row["id"]))
+            return row["id"], json.loads(row["spec"])
+
+    def add_files(self, job_id, category, transfers):
+        with self.connect() as conn:
+            conn.executemany(
+                "INSERT OR IGNORE INTO files (job_id, category, url, path, item, season, file, size) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [(job_id, category, t["url"], t["path"], t["item"], t["season"], t["file"], t.get("size")) for t in transfers]
+            )
+            conn.execute("UPDATE jobs SET state = ?, updated_at = ? WHERE id = ? AND state = ?", (DOWNLOADING, now(), job_id, LISTING))
+
+    def next_files(self, limit, exclude):
+        # Highest-priority job first, then queue order within a job
+        with self.connect() as conn:
+            rows = conn.execute(
+                "SELECT files.* FROM files JOIN jobs ON jobs.id = files.job_id "
+                "WHERE files.state = ? AND jobs.state = ? AND jobs.paused = 0 "
+                "ORDER BY jobs.priority DESC, jobs.id, files.id LIMIT ?",
+                (PENDING, DOWNLOADING, limit + len(exclude))
+            ).fetchall()
+            return [dict(row) for row in rows if row["id"] not in exclude][:limit]
+
+    def set_file_state(self, file_id, state, size_mb=None, error=None):
+        with self.connect() as conn:
+            conn.execute("UPDATE files SET state = ?, size_mb = COALESCE(?, size_mb), error = ? WHERE id = ?",
+                         (state, size_mb, error, file_id))
+
+    def cancel_files(self, job_id):
+        with self.connect() as conn:
+            conn.execute("UPDATE files SET state = ? WHERE job_id = ? AND state NOT IN (?, ?)", (CANCELLED, job_id, DONE, FAILED))
+
+    def finish_jobs(self):
+        # A downloading job whose files have all settled is verified: every file
+        # marked done must still be on disk, otherwise it is queued again
+        finished = []
+        with self.connect() as conn:
+            for row in conn.execute("SELECT id FROM jobs WHERE state = ?", (DOWNLOADING,)).fetchall():
+                counts = dict(conn.execute("SELECT state, COUNT(*) FROM files WHERE job_id = ? GROUP BY state", (row["id"],)).fetchall())
+                if counts.get(PENDING) or counts.get(DOWNLOADING) or counts.get(VERIFYING):
+                    continue
+                conn.execute("UPDATE jobs SET state = ?, updated_at = ? WHERE id = ?", (VERIFYING, now(), row["id"]))
+                missing = [
+                    file["id"] for file in conn.execute("SELECT id, path FROM files WHERE job_id = ? AND state = ?", (row["id"], DONE))
+                    if not os.path.exists(file["path"])
+                ]
+                if missing:
+                    logging.warning(f"Job {row['id']}: {len(missing)} downloaded files are missing; queueing them again")
+                    conn.executemany("UPDATE files SET state = ? WHERE id = ?", [(PENDING, file_id) for file_id in missing])
+                    conn.execute("UPDATE jobs SET state = ?, updated_at = ? WHERE id = ?", (DOWNLOADING, now(), row["id"]))
+                    continue
+                state = FAILED if counts.get(FAILED) else DONE
+                error = f"{counts[FAILED]} files failed" if counts.get(FAILED) else None
+                conn.execute("UPDATE jobs SET state = ?, error = ?, updated_at = ? WHERE id = ?", (state, error, now(), row["id"]))
+                finished.append((row["id"], state))
+        return finished
+
+class DownloadDaemon:
+    def __init__(self, config, settings=None, download_dir=None, base_url=None):
+        self.settings = dict(DEFAULT_DAEMON_SETTINGS)
+        self.settings.update({key: value for key, value in (settings or {}).items() if key in DEFAULT_DAEMON_SETTINGS})
+        self.queue = JobQueue(self.settings["database"])
+        self.runner = BatchRunner(config, {"jobs": []}, download_dir, base_url)
+        self.active = {}
+        self.active_files = {}
+        self.interrupted = set()
+        # Files skipped or cancelled on their own, with the reason recorded against them
+        self.dropped = {}
+        self.listing = {}
+        self.wake = None
+        self.stopping = None
+
+    def notify(self):
+        if self.wake is not None:
+            self.wake.set()
+
+    async def run(self):
+        self.wake = asyncio.Event()
+        self.stopping = asyncio.Event()
+        jobs, files = self.queue.recover()
+        if jobs or files:
+            logging.info(f"Recovered {jobs} interrupted jobs and {files} interrupted files")
+
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, self.stopping.set)
+            except (NotImplementedError, RuntimeError):
+                pass
+
+        api = web.AppRunner(self.control_app())
+        await api.setup()
+        await web.TCPSite(api, self.settings["host"], self.settings["port"]).start()
+        logging.info(f"Download daemon listening on http://{self.settings['host']}:{self.settings['port']}")
+
+        try:
+            async with concurrency_control(self.settings["concurrency"]), shared_session() as session:
+                while not self.stopping.is_set():
+                    self.wake.clear()
+                    self.start_listing(session)
+                    self.start_downloads(session)
+                    for job_id, state in self.queue.finish_jobs():
+                        logging.info(f"Job {job_id} {state}")
+                    waiters = [asyncio.create_task(self.wake.wait()), asyncio.create_task(self.stopping.wait())]
+                    await asyncio.wait(waiters, timeout=5, return_when=asyncio.FIRST_COMPLETED)
+                    for waiter in waiters:
+                        waiter.cancel()
+                logging.info("Stopping download daemon")
+                await self.cancel_tasks(list(self.active) + list(self.listing))
+        finally:
+            await api.cleanup()
+
+    def start_listing(self, session):
+        while len(self.listing) < self.settings["listing_workers"]:
+            claimed = self.queue.next_job_to_list()
+            if claimed is None:
+                return
+            job_id, job = claimed
+            self.listing[("job", job_id)] = asyncio.create_task(self.list_job(session, job_id, job))
+
+    async def list_job(self, session, job_id, job):
+        try:
+            with tracer.span("job", job=job_id, category=job.get("category", "TV Shows"), query=job.get("query")):
+                selected, transfers = await self.runner.resolve(session, job)
+            self.queue.add_files(job_id, job.get("category", "TV Shows"), transfers)
+            logging.info(f"Job {job_id}: {len(transfers)} files queued from {selected['name']}")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.error(f"Job {job_id} failed while listing: {e}")
+            self.queue.set_state(job_id, FAILED, str(e))
+        finally:
+            self.listing.pop(("job", job_id), None)
+            self.interrupted.discard(("job", job_id))
+            self.notify()
+
+    def start_downloads(self, session):
+        # Keep one file queued behind each transfer slot so the scheduler never idles
+        free = scheduler.max_active + 1 - len(self.active)
+        if free <= 0:
+            return
+        for file in self.queue.next_files(free, set(self.active)):
+            self.queue.set_file_state(file["id"], DOWNLOADING)
+            self.active_files[file["id"]] = file
+            self.active[file["id"]] = asyncio.create_task(self.download(session, file))
+
+    async def download(self, session, file):
+        transfer = {
+            "job": file["job_id"],
+            "scraper": self.runner.scraper_for(file["category"]),
+            "url": file["url"],
+            "path": file["path"],
+            "item": file["item"],
+            "season": file["season"],
+            "file": file["file"],
+            # The listed size, so the scheduler counts this transfer at its real size
+            "size": file["size"]
+        }
+        try:
+            result = await self.runner.run_transfer(session, transfer)
+            if file["id"] in self.interrupted or file["id"] in self.dropped:
+                # download_file reports a cancelled transfer as a plain failure, and a skipped one as skipped
+                self.requeue(file)
+                return
+            if result["status"] == "failed":
+                self.queue.set_file_state(file["id"], FAILED, error=result.get("error", "download failed"))
+                return
+            self.queue.set_file_state(file["id"], VERIFYING)
+            if os.path.exists(file["path"]) and os.path.getsize(file["path"]) > 0 and not os.path.exists(f"{file['path']}.tmp"):
+                self.queue.set_file_state(file["id"], DONE, size_mb=os.path.getsize(file["path"]) / (1024 * 1024))
+            else:
+                self.queue.set_file_state(file["id"], FAILED, error="file missing or empty after download")
+        except asyncio.CancelledError:
+            self.requeue(file)
+            raise
+        finally:
+            self.active.pop(file["id"], None)
+            self.active_files.pop(file["id"], None)
+            self.interrupted.discard(file["id"])
+            self.dropped.pop(file["id"], None)
+            self.notify()
+
+    def requeue(self, file):
+        # Paused, cancelled or shutting down; the partial .tmp stays for the next attempt
+        if file["id"] in self.dropped:
+            self.queue.set_file_state(file["id"], CANCELLED, error=self.dropped[file["id"]])
+            return
+        cancelled = self.queue.job(file["job_id"])["state"] == CANCELLED
+        self.queue.set_file_state(file["id"], CANCELLED if cancelled else PENDING)
+
+    async def cancel_tasks(self, keys):
+        tasks = [task for key, task in list(self.active.items()) + list(self.listing.items()) if key in keys]
+        self.interrupted.update(keys)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def stop_job_work(self, job_id):
+        keys = [file_id for file_id, file in self.active_files.items() if file["job_id"] == job_id]
+        keys += [key for key in self.listing if key == ("job", job_id)]
+        await self.cancel_tasks(keys)
+
+    def control_app(self):
+        app = web.Application()
+        app.router.add_get('/jobs', self.handle_list)
+        app.router.add_post('/jobs', self.handle_enqueue)
+        app.router.add_get('/jobs/{id:\\d+}', self.handle_get)
+        app.router.add_post('/jobs/{id:\\d+}/pause', self.handle_pause)
+        app.router.add_post('/jobs/{id:\\d+}/resume', self.handle_resume)
+        app.router.add_post('/jobs/{id:\\d+}/priority', self.handle_priority)
+        app.router.add_post('/jobs/{id:\\d+}/cancel', self.handle_cancel)
+        app.router.add_get('/files', self.handle_files)
+        app.router.add_post('/files/{id:\\d+}/{action}', self.handle_file_action)
+        app.router.add_get('/metrics', handle_metrics)
+        return app
+
+    async def handle_list(self, request):
+        return web.json_response(self.queue.jobs(include_finished=request.query.get('all') == '1'))
+
+    async def handle_get(self, request):
+        job = self.queue.job(int(request.match_info['id']))
+        if job is None:
+            raise web.HTTPNotFound()
+        return web.json_response(job)
+
+    async def handle_enqueue(self, request):
+        try:
+            body = await request.json()
+            jobs = body.get("jobs", [body]) if isinstance(body, dict) else body
+            for i, job in enumerate(jobs, 1):
+                validate_job(job, i)
+        except (ValueError, AttributeError, JobFileError) as e:
+            return web.json_response({"error": str(e)}, status=400)
+        ids = [self.queue.enqueue(job, job.get("priority", 0)) for job in jobs]
+        logging.info(f"Queued jobs {ids}")
+        self.notify()
+        return web.json_response({"ids": ids}, status=201)
+
+    async def handle_pause(self, request):
+        job_id = int(request.match_info['id'])
+        if not self.queue.update(job_id, paused=1):
+            raise web.HTTPNotFound()
+        await self.stop_job_work(job_id)
+        self.reset_listing_state(job_id)
+        return web.json_response(self.queue.job(job_id))
+
+    async def handle_resume(self, request):
+        job_id = int(request.match_info['id'])
+        if not self.queue.update(job_id, paused=0):
+            raise web.HTTPNotFound()
+        self.notify()
+        return web.json_response(self.queue.job(job_id))
+
+    async def handle_priority(self, request):
+        job_id = int(request.match_info['id'])
+        try:
+            priority = int((await request.json())["priority"])
+        except (ValueError, KeyError, TypeError) as e:
+            return web.json_response({"error": f"expected {{\"priority\": <number>}}: {e}"}, status=400)
+        if not self.queue.update(job_id, priority=priority):
+            raise web.HTTPNotFound()
+        self.notify()
+        return web.json_response(self.queue.job(job_id))
+
+    async def handle_cancel(self, request):
+        job_id = int(request.match_info['id'])
+        job = self.queue.job(job_id)
+        if job is None:
+            raise web.HTTPNotFound()
+        if job["state"] not in FINISHED:
+            self.queue.set_state(job_id, CANCELLED)
+            await self.stop_job_work(job_id)
+            self.queue.cancel_files(job_id)
+        self.notify()
+        return web.json_response(self.queue.job(job_id))
+
+    async def handle_files(self, request):
+        # Files being transferred right now, with their live transfer state
+        files = []
+        for file_id, file in list(self.active_files.items()):
+            handle = transfers.for_path(file["path"])
+            progress_bar = handle.progress if handle else None
+            files.append({
+                "id": file_id,
+                "job": file["job_id"],
+                "file": file["file"],
+                "state": handle.state if handle else "queued",
+                "bytes": progress_bar.done if progress_bar else 0,
+                "total": progress_bar.total if progress_bar else None
+            })
+        return web.json_response(files)
+
+    async def handle_file_action(self, request):
+        # Pause and resume hold the transfer in place and last only while it
+        # runs; job pause is the durable one. Skip and cancel drop just this
+        # file and keep its partial data.
+        file_id = int(request.match_info['id'])
+        action = request.match_info['action']
+        if action not in ACTIONS:
+            raise web.HTTPNotFound()
+        file = self.active_files.get(file_id)
+        if file is None:
+            return web.json_response({"error": f"file {file_id} is not being transferred"}, status=409)
+        handle = transfers.for_path(file["path"])
+        if action in ("skip", "cancel"):
+            self.dropped[file_id] = "skipped" if action == "skip" else "cancelled"
+            if handle is not None:
+                getattr(handle, action)()
+            else:
+                # Still waiting for a transfer slot
+                self.active[file_id].cancel()
+        elif handle is None or not getattr(handle, action)():
+            return web.json_response({"error": f"cannot {action} file {file_id} now"}, status=409)
+        return web.json_response({"id": file_id, "action": action})
+
+    def reset_listing_state(self, job_id):
+        # A job paused mid-listing is listed again from scratch when resumed
+        job = self.queue.job(job_id)
+        if job and job["state"] == LISTING:
+            self.queue.set_state(job_id, PENDING)
+
+async def run_daemon(config, download_dir=None, base_url=None):
+    await DownloadDaemon(config, config.get('daemon', {}), download_dir, base_url).run()
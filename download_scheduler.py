@@ -0,0 +1,94 @@
+import asyncio
+import itertools
+import logging
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from tracing import tracer
+
+# Counted against the byte budget for a file whose size is not known yet
+DEFAULT_SIZE_ESTIMATE = 1024 * 1024 * 1024
+
+class DownloadScheduler:
+    # One budget for every transfer in the process. Work is admitted in
+    # submission order, so a large file waiting for bytes cannot be starved by
+    # small ones that would fit.
+    def __init__(self, max_active=1, max_bytes_in_flight=0, size_estimate=DEFAULT_SIZE_ESTIMATE):
+        self.max_active = max(1, max_active)
+        self.max_bytes_in_flight = max_bytes_in_flight
+        self.size_estimate = size_estimate
+        self.active = 0
+        self.bytes_in_flight = 0
+        self.waiting = deque()
+        self.tickets = itertools.count()
+        self.condition = None
+        self.condition_loop = None
+
+    def _get_condition(self):
+        loop = asyncio.get_running_loop()
+        if self.condition is None or self.condition_loop is not loop:
+            self.condition = asyncio.Condition()
+            self.condition_loop = loop
+        return self.condition
+
+    def _can_start(self, ticket, size):
+        if not self.waiting or self.waiting[0] != ticket:
+            return False
+        if self.active >= self.max_active:
+            return False
+        if self.max_bytes_in_flight and self.active > 0:
+            return self.bytes_in_flight + size <= self.max_bytes_in_flight
+        return True
+
+    async def set_limits(self, max_active=None, max_bytes_in_flight=None):
+        if max_active is not None:
+            self.max_active = max(1, max_active)
+        if max_bytes_in_flight is not None:
+            self.max_bytes_in_flight = max_bytes_in_flight
+        logging.debug(f"Scheduler limits: {self.max_active} transfers, {self.max_bytes_in_flight} bytes in flight")
+        condition = self._get_condition()
+        async with condition:
+            condition.notify_all()
+
+    async def acquire(self, size=0):
+        condition = self._get_condition()
+        ticket = next(self.tickets)
+        async with condition:
+            self.waiting.append(ticket)
+            try:
+                await condition.wait_for(lambda: self._can_start(ticket, size))
+            finally:
+                self.waiting.remove(ticket)
+                condition.notify_all()
+            self.active += 1
+            self.bytes_in_flight += size
+
+    async def release(self, size=0):
+        condition = self._get_condition()
+        async with condition:
+            self.active -= 1
+            self.bytes_in_flight -= size
+            condition.notify_all()
+
+    @asynccontextmanager
+    async def slot(self, size=0):
+        # An unknown size still takes its share of the byte budget
+        size = size or self.size_estimate
+        started = time.monotonic()
+        await self.acquire(size)
+        waited = time.monotonic() - started
+        if waited > 0.001:
+            tracer.record("queue_wait", waited)
+        try:
+            yield
+        finally:
+            await self.release(size)
+
+    async def submit(self, func, *args, size=0):
+        async with self.slot(size):
+            return await func(*args)
+
+scheduler = DownloadScheduler()
+
+def get_scheduler():
+    return scheduler
@@ -1,24 +1,42 @@
 import aiohttp
 import os
-from tqdm.asyncio import tqdm as tqdm_asyncio
+from http_client import get_session
+from disk_writer import AsyncFileWriter, CHUNK_SIZE, run_in_writer
+from resume_manifest import ResumeManifest, BLOCK_SIZE, prepare_resume
+from rate_limiter import rate_limiter
+from concurrency_controller import controller
+from retry_policy import retry_policy
+from progress import progress
+from metrics import metrics
+from tracing import tracer
+from content_index import deduplicator
+from transfer_control import transfers, CANCELLED
 import logging
 import asyncio
-import sys
 import time
+import glob
+import re
+import shutil
 from colorama import Fore, Style
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-terminate = False
-skip_current = False
+DOWNLOAD_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.3'
+}
 
-def set_terminate_flag(value):
-    global terminate
-    terminate = value
+# What a transfer returns when the file was linked from the library instead
+LINKED = "linked"
 
-def set_skip_flag(value):
-    global skip_current
-    skip_current = value
+default_segments = 1
+min_segment_size = 16 * 1024 * 1024
+
+def set_segment_options(segments=None, min_size=None):
+    global default_segments, min_segment_size
+    if segments is not None:
+        default_segments = max(1, int(segments))
+    if min_size is not None:
+        min_segment_size = max(1024 * 1024, int(min_size))
 
 def format_time(seconds):
     if seconds < 60:
@@ -31,166 +49,508 @@ def format_time(seconds):
         minutes, seconds = divmod(remainder, 60)
         return f"{hours:.0f}h {minutes:.0f}m {seconds:.0f}s"
 
-async def download_file(session, url, path, expected_size, retries=10, backoff_factor=5):
-    global terminate, skip_current
-    if terminate:
+class RangeNotSupportedError(Exception):
+    # Raised to fall back to a single stream. `response` is the still-open reply to
+    # the probe request, which the single-stream path can consume instead of asking again.
+    def __init__(self, message="", response=None):
+        super().__init__(message)
+        self.response = response
+
+class RemoteChangedError(Exception):
+    pass
+
+def find_segment_parts(temp_path):
+    parts = []
+    for part_path in glob.glob(f"{glob.escape(temp_path)}.part*"):
+        match = re.search(r'\.part(\d+)-(\d+)$', part_path)
+        if match:
+            parts.append((int(match.group(1)), int(match.group(2)), part_path))
+    return sorted(parts)
+
+def plan_segments(total_size, segments):
+    count = max(1, min(segments, total_size // min_segment_size))
+    # Boundaries fall on manifest blocks, so a finished segment's hashes carry over when stitched
+    segment_size = max(BLOCK_SIZE, total_size // count // BLOCK_SIZE * BLOCK_SIZE)
+    ranges = []
+    start = 0
+    while start < total_size and len(ranges) < count:
+        end = total_size - 1 if len(ranges) == count - 1 else min(total_size - 1, start + segment_size - 1)
+        ranges.append((start, end))
+        start = end + 1
+    return ranges
+
+def response_total_size(response, offset=0):
+    # Full size of the remote file from Content-Range, falling back to Content-Length
+    if response.status == 206:
+        match = re.match(r'bytes \d+-\d+/(\d+)', response.headers.get('Content-Range', ''))
+        if match:
+            return int(match.group(1))
+    content_length = int(response.headers.get('Content-Length', 0))
+    if content_length == 0:
+        return 0
+    return content_length + (offset if response.status == 206 else 0)
+
+async def download_segment(session, url, segment_path, start, end, headers, progress_bar, control, retries, backoff_factor, first_response=None):
+    try:
+        with tracer.span("segment", start=start, end=end):
+            return await _download_segment(session, url, segment_path, start, end, headers, progress_bar, control, retries, backoff_factor, first_response)
+    finally:
+        if first_response is not None:
+            first_response.release()
+
+async def _download_segment(session, url, segment_path, start, end, headers, progress_bar, control, retries, backoff_factor, first_response):
+    length = end - start + 1
+    manifest, _ = await run_in_writer(prepare_resume, segment_path, url, start)
+    delay = 0
+    for attempt in range(retries):
+        if control.stopped:
+            return control.result
+
+        existing = os.path.getsize(segment_path) if os.path.exists(segment_path) else 0
+        if existing > length:
+            with open(segment_path, 'r+b') as file:
+                file.truncate(length)
+            manifest.blocks = manifest.blocks[:length // manifest.block_size]
+            existing = length
+        if existing == length:
+            return True
+
+        segment_headers = dict(headers, Range=f"bytes={start + existing}-{end}")
+        if existing > 0 and manifest.if_range_header():
+            segment_headers['If-Range'] = manifest.if_range_header()
+        try:
+            timeout = aiohttp.ClientTimeout(total=3600, sock_read=60)
+            await retry_policy.before_request(url)
+            sent = None
+            if first_response is not None and existing == 0 and attempt == 0:
+                # The response that revealed the file size doubles as this segment's stream
+                request = first_response
+            else:
+                sent = time.monotonic()
+                request = session.get(url, headers=segment_headers, timeout=timeout)
+            async with request as response:
+                if sent is not None:
+                    metrics.first_byte.observe(time.monotonic() - sent)
+                    tracer.record("connect", time.monotonic() - sent, status=response.status, attempt=attempt + 1)
+                if response.status == 429:
+                    # The pause applies to the whole host and is waited out before the next request
+                    wait_time = retry_policy.on_throttle(url, response)
+                    logging.warning(f"Rate limit exceeded on segment {start}-{end}. Waiting for {wait_time:.1f} seconds before retrying.")
+                    controller.record_congestion("429")
+                    metrics.throttled.inc(kind="download")
+                    continue
+                if response.status == 200:
+                    raise RangeNotSupportedError(f"Server ignored range request for segment {start}-{end}")
+                response.raise_for_status()
+                retry_policy.on_success(url)
+                remote_size = response_total_size(response)
+                if not manifest.matches_remote(remote_size, response.headers.get('ETag')):
+                    raise RemoteChangedError(f"Remote file changed while downloading segment {start}-{end}")
+                manifest.remote_size = remote_size
+                manifest.set_remote(response)
+
+                written = existing
+                async with tracer.span("transfer", offset=start + existing) as transfer, AsyncFileWriter(segment_path, 'ab', manifest=manifest) as file:
+                    async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                        # Every segment checks the same handle, so they pause and stop together
+                        if await control.checkpoint(transfer):
+                            return control.result
+                        chunk = chunk[:length - written]
+                        if chunk:
+                            waited = time.perf_counter()
+                            await file.write(chunk)
+                            written += len(chunk)
+                            throttled = time.perf_counter()
+                            await rate_limiter.throttle(url, len(chunk))
+                            transfer.add("disk_wait", throttled - waited)
+                            transfer.add("rate_wait", time.perf_counter() - throttled)
+                            controller.record_bytes(len(chunk))
+                            metrics.bytes_downloaded.inc(len(chunk))
+                            progress_bar.update(len(chunk))
+                        if written >= length:
+                            break
+
+                if written == length:
+                    return True
+                logging.warning(f"Segment {start}-{end} incomplete ({written}/{length} bytes).")
+                cause = "incomplete"
+        except (RangeNotSupportedError, RemoteChangedError):
+            raise
+        except asyncio.TimeoutError:
+            logging.error(f"Segment {start}-{end} stalled")
+            controller.record_congestion("stall")
+            metrics.stalls.inc()
+            cause = "stall"
+        except (aiohttp.ClientError, OSError) as e:
+            logging.error(f"Error downloading segment {start}-{end}: {e}")
+            cause = "client_error" if isinstance(e, aiohttp.ClientError) else "os_error"
+
+        if attempt < retries - 1:
+            metrics.retries.inc(kind="segment", cause=cause)
+            delay = retry_policy.on_failure(url, delay, backoff_factor)
+            logging.info(f"Retrying segment {start}-{end} in {delay:.1f} seconds...")
+            with tracer.span("retry_wait", cause=cause):
+                await asyncio.sleep(delay)
+
+    raise aiohttp.ClientError(f"Segment {start}-{end} failed after {retries} attempts")
+
+def stitch_segments(temp_path, ranges):
+    manifest = ResumeManifest.load(temp_path)
+    with open(temp_path, 'r+b') as file:
+        for start, end, segment_path in ranges[1:]:
+            # Anything past `start` is a leftover from an interrupted stitch
+            file.truncate(start)
+            file.seek(start)
+            with open(segment_path, 'rb') as part:
+                shutil.copyfileobj(part, file, 8 * 1024 * 1024)
+            file.flush()
+            os.fsync(file.fileno())
+            part_manifest = ResumeManifest.load(segment_path)
+            if manifest is not None and part_manifest is not None:
+                manifest.blocks = manifest.blocks[:start // manifest.block_size]
+                manifest.absorb(part_manifest)
+                manifest.save()
+            os.remove(segment_path)
+            if part_manifest is not None:
+                part_manifest.remove()
+
+def remove_segment_files(temp_path, include_temp=False):
+    for _, _, part_path in find_segment_parts(temp_path):
+        os.remove(part_path)
+        ResumeManifest(part_path).remove()
+    if include_temp:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        ResumeManifest(temp_path).remove()
+
+async def download_file_segmented(session, url, path, expected_size, segments, headers, control, retries, backoff_factor):
+    temp_path = f"{path}.tmp"
+    parts = find_segment_parts(temp_path)
+    first_response = None
+    if parts:
+        # The .tmp file always holds the first segment, up to where the first part begins
+        total_size = parts[-1][1] + 1
+        ranges = [(0, parts[0][0] - 1, temp_path)] + parts
+        logging.info(f"Resuming segmented download: {url} ({len(ranges)} segments)")
+    else:
+        if expected_size and expected_size < 2 * min_segment_size:
+            raise RangeNotSupportedError("File too small to split")
+        # An open-ended range request both probes for range support and starts the first segment
+        await retry_policy.before_request(url)
+        try:
+            sent = time.monotonic()
+            first_response = await session.get(url, headers=dict(headers, Range='bytes=0-'), timeout=aiohttp.ClientTimeout(total=3600, sock_read=60))
+            metrics.first_byte.observe(time.monotonic() - sent)
+            tracer.record("connect", time.monotonic() - sent, status=first_response.status, probe=True)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logging.warning(f"Range probe failed: {e}")
+            raise RangeNotSupportedError(str(e))
+        total_size = response_total_size(first_response) if first_response.status == 206 else 0
+        if not total_size:
+            logging.info("Server does not support range requests. Using a single stream.")
+            raise RangeNotSupportedError("No Content-Range in probe response", first_response)
+        if not expected_size and await deduplicator.link_existing(session, url, path, total_size, DOWNLOAD_HEADERS):
+            first_response.release()
+            return LINKED
+        plan = plan_segments(total_size, segments)
+        if len(plan) < 2:
+            raise RangeNotSupportedError("File too small to split", first_response)
+        ranges = [(start, end, temp_path if start == 0 else f"{temp_path}.part{start}-{end}") for start, end in plan]
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        for _, _, segment_path in ranges:
+            open(segment_path, 'ab').close()
+        logging.info(f"Downloading {url} in {len(ranges)} segments ({total_size} bytes)")
+
+    downloaded = sum(min(os.path.getsize(p), end - start + 1) for start, end, p in ranges if os.path.exists(p))
+    progress_bar = progress.start(os.path.basename(path), total_size, downloaded)
+    progress_bar.set_status(f"x{len(ranges)}")
+    control.attach(progress_bar)
+    start_time = time.time()
+    tasks = [
+        asyncio.create_task(download_segment(session, url, segment_path, start, end, headers, progress_bar, control, retries, backoff_factor,
+                                             first_response if start == 0 else None))
+        for start, end, segment_path in ranges
+    ]
+    try:
+        done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        results = [task.result() for task in done]
+    except RangeNotSupportedError as e:
+        logging.warning(f"{e}. Falling back to a single stream.")
+        remove_segment_files(temp_path)
+        raise RangeNotSupportedError(str(e))
+    except RemoteChangedError as e:
+        logging.warning(f"{e}. Discarding partial data and starting over.")
+        remove_segment_files(temp_path, include_temp=True)
+        raise RangeNotSupportedError(str(e))
+    except asyncio.CancelledError:
+        logging.info(f"Download cancelled: {os.path.basename(path)}")
+        for task in tasks:
+            task.cancel()
+        return None
+    except Exception as e:
+        logging.error(f"Failed to download file after {retries} attempts: {e}")
+        remove_segment_files(temp_path, include_temp=True)
+        return None
+    finally:
+        progress_bar.close()
+
+    if None in results:
+        logging.info(f"Download interrupted: {os.path.basename(path)}")
         return None
+    if "skipped" in results:
+        logging.info(f"Skipping download: {os.path.basename(path)}")
+        return "skipped"
+
+    with tracer.span("stitch", segments=len(ranges)):
+        await run_in_writer(stitch_segments, temp_path, ranges)
+    download_time = time.time() - start_time
+
+    if os.path.getsize(temp_path) != total_size:
+        logging.warning(f"Download incomplete. File size: {os.path.getsize(temp_path)}, Expected: {total_size}")
+        return None
+    os.replace(temp_path, path)
+    ResumeManifest(temp_path).remove()
+    logging.info(f"Successfully downloaded: {path}")
+    size_mb = total_size / (1024 * 1024)
+    speed_mbps = size_mb / download_time if download_time > 0 else 0
+    return path, download_time, speed_mbps
+
+async def download_file(session, url, path, expected_size, retries=10, backoff_factor=5, segments=None):
+    # The transfer can be paused, skipped or cancelled through its handle in
+    # the transfer registry while this runs
+    with tracer.span("download", file=os.path.basename(path)) as span, transfers.track(url, path) as control:
+        # With a known size the library is checked before any request; otherwise
+        # the transfer checks once its first response has told it the size
+        if not control.stopped and await deduplicator.link_existing(session or get_session(), url, path, expected_size, DOWNLOAD_HEADERS):
+            result = LINKED
+        else:
+            result = await _download_file(session, url, path, expected_size, control, retries, backoff_factor, segments)
+        if result == LINKED:
+            outcome = "linked"
+        elif result == "skipped":
+            outcome = "skipped"
+        elif result:
+            outcome = "ok"
+        else:
+            outcome = "cancelled" if control.state == CANCELLED else "failed"
+        span.set(result=outcome)
+    metrics.downloads.inc(result=outcome)
+    if result == LINKED:
+        return path, 0, 0
+    if result and result != "skipped":
+        await deduplicator.add(path)
+    return result
+
+async def _download_file(session, url, path, expected_size, control, retries, backoff_factor, segments):
+    if control.stopped:
+        return control.result
+
+    if segments is None:
+        segments = default_segments
+    if session is None:
+        session = get_session()
 
     temp_path = f"{path}.tmp"
+    headers = dict(DOWNLOAD_HEADERS)
+
+    initial_response = None
+    if find_segment_parts(temp_path) or (segments > 1 and not os.path.exists(temp_path)):
+        try:
+            return await download_file_segmented(session, url, path, expected_size, segments, headers, control, retries, backoff_factor)
+        except RangeNotSupportedError as e:
+            initial_response = e.response
+
     existing_file_size = 0
     if os.path.exists(temp_path):
-        existing_file_size = os.path.getsize(temp_path)
-        logging.info(f"Found existing partial download: {url} ({existing_file_size} bytes)")
+        # Only the blocks the manifest can vouch for are kept; a bad tail is truncated away
+        manifest, existing_file_size = await run_in_writer(prepare_resume, temp_path, url)
+        logging.info(f"Found existing partial download: {url} ({existing_file_size} verified bytes)")
+    else:
+        manifest = ResumeManifest(temp_path, url=url)
 
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.3'
-    }
+    if initial_response is not None and existing_file_size > 0:
+        initial_response.release()
+        initial_response = None
 
-    progress_bar = None
+    delay = 0
 
     for attempt in range(retries):
-        if terminate:
-            return None
+        if control.stopped:
+            if initial_response is not None:
+                initial_response.release()
+            return control.result
 
         try:
             logging.info(f"Downloading: {url} (Attempt {attempt + 1}/{retries})")
             timeout = aiohttp.ClientTimeout(total=3600)  # 1 hour timeout
 
+            if attempt > 0:
+                existing_file_size = os.path.getsize(temp_path) if os.path.exists(temp_path) else 0
+            headers.pop('Range', None)
+            headers.pop('If-Range', None)
             if existing_file_size > 0:
                 headers['Range'] = f"bytes={existing_file_size}-"
+                if manifest.if_range_header():
+                    headers['If-Range'] = manifest.if_range_header()
                 logging.info(f"Attempting to resume download from byte {existing_file_size}")
 
-            connector = aiohttp.TCPConnector(force_close=True)
-            async with aiohttp.ClientSession(connector=connector) as retry_session:
-                async with retry_session.get(url, headers=headers, timeout=timeout) as response:
-                    if response.status == 416:
-                        logging.info(f"File already fully downloaded: {path}")
-                        if os.path.exists(temp_path):
-                            os.replace(temp_path, path)
-                        return path, 0, 0  # Return path, 0 download time, and 0 speed
-                    
-                    if response.status == 429:
-                        wait_time = backoff_factor * (2 ** attempt)
-                        logging.warning(f"Rate limit exceeded. Waiting for {wait_time} seconds before retrying.")
-                        await asyncio.sleep(wait_time)
-                        continue
-                    
-                    if existing_file_size > 0 and response.status == 200:
-                        logging.warning("Server does not support range requests. Starting download from the beginning.")
-                        existing_file_size = 0
-
-                    response.raise_for_status()
-                    total_size = int(response.headers.get('content-length', 0))
-                    if total_size == 0:
-                        total_size = expected_size
-                    if existing_file_size > 0 and response.status == 206:
-                        total_size += existing_file_size
-                    logging.info(f"Total file size: {total_size} bytes")
-                    os.makedirs(os.path.dirname(path), exist_ok=True)
-                    
-                    mode = 'ab' if existing_file_size > 0 and response.status == 206 else 'wb'
-                    
-                    with open(temp_path, mode) as file:
-                        if progress_bar is None:
-                            progress_bar = tqdm_asyncio(
-                                total=total_size,
-                                initial=existing_file_size,
-                                unit='iB',
-                                unit_scale=True,
-                                unit_divisor=1024,
-                                desc=os.path.basename(path),
-                                bar_format='{l_bar}{bar}| {n_fmt}/{total_fmt} [{rate_fmt}{postfix}]'
-                            )
-                        last_update_time = time.time()
-                        last_size = existing_file_size
-                        start_time = time.time()
-                        inactivity_timer = 0
-                        eta = 0
-                        try:
-                            async for chunk in response.content.iter_chunked(1024*1024):  # 1MB chunks
-                                if terminate:
-                                    logging.info(f"Download interrupted: {os.path.basename(path)}")
-                                    progress_bar.close()
-                                    return None
-                                if skip_current:
-                                    logging.info(f"Skipping download: {os.path.basename(path)}")
-                                    progress_bar.close()
-                                    return "skipped"
-                                if chunk:
-                                    file.write(chunk)
-                                    progress_bar.update(len(chunk))
-                                    current_time = time.time()
-                                    if current_time - last_update_time > 1:  # Update ETA every second
-                                        current_size = file.tell()
-                                        speed = (current_size - last_size) / (current_time - last_update_time)
-                                        if speed > 0:
-                                            eta = (total_size - current_size) / speed
-                                        else:
-                                            eta = 0
-                                        if current_size == last_size:
-                                            inactivity_timer += current_time - last_update_time
-                                            if inactivity_timer >= 30:  # 30 seconds of inactivity
-                                                logging.warning("Download seems to be stuck. Restarting...")
-                                                raise aiohttp.ClientPayloadError("Download stuck")
-                                        else:
-                                            inactivity_timer = 0
-                                        last_size = current_size
-                                        last_update_time = current_time
-                                        progress_bar.set_postfix_str(f"ETA: {format_time(eta)} | Inactive: {format_time(inactivity_timer)}", refresh=False)
-                                else:
-                                    logging.warning("Received empty chunk")
-                                sys.stdout.flush()
-                        except aiohttp.ClientPayloadError as e:
-                            logging.error(f"Payload error during download: {e}")
-                            if file.tell() < total_size:
-                                logging.info("Download incomplete. Will retry from current position.")
-                                raise
-                        except asyncio.CancelledError:
-                            logging.info(f"Download cancelled: {os.path.basename(path)}")
-                            progress_bar.close()
-                            return None
-                        except Exception as e:
-                            logging.error(f"Error during download: {e}")
-                            raise
-                        finally:
-                            progress_bar.close()
-                            end_time = time.time()
-                            download_time = end_time - start_time
-                            logging.info(f"Download attempt completed in {download_time:.2f} seconds")
-                    
-                    if os.path.getsize(temp_path) == total_size or total_size == 0:
+            sent = None
+            if initial_response is not None:
+                request, initial_response = initial_response, None
+            else:
+                await retry_policy.before_request(url)
+                sent = time.monotonic()
+                request = session.get(url, headers=headers, timeout=timeout)
+            async with request as response:
+                if sent is not None:
+                    metrics.first_byte.observe(time.monotonic() - sent)
+                    tracer.record("connect", time.monotonic() - sent, status=response.status, attempt=attempt + 1)
+                if response.status == 416:
+                    logging.info(f"File already fully downloaded: {path}")
+                    if os.path.exists(temp_path):
                         os.replace(temp_path, path)
-                        logging.info(f"Successfully downloaded: {path}")
-                        size_mb = os.path.getsize(path) / (1024 * 1024)
-                        speed_mbps = size_mb / download_time if download_time > 0 else 0
-                        return path, download_time, speed_mbps
-                    else:
-                        logging.warning(f"Download incomplete. File size: {os.path.getsize(temp_path)}, Expected: {total_size}")
+                    manifest.remove()
+                    return path, 0, 0  # Return path, 0 download time, and 0 speed
+                
+                if response.status == 429:
+                    # The pause applies to the whole host and is waited out before the next request
+                    wait_time = retry_policy.on_throttle(url, response)
+                    logging.warning(f"Rate limit exceeded. Waiting for {wait_time:.1f} seconds before retrying.")
+                    controller.record_congestion("429")
+                    metrics.throttled.inc(kind="download")
+                    continue
+                
+                if existing_file_size > 0 and response.status == 200:
+                    logging.warning("Server does not support range requests or the file changed. Starting download from the beginning.")
+                    existing_file_size = 0
+
+                response.raise_for_status()
+                retry_policy.on_success(url)
+                total_size = response_total_size(response, existing_file_size) or expected_size
+                if response.status == 206 and not manifest.matches_remote(total_size, response.headers.get('ETag')):
+                    logging.warning(f"Remote file changed since the partial download started. Restarting: {url}")
+                    manifest.reset()
+                    await run_in_writer(os.truncate, temp_path, 0)
+                    existing_file_size = 0
+                    continue
+                if existing_file_size == 0 and not expected_size and await deduplicator.link_existing(session, url, path, total_size, DOWNLOAD_HEADERS):
+                    return LINKED
+                logging.info(f"Total file size: {total_size} bytes")
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                
+                mode = 'ab' if existing_file_size > 0 and response.status == 206 else 'wb'
+                if mode == 'wb':
+                    manifest.reset(total_size, response.headers.get('ETag'), response.headers.get('Last-Modified'))
+                else:
+                    manifest.remote_size = total_size
+                    manifest.set_remote(response)
+                
+                async with tracer.span("transfer", offset=existing_file_size) as transfer, AsyncFileWriter(temp_path, mode, manifest=manifest) as file:
+                    progress_bar = progress.start(os.path.basename(path), total_size, existing_file_size)
+                    control.attach(progress_bar)
+                    last_update_time = time.time()
+                    last_size = existing_file_size
+                    start_time = time.time()
+                    inactivity_timer = 0
+                    try:
+                        async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                            if await control.checkpoint(transfer):
+                                logging.info(f"{'Skipping download' if control.result else 'Download cancelled'}: {os.path.basename(path)}")
+                                progress_bar.close()
+                                return control.result
+                            if chunk:
+                                waited = time.perf_counter()
+                                await file.write(chunk)
+                                progress_bar.update(len(chunk))
+                                throttled = time.perf_counter()
+                                await rate_limiter.throttle(url, len(chunk))
+                                transfer.add("disk_wait", throttled - waited)
+                                transfer.add("rate_wait", time.perf_counter() - throttled)
+                                controller.record_bytes(len(chunk))
+                                metrics.bytes_downloaded.inc(len(chunk))
+                                current_time = time.time()
+                                if current_time - last_update_time > 1:  # Check for stalls every second
+                                    current_size = file.tell()
+                                    if current_size == last_size:
+                                        inactivity_timer += current_time - last_update_time
+                                        if inactivity_timer >= 30:  # 30 seconds of inactivity
+                                            logging.warning("Download seems to be stuck. Restarting...")
+                                            controller.record_congestion("stall")
+                                            metrics.stalls.inc()
+                                            raise aiohttp.ClientPayloadError("Download stuck")
+                                    else:
+                                        inactivity_timer = 0
+                                    last_size = current_size
+                                    last_update_time = current_time
+                                    progress_bar.set_status(f"stalled {format_time(inactivity_timer)}" if inactivity_timer else "")
+                            else:
+                                logging.warning("Received empty chunk")
+                    except aiohttp.ClientPayloadError as e:
+                        logging.error(f"Payload error during download: {e}")
+                        if file.tell() < total_size:
+                            logging.info("Download incomplete. Will retry from current position.")
+                            raise
+                    except asyncio.CancelledError:
+                        logging.info(f"Download cancelled: {os.path.basename(path)}")
+                        progress_bar.close()
                         return None
+                    except Exception as e:
+                        logging.error(f"Error during download: {e}")
+                        raise
+                    finally:
+                        progress_bar.close()
+                        end_time = time.time()
+                        download_time = end_time - start_time
+                        logging.info(f"Download attempt completed in {download_time:.2f} seconds")
+                
+                if os.path.getsize(temp_path) == total_size or total_size == 0:
+                    os.replace(temp_path, path)
+                    manifest.remove()
+                    logging.info(f"Successfully downloaded: {path}")
+                    size_mb = os.path.getsize(path) / (1024 * 1024)
+                    speed_mbps = size_mb / download_time if download_time > 0 else 0
+                    return path, download_time, speed_mbps
+                else:
+                    logging.warning(f"Download incomplete. File size: {os.path.getsize(temp_path)}, Expected: {total_size}")
+                    return None
         except aiohttp.ClientResponseError as e:
             if e.status == 416:
                 logging.info(f"File already fully downloaded: {path}")
                 if os.path.exists(temp_path):
                     os.replace(temp_path, path)
+                manifest.remove()
                 return path, 0, 0  # Return path, 0 download time, and 0 speed
             logging.error(f"Client response error: {e}")
+            cause = f"http_{e.status}"
         except aiohttp.ClientError as e:
             logging.error(f"Client error during download: {e}")
+            cause = "payload" if isinstance(e, aiohttp.ClientPayloadError) else "client_error"
         except asyncio.TimeoutError:
             logging.error("Download timed out")
+            controller.record_congestion("stall")
+            metrics.stalls.inc()
+            cause = "timeout"
         except OSError as e:
             logging.error(f"OS error during download: {e}")
+            cause = "os_error"
         except Exception as e:
             logging.error(f"Unexpected error during download: {e}")
+            cause = "unexpected"
         
         if attempt < retries - 1:
-            wait_time = backoff_factor * (2 ** attempt)
-            logging.info(f"Retrying download in {wait_time} seconds...")
-            await asyncio.sleep(wait_time)
+            metrics.retries.inc(kind="download", cause=cause)
+            delay = retry_policy.on_failure(url, delay, backoff_factor)
+            logging.info(f"Retrying download in {delay:.1f} seconds...")
+            with tracer.span("retry_wait", cause=cause):
+                await asyncio.sleep(delay)
         else:
             logging.error(f"Failed to download file after {retries} attempts.")
             if os.path.exists(temp_path):
                 os.remove(temp_path)
+            manifest.remove()
             return None
 
     return None
\ No newline at end of file
@@ -1,96 +1,186 @@
 import os
 import asyncio
+from collections import OrderedDict
+from contextlib import aclosing
 from colorama import Fore, Style
+from progress import format_size
+
+# Listings kept for instant navigation, and how many child folders are fetched at once
+PREFETCH_CACHE_SIZE = 64
+PREFETCH_WORKERS = 4
 
 class FolderNavigator:
-    def __init__(self, base_scraper):
+    # Browses the site folder by folder. While the user reads a listing its
+    # subfolders are fetched in the background into a small LRU cache, so
+    # stepping into one is instant. Prompts run in a thread to keep the event
+    # loop, and with it the prefetching, going while input() waits.
+    def __init__(self, base_scraper, start_path="/"):
         self.scraper = base_scraper
-        self.current_path = "/"
+        self.root = start_path
+        self.current_path = start_path
+        # (path, name) of each folder entered since the start, for '..' and download paths
+        self.crumbs = []
         self.history = []
+        self.cache = OrderedDict()
+        self.prefetching = {}
+        self.prefetch_slots = asyncio.Semaphore(PREFETCH_WORKERS)
+
+    async def prompt(self, text):
+        return await asyncio.to_thread(input, text)
 
     async def list_contents(self):
-        return await self.scraper.fetch_directory_contents(self.current_path)
+        contents = await self.get_contents(self.current_path)
+        self.prefetch(contents)
+        return contents
+
+    async def get_contents(self, path):
+        if path in self.cache:
+            self.cache.move_to_end(path)
+            return self.cache[path]
+        task = self.prefetching.get(path)
+        if task is not None:
+            try:
+                return await asyncio.shield(task)
+            except asyncio.CancelledError:
+                # Only a cancelled prefetch falls through to a fetch of our own
+                if not task.cancelled():
+                    raise
+        contents = await self.scraper.fetch_directory_contents(path)
+        self.remember(path, contents)
+        return contents
+
+    def remember(self, path, contents):
+        self.cache[path] = contents
+        self.cache.move_to_end(path)
+        while len(self.cache) > PREFETCH_CACHE_SIZE:
+            self.cache.popitem(last=False)
+
+    def prefetch(self, contents):
+        # Half the cache at most, so one large folder cannot evict the way back
+        folders = [entry['path'] for entry in contents if entry['is_dir']][:PREFETCH_CACHE_SIZE // 2]
+        for path, task in list(self.prefetching.items()):
+            if path not in folders:
+                task.cancel()
+        for path in folders:
+            if path not in self.cache and path not in self.prefetching:
+                self.prefetching[path] = asyncio.create_task(self._prefetch(path))
 
-    def change_directory(self, new_dir):
-        self.history.append(self.current_path)
-        self.current_path = os.path.normpath(os.path.join(self.current_path, new_dir))
+    async def _prefetch(self, path):
+        try:
+            async with self.prefetch_slots:
+                contents = await self.scraper.fetch_directory_contents(path)
+            self.remember(path, contents)
+            return contents
+        finally:
+            self.prefetching.pop(path, None)
+
+    def stop_prefetching(self):
+        for task in list(self.prefetching.values()):
+            task.cancel()
+
+    def change_directory(self, path, name, crumbs=()):
+        # crumbs are the folders between the current one and path, for a search hit further down
+        self.history.append((self.current_path, list(self.crumbs)))
+        self.crumbs.extend(crumbs)
+        self.crumbs.append((path, name))
+        self.current_path = path
+
+    def go_up(self):
+        if not self.crumbs:
+            print(f"{Fore.YELLOW}Already at the root directory.{Style.RESET_ALL}")
+            return
+        self.history.append((self.current_path, list(self.crumbs)))
+        self.crumbs.pop()
+        self.current_path = self.crumbs[-1][0] if self.crumbs else self.root
 
     def go_back(self):
         if self.history:
-            self.current_path = self.history.pop()
+            self.current_path, self.crumbs = self.history.pop()
         else:
             print(f"{Fore.YELLOW}Already at the root directory.{Style.RESET_ALL}")
 
+    def describe(self, item):
+        icon = "📁" if item['is_dir'] else "📄"
+        size = f" ({format_size(item['size'])})" if item.get('size') else ""
+        return f"{icon} {item['name']}{size}"
+
     async def navigate(self):
         while True:
             contents = await self.list_contents()
-            print(f"\n{Fore.CYAN}Current path: {self.current_path}{Style.RESET_ALL}")
+            location = " > ".join(name for _, name in self.crumbs) or self.current_path
+            print(f"\n{Fore.CYAN}Current path: {location}{Style.RESET_ALL}")
             print(f"{Fore.GREEN}{'=' * 50}{Style.RESET_ALL}")
-            
+
             for i, item in enumerate(contents, 1):
-                icon = "📁" if item['is_dir'] else "📄"
-                print(f"{i:2}. {icon} {item['name']}")
-            
+                print(f"{i:2}. {self.describe(item)}")
+
             print(f"{Fore.GREEN}{'=' * 50}{Style.RESET_ALL}")
             print(f"{Fore.YELLOW}Commands: 'q' to quit, '..' to go up, 'b' to go back{Style.RESET_ALL}")
-            choice = input(f"{Fore.CYAN}Enter your choice: {Style.RESET_ALL}")
+            choice = await self.prompt(f"{Fore.CYAN}Enter your choice: {Style.RESET_ALL}")
 
             if choice.lower() == 'q':
                 break
             elif choice == '..':
-                self.change_directory('..')
+                self.go_up()
             elif choice.lower() == 'b':
                 self.go_back()
             elif choice.isdigit() and 1 <= int(choice) <= len(contents):
                 selected = contents[int(choice) - 1]
                 if selected['is_dir']:
-                    self.change_directory(selected['name'])
+                    self.change_directory(selected['path'], selected['name'])
                 else:
                     await self.handle_file_selection(selected)
             else:
                 print(f"{Fore.RED}Invalid choice. Please try again.{Style.RESET_ALL}")
 
-    async def handle_file_selection(self, file):
+    async def handle_file_selection(self, file, crumbs=()):
         print(f"\n{Fore.GREEN}Selected file: {file['name']}{Style.RESET_ALL}")
-        choice = input(f"{Fore.YELLOW}Do you want to download this file? (y/n): {Style.RESET_ALL}").lower()
+        choice = (await self.prompt(f"{Fore.YELLOW}Do you want to download this file? (y/n): {Style.RESET_ALL}")).lower()
         if choice == 'y':
-            await self.scraper.download_item(file['url'], self.current_path, file['name'])
+            # Saved under the download directory in the same folders as on the site
+            folders = [self.scraper.sanitize_filename(name) for _, name in self.crumbs + list(crumbs)]
+            path = os.path.join(self.scraper.download_dir, *folders, self.scraper.sanitize_filename(file['name']))
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            await self.scraper.download_file(None, file['url'], path, file.get('size'))
         else:
             print(f"{Fore.YELLOW}Download cancelled.{Style.RESET_ALL}")
 
     async def search(self, query):
-        results = await self.scraper.search_in_directory(self.current_path, query)
+        # Hits are printed as the crawl finds them; the choice is asked once it is done
+        results = []
+        print(f"\n{Fore.GREEN}Search results for '{query}':{Style.RESET_ALL}")
+        async with aclosing(self.scraper.search_in_directory(self.current_path, query)) as matches:
+            async for result in matches:
+                results.append(result)
+                print(f"{len(results):2}. {self.describe(result)} ({result['path']})")
         if results:
-            print(f"\n{Fore.GREEN}Search results for '{query}':{Style.RESET_ALL}")
-            for i, result in enumerate(results, 1):
-                icon = "📁" if result['is_dir'] else "📄"
-                print(f"{i:2}. {icon} {result['name']} ({result['path']})")
-            
-            choice = input(f"{Fore.YELLOW}Enter number to navigate to item, or press Enter to cancel: {Style.RESET_ALL}")
+            choice = await self.prompt(f"{Fore.YELLOW}Enter number to navigate to item, or press Enter to cancel: {Style.RESET_ALL}")
             if choice.isdigit() and 1 <= int(choice) <= len(results):
                 selected = results[int(choice) - 1]
                 if selected['is_dir']:
-                    self.current_path = selected['path']
+                    self.change_directory(selected['path'], selected['name'], selected['crumbs'])
                 else:
-                    self.current_path = os.path.dirname(selected['path'])
-                    await self.handle_file_selection(selected)
+                    await self.handle_file_selection(selected, selected['crumbs'])
         else:
             print(f"{Fore.YELLOW}No results found for '{query}'{Style.RESET_ALL}")
 
     async def run(self):
-        while True:
-            print(f"\n{Fore.CYAN}Folder Navigation Menu:{Style.RESET_ALL}")
-            print(f"1. Browse folders")
-            print(f"2. Search in current directory")
-            print(f"3. Return to main menu")
-            choice = input(f"{Fore.YELLOW}Enter your choice: {Style.RESET_ALL}")
-
-            if choice == '1':
-                await self.navigate()
-            elif choice == '2':
-                query = input(f"{Fore.YELLOW}Enter search query: {Style.RESET_ALL}")
-                await self.search(query)
-            elif choice == '3':
-                break
-            else:
-                print(f"{Fore.RED}Invalid choice. Please try again.{Style.RESET_ALL}")
\ No newline at end of file
+        try:
+            while True:
+                print(f"\n{Fore.CYAN}Folder Navigation Menu:{Style.RESET_ALL}")
+                print(f"1. Browse folders")
+                print(f"2. Search in current directory")
+                print(f"3. Return to main menu")
+                choice = await self.prompt(f"{Fore.YELLOW}Enter your choice: {Style.RESET_ALL}")
+
+                if choice == '1':
+                    await self.navigate()
+                elif choice == '2':
+                    query = await self.prompt(f"{Fore.YELLOW}Enter search query: {Style.RESET_ALL}")
+                    await self.search(query)
+                elif choice == '3':
+                    break
+                else:
+                    print(f"{Fore.RED}Invalid choice. Please try again.{Style.RESET_ALL}")
+        finally:
+            self.stop_prefetching()
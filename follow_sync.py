@@ -0,0 +1,315 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+from urllib.parse import quote
+from http_client import shared_session
+from concurrency_controller import concurrency_control
+from batch_runner import BatchRunner, pick_result, EXIT_OK, EXIT_FAILURES
+from scraper.listing_parser import parse_listing
+from tracing import tracer
+
+DEFAULT_FOLLOW_SETTINGS = {
+    "database": "follows.db",
+    # Besides seasons that are new on the show page, how many of the latest seasons to recheck
+    "recheck_seasons": 1,
+    # 0 syncs once and exits; otherwise --sync keeps running and syncs on this interval
+    "interval_minutes": 0,
+    "concurrency": 2
+}
+
+# Episode states. Baseline episodes were already listed when the show was
+# followed without backfill and are never downloaded.
+PENDING = "pending"
+DONE = "done"
+BASELINE = "baseline"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS shows (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    url TEXT NOT NULL UNIQUE,
+    etag TEXT,
+    last_modified TEXT,
+    followed_at TEXT NOT NULL,
+    checked_at TEXT
+);
+CREATE TABLE IF NOT EXISTS seasons (
+    show_id INTEGER NOT NULL REFERENCES shows (id),
+    url TEXT NOT NULL,
+    name TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    etag TEXT,
+    last_modified TEXT,
+    checked_at TEXT,
+    PRIMARY KEY (show_id, url)
+);
+CREATE TABLE IF NOT EXISTS episodes (
+    show_id INTEGER NOT NULL REFERENCES shows (id),
+    season_url TEXT NOT NULL,
+    url TEXT NOT NULL,
+    name TEXT NOT NULL,
+    state TEXT NOT NULL,
+    seen_at TEXT NOT NULL,
+    PRIMARY KEY (show_id, url)
+);
+CREATE INDEX IF NOT EXISTS episodes_state ON episodes (show_id, state);
+"""
+
+def now():
+    return time.strftime("%Y-%m-%d %H:%M:%S")
+
+class FollowStore:
+    # Subscriptions and the per-season episode index, in SQLite like the
+    # history store: WAL mode and a short-lived connection per call.
+    def __init__(self, db_path):
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        with self.connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+
+    @contextmanager
+    def connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA synchronous=NORMAL")
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def add_show(self, name, url):
+        with self.connect() as conn:
+            conn.execute("INSERT OR IGNORE INTO shows (name, url, followed_at) VALUES (?, ?, ?)", (name, url, now()))
+            return conn.execute("SELECT id FROM shows WHERE url = ?", (url,)).fetchone()[0]
+
+    def remove_show(self, show_id):
+        with self.connect() as conn:
+            conn.execute("DELETE FROM episodes WHERE show_id = ?", (show_id,))
+            conn.execute("DELETE FROM seasons WHERE show_id = ?", (show_id,))
+            conn.execute("DELETE FROM shows WHERE id = ?", (show_id,))
+
+    def shows(self):
+        with self.connect() as conn:
+            rows = conn.execute(
+                "SELECT shows.*, "
+                "(SELECT COUNT(*) FROM seasons WHERE show_id = shows.id) AS seasons, "
+                "(SELECT COUNT(*) FROM episodes WHERE show_id = shows.id AND state = 'done') AS downloaded, "
+                "(SELECT COUNT(*) FROM episodes WHERE show_id = shows.id AND state = 'pending') AS pending "
+                "FROM shows ORDER BY name"
+            )
+            return [dict(row) for row in rows]
+
+    def set_validators(self, show_id, headers, season_url=None):
+        values = (headers.get("ETag"), headers.get("Last-Modified"), now())
+        with self.connect() as conn:
+            if season_url is None:
+                conn.execute("UPDATE shows SET etag = ?, last_modified = ?, checked_at = ? WHERE id = ?", values + (show_id,))
+            else:
+                conn.execute("UPDATE seasons SET etag = ?, last_modified = ?, checked_at = ? WHERE show_id = ? AND url = ?",
+                             values + (show_id, season_url))
+
+    def touch(self, show_id, season_url=None):
+        with self.connect() as conn:
+            if season_url is None:
+                conn.execute("UPDATE shows SET checked_at = ? WHERE id = ?", (now(), show_id))
+            else:
+                conn.execute("UPDATE seasons SET checked_at = ? WHERE show_id = ? AND url = ?", (now(), show_id, season_url))
+
+    def seasons(self, show_id):
+        with self.connect() as conn:
+            return [dict(row) for row in conn.execute("SELECT * FROM seasons WHERE show_id = ? ORDER BY position", (show_id,))]
+
+    def set_seasons(self, show_id, seasons):
+        # Keeps the validators of seasons that are still listed
+        with self.connect() as conn:
+            for position, season in enumerate(seasons):
+                conn.execute("INSERT INTO seasons (show_id, url, name, position) VALUES (?, ?, ?, ?) "
+                             "ON CONFLICT (show_id, url) DO UPDATE SET name = excluded.name, position = excluded.position",
+                             (show_id, season['url'], season['name'], position))
+
+    def merge_episodes(self, show_id, season_url, episodes, state):
+        # Returns the episodes that were not in the index yet; a renamed or
+        # re-uploaded episode has a new URL, so it counts as new
+        with self.connect() as conn:
+            known = {row[0] for row in conn.execute("SELECT url FROM episodes WHERE show_id = ? AND season_url = ?", (show_id, season_url))}
+            new = [episode for episode in episodes if episode['url'] not in known]
+            conn.executemany("INSERT INTO episodes (show_id, season_url, url, name, state, seen_at) VALUES (?, ?, ?, ?, ?, ?)",
+                             [(show_id, season_url, episode['url'], episode['name'], state, now()) for episode in new])
+        return new
+
+    def pending(self, show_id):
+        with self.connect() as conn:
+            return [dict(row) for row in conn.execute("SELECT * FROM episodes WHERE show_id = ? AND state = ?", (show_id, PENDING))]
+
+    def set_state(self, show_id, url, state):
+        with self.connect() as conn:
+            conn.execute("UPDATE episodes SET state = ? WHERE show_id = ? AND url = ?", (state, show_id, url))
+
+class FollowSync:
+    # Keeps followed shows up to date. A sync revalidates each show page and
+    # its latest seasons with If-None-Match / If-Modified-Since; an unchanged
+    # listing costs one 304 and no parsing. Changed listings are diffed against
+    # the episode index and only the new episodes are downloaded, through the
+    # batch runner's transfer path.
+    def __init__(self, config, settings=None, download_dir=None, base_url=None):
+        self.settings = dict(DEFAULT_FOLLOW_SETTINGS)
+        self.settings.update({key: value for key, value in (settings or {}).items() if key in DEFAULT_FOLLOW_SETTINGS})
+        self.store = FollowStore(os.path.expanduser(self.settings["database"]))
+        self.runner = BatchRunner(config, {"jobs": []}, download_dir, base_url)
+        self.scraper = self.runner.scraper_for("TV Shows")
+        self.requests = 0
+
+    async def fetch(self, session, url, etag=None, last_modified=None):
+        # (status, listing or None when unchanged, response headers), or None on failure.
+        # The page cache is bypassed: its TTL would hide changes the sync is looking for.
+        conditional_headers = {}
+        if etag:
+            conditional_headers["If-None-Match"] = etag
+        if last_modified:
+            conditional_headers["If-Modified-Since"] = last_modified
+        self.requests += 1
+        result = await self.scraper.fetch_text(session, url, conditional_headers)
+        if result is None:
+            return None
+        status, text, headers = result
+        return status, None if text is None else parse_listing(text, self.runner.base_url), headers
+
+    async def follow(self, query, select=None, backfill=False):
+        async with shared_session() as session:
+            listing = await self.scraper.fetch_page(session, f"{self.runner.base_url}/s/{quote(query)}")
+            show = pick_result(self.scraper.extract_links(listing) if listing else [], select)
+            if show is None:
+                logging.error(f"No TV show matching {select or 1!r} for {query!r}")
+                return None
+            show_id = self.store.add_show(show['name'], show['url'])
+            # The first check indexes every season; without backfill what is listed now is the baseline
+            await self.check_show(session, show_id, show['url'], None, None, BASELINE if not backfill else PENDING)
+        logging.info(f"Following {show['name']} ({len(self.store.pending(show_id))} episodes to download)")
+        return show
+
+    def unfollow(self, name):
+        show = pick_result(self.store.shows(), name)
+        if show is None:
+            return None
+        self.store.remove_show(show['id'])
+        logging.info(f"No longer following {show['name']}")
+        return show
+
+    async def check_show(self, session, show_id, url, etag, last_modified, new_state=PENDING):
+        with tracer.span("show", url=url) as span:
+            # A season whose listing was never read counts as new, so a failed first check is retried in full
+            known = [season for season in self.store.seasons(show_id) if season['checked_at']]
+            result = await self.fetch(session, url, etag, last_modified)
+            if result is None:
+                logging.error(f"Failed to check {url}")
+                seasons = known
+            elif result[1] is None:
+                self.store.touch(show_id)
+                seasons = known
+            else:
+                self.store.set_seasons(show_id, self.scraper.extract_links(result[1]))
+                seasons = self.store.seasons(show_id)
+
+            known_urls = {season['url'] for season in known}
+            recheck = self.settings["recheck_seasons"]
+            # The latest seasons before this check, so one that just stopped being the newest still gets its final episodes
+            previous = [season for season in seasons if season['url'] in known_urls]
+            latest = {season['url'] for season in previous[-recheck:]} if recheck > 0 else set()
+            # A season seen for the first time is fetched without validators
+            to_check = [season for season in seasons if season['url'] not in known_urls or season['url'] in latest]
+            new = await asyncio.gather(*[self.check_season(session, show_id, season, new_state) for season in to_check])
+            failed = new.count(None)
+            span.set(seasons=len(to_check), new=sum(count or 0 for count in new), failed=failed)
+            # Saved last: with the show page answering 304, seasons that are not among the latest would never be looked at again
+            if result is not None and result[1] is not None and not failed:
+                self.store.set_validators(show_id, result[2])
+
+    async def check_season(self, session, show_id, season, new_state):
+        # The number of new episodes, or None when the listing could not be fetched
+        result = await self.fetch(session, season['url'], season.get('etag'), season.get('last_modified'))
+        if result is None:
+            logging.error(f"Failed to check {season['url']}")
+            return None
+        status, listing, headers = result
+        if listing is None:
+            self.store.touch(show_id, season['url'])
+            return 0
+        new = self.store.merge_episodes(show_id, season['url'], self.scraper.extract_file_links(listing), new_state)
+        # Saved after the episodes, so a crash in between only costs a refetch
+        self.store.set_validators(show_id, headers, season['url'])
+        if new and new_state == PENDING:
+            logging.info(f"{len(new)} new episodes in {season['name']}")
+        return len(new)
+
+    def transfers(self, show):
+        show_name = self.scraper.sanitize_filename(show['name'])
+        seasons = {season['url']: season['name'] for season in self.store.seasons(show['id'])}
+        transfers = []
+        for episode in self.store.pending(show['id']):
+            season_name = seasons.get(episode['season_url'], '')
+            file_name = self.scraper.sanitize_filename(episode['name'])
+            path = os.path.join(self.scraper.download_dir, show_name, self.scraper.sanitize_filename(season_name), file_name)
+            transfer = self.runner.transfer(self.scraper, episode['url'], path, show_name, season_name, file_name)
+            transfer.update(job=show['id'], show=show['name'])
+            transfers.append(transfer)
+        return transfers
+
+    async def sync(self):
+        started = time.time()
+        self.requests = 0
+        shows = self.store.shows()
+        async with tracer.span("sync", shows=len(shows)), concurrency_control(self.settings["concurrency"]), shared_session() as session:
+            await asyncio.gather(*[
+                self.check_show(session, show['id'], show['url'], show['etag'], show['last_modified']) for show in shows
+            ])
+            transfers = [transfer for show in shows for transfer in self.transfers(show)]
+            logging.info(f"Checked {len(shows)} shows with {self.requests} requests; {len(transfers)} episodes to download")
+            results = await asyncio.gather(*[self.runner.run_transfer(session, transfer) for transfer in transfers])
+
+        counts = {"downloaded": 0, "skipped": 0, "failed": 0}
+        for transfer, result in zip(transfers, results):
+            counts[result["status"]] += 1
+            # A failed episode stays pending and is retried by the next sync
+            if result["status"] != "failed":
+                self.store.set_state(transfer["job"], transfer["url"], DONE)
+            result["show"] = transfer["show"]
+        return {
+            "ok": counts["failed"] == 0,
+            "started_at": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(started)),
+            "duration_seconds": round(time.time() - started, 3),
+            "shows": len(shows),
+            "listing_requests": self.requests,
+            "transfers": counts,
+            "downloaded_mb": round(sum(result.get("size_mb", 0) for result in results), 3),
+            "files": results
+        }
+
+def print_follows(store):
+    shows = store.shows()
+    if not shows:
+        print("Not following any shows")
+    for show in shows:
+        print(f"{show['name']}: {show['seasons']} seasons, {show['downloaded']} episodes downloaded, "
+              f"{show['pending']} pending, last checked {show['checked_at'] or 'never'}")
+
+async def run_sync(config, download_dir=None, base_url=None, summary_path=None):
+    follow_sync = FollowSync(config, config.get('follow', {}), download_dir, base_url)
+    interval = follow_sync.settings["interval_minutes"] * 60
+    while True:
+        summary = await follow_sync.sync()
+        output = json.dumps(summary, indent=2)
+        if summary_path:
+            with open(summary_path, 'w') as f:
+                f.write(output)
+        else:
+            print(output)
+        if not interval:
+            return EXIT_OK if summary["ok"] else EXIT_FAILURES
+        logging.info(f"Next sync in {follow_sync.settings['interval_minutes']} minutes")
+        await asyncio.sleep(interval)
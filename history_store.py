@@ -0,0 +1,122 @@
+import json
+import logging
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS downloads (
+    id INTEGER PRIMARY KEY,
+    item TEXT NOT NULL,
+    season TEXT NOT NULL DEFAULT '',
+    file TEXT NOT NULL,
+    size_mb REAL,
+    download_time REAL,
+    speed_mbps REAL,
+    downloaded_at TEXT NOT NULL,
+    UNIQUE (item, season, file)
+);
+CREATE INDEX IF NOT EXISTS downloads_file ON downloads (file);
+CREATE INDEX IF NOT EXISTS downloads_downloaded_at ON downloads (downloaded_at);
+"""
+
+class HistoryStore:
+    # One row per downloaded file. Every call opens its own short-lived
+    # connection, so concurrent tasks, threads and processes can all write;
+    # WAL mode lets readers page through history while downloads are recorded.
+    def __init__(self, db_path):
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        with self.connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+
+    @contextmanager
+    def connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA synchronous=NORMAL")
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def record(self, item, season, file, size_mb, download_time, speed_mbps, downloaded_at=None):
+        downloaded_at = downloaded_at or time.strftime("%Y-%m-%d %H:%M:%S")
+        try:
+            with self.connect() as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO downloads (item, season, file, size_mb, download_time, speed_mbps, downloaded_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (item, season or '', file, size_mb, download_time, speed_mbps, downloaded_at)
+                )
+        except sqlite3.Error as e:
+            logging.error(f"Error saving history to {self.db_path}. Error: {str(e)}")
+
+    def lookup(self, item, season=None, file=None):
+        query = "SELECT * FROM downloads WHERE item = ?"
+        params = [item]
+        if season is not None:
+            query += " AND season = ?"
+            params.append(season)
+        if file is not None:
+            query += " AND file = ?"
+            params.append(file)
+        with self.connect() as conn:
+            return [dict(row) for row in conn.execute(query + " ORDER BY season, file", params)]
+
+    def has_file(self, item, season, file):
+        return bool(self.lookup(item, season, file))
+
+    def count(self):
+        with self.connect() as conn:
+            return conn.execute("SELECT COUNT(*) FROM downloads").fetchone()[0]
+
+    def page(self, offset, limit):
+        with self.connect() as conn:
+            rows = conn.execute(
+                "SELECT * FROM downloads ORDER BY item, season, file LIMIT ? OFFSET ?",
+                (limit, offset)
+            )
+            return [dict(row) for row in rows]
+
+    def migrate_json(self, json_path):
+        # One-time import of the old download_history.json, which is then renamed
+        if not os.path.exists(json_path):
+            return 0
+        try:
+            with open(json_path, 'r') as f:
+                history = json.load(f)
+        except (OSError, ValueError) as e:
+            logging.error(f"Could not migrate history file {json_path}: {e}")
+            return 0
+
+        rows = []
+        for item_name, item_data in history.items():
+            if not isinstance(item_data, dict):
+                continue
+            if 'files' in item_data:
+                for file_name, file_data in item_data['files'].items():
+                    rows.append((item_name, '', file_name, file_data, item_data.get('last_download')))
+            else:
+                for season_name, season_data in item_data.items():
+                    if not isinstance(season_data, dict):
+                        continue
+                    for episode_name, episode_data in season_data.get('episodes', {}).items():
+                        rows.append((item_name, season_name, episode_name, episode_data, season_data.get('last_download')))
+
+        with self.connect() as conn:
+            conn.executemany(
+                "INSERT OR IGNORE INTO downloads (item, season, file, size_mb, download_time, speed_mbps, downloaded_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (item, season, file, data.get('size_mb'), data.get('download_time'), data.get('speed_mbps'),
+                     last_download or time.strftime("%Y-%m-%d %H:%M:%S"))
+                    for item, season, file, data, last_download in rows
+                ]
+            )
+        os.replace(json_path, f"{json_path}.migrated")
+        logging.info(f"Migrated {len(rows)} history records from {json_path}")
+        return len(rows)
@@ -0,0 +1,61 @@
+import asyncio
+import ssl
+import logging
+from contextlib import asynccontextmanager
+import aiohttp
+
+DEFAULT_HTTP_SETTINGS = {
+    "limit": 64,
+    "limit_per_host": 16,
+    "keepalive_timeout": 60,
+    "dns_cache_ttl": 300,
+    "connect_timeout": 30,
+    # Limits for listings, HEAD requests and range probes; transfers set their own per request
+    "request_timeout": 300,
+    "read_timeout": 60
+}
+
+http_settings = dict(DEFAULT_HTTP_SETTINGS)
+ssl_context = ssl.create_default_context()
+
+_session = None
+_session_loop = None
+
+def configure_http(settings):
+    # Takes effect the next time the shared session is created
+    http_settings.update({key: value for key, value in (settings or {}).items() if key in DEFAULT_HTTP_SETTINGS})
+
+def get_session():
+    global _session, _session_loop
+    loop = asyncio.get_running_loop()
+    if _session is None or _session.closed or _session_loop is not loop:
+        # One context for every connection so TLS state is shared across the pool
+        connector = aiohttp.TCPConnector(
+            limit=http_settings["limit"],
+            limit_per_host=http_settings["limit_per_host"],
+            keepalive_timeout=http_settings["keepalive_timeout"],
+            use_dns_cache=True,
+            ttl_dns_cache=http_settings["dns_cache_ttl"],
+            ssl=ssl_context
+        )
+        timeout = aiohttp.ClientTimeout(
+            total=http_settings["request_timeout"],
+            sock_connect=http_settings["connect_timeout"],
+            sock_read=http_settings["read_timeout"]
+        )
+        _session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+        _session_loop = loop
+        logging.debug(f"Created shared HTTP session (limit={http_settings['limit']}, per host={http_settings['limit_per_host']})")
+    return _session
+
+@asynccontextmanager
+async def shared_session():
+    # Unlike `async with aiohttp.ClientSession()`, leaving the block keeps the pool open
+    yield get_session()
+
+async def close_session():
+    global _session, _session_loop
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = None
+    _session_loop = None
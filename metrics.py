@@ -0,0 +1,226 @@
+import asyncio
+import logging
+import os
+import time
+from contextlib import contextmanager
+from aiohttp import web
+from download_scheduler import scheduler
+from concurrency_controller import controller
+from retry_policy import retry_policy
+from progress import progress
+from content_index import deduplicator
+
+DEFAULT_METRICS_SETTINGS = {
+    # Serve /metrics over HTTP
+    "listen": False,
+    "host": "127.0.0.1",
+    "port": 9108,
+    # Also (or instead) rewrite this file every write_interval seconds, e.g. for a textfile collector
+    "file": "",
+    "write_interval": 15
+}
+
+PREFIX = "vadscrape_"
+
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+PARSE_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1)
+DURATION_BUCKETS = (1, 5, 15, 30, 60, 120, 300, 600, 1800, 3600, 7200)
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{escape_label(value)}"' for key, value in labels) + "}"
+
+def format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Metric:
+    def __init__(self, name, kind, help_text):
+        self.name = PREFIX + name
+        self.kind = kind
+        self.help = help_text
+
+    def header(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+class Counter(Metric):
+    # Counters are only touched from the event loop, so plain dict updates are safe
+    def __init__(self, name, help_text):
+        super().__init__(name, "counter", help_text)
+        self.values = {}
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def total(self, **labels):
+        # Summed over every series whose labels include the given ones
+        wanted = set(labels.items())
+        return sum(value for key, value in self.values.items() if wanted <= set(key))
+
+    def samples(self):
+        return [f"{self.name}{format_labels(key)} {format_value(value)}" for key, value in sorted(self.values.items())]
+
+class Gauge(Metric):
+    # Read from a callback when the metrics are rendered, so the hot path pays nothing
+    def __init__(self, name, help_text, read):
+        super().__init__(name, "gauge", help_text)
+        self.read = read
+
+    def samples(self):
+        value = self.read()
+        items = value.items() if isinstance(value, dict) else [((), value)]
+        return [f"{self.name}{format_labels(key)} {format_value(amount)}" for key, amount in sorted(items)]
+
+class Histogram(Metric):
+    def __init__(self, name, help_text, buckets=LATENCY_BUCKETS):
+        super().__init__(name, "histogram", help_text)
+        self.buckets = tuple(buckets) + (float("inf"),)
+        self.series = {}
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        series = self.series.get(key)
+        if series is None:
+            series = self.series[key] = [[0] * len(self.buckets), 0.0, 0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[0][i] += 1
+                break
+        series[1] += value
+        series[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(time.monotonic() - started, **labels)
+
+    def totals(self):
+        # (count, sum) over every series
+        return sum(series[2] for series in self.series.values()), sum(series[1] for series in self.series.values())
+
+    def samples(self):
+        lines = []
+        for key, (counts, total, count) in sorted(self.series.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f"{self.name}_bucket{format_labels(key + (('le', format_value(bound)),))} {cumulative}")
+            lines.append(f"{self.name}_sum{format_labels(key)} {format_value(total)}")
+            lines.append(f"{self.name}_count{format_labels(key)} {count}")
+        return lines
+
+def retry_events():
+    # The retry policy's own counters, minus the per-host breakdowns
+    return {(("event", key),): value for key, value in retry_policy.stats().items() if ':' not in key}
+
+def open_circuits():
+    return {(("host", host),): int(state.breaker_open) for host, state in retry_policy.hosts.items()}
+
+class Metrics:
+    def __init__(self):
+        self.bytes_downloaded = Counter("downloaded_bytes_total", "Bytes received by file transfers")
+        self.downloads = Counter("downloads_total", "Finished file transfers by result")
+        self.first_byte = Histogram("download_first_byte_seconds", "Time from sending a download request to its response headers")
+        self.retries = Counter("retries_total", "Failed requests that were retried, by kind and cause")
+        self.throttled = Counter("http_429_total", "HTTP 429 responses, by kind")
+        self.stalls = Counter("stalls_total", "Transfers restarted because no data arrived")
+        self.listing_fetch = Histogram("listing_fetch_seconds", "Directory listing requests sent to the server, by HTTP status")
+        self.listing_parse = Histogram("listing_parse_seconds", "Time spent parsing directory listings", PARSE_BUCKETS)
+        self.item_download = Histogram("item_download_seconds", "Time to download a season, movie or folder", DURATION_BUCKETS)
+        self.metrics = [
+            self.bytes_downloaded, self.downloads, self.first_byte, self.retries, self.throttled, self.stalls,
+            self.listing_fetch, self.listing_parse, self.item_download,
+            Gauge("transfers_active", "Transfers holding a scheduler slot", lambda: scheduler.active),
+            Gauge("transfers_queued", "Transfers waiting for a scheduler slot", lambda: len(scheduler.waiting)),
+            Gauge("transfers_limit", "Current concurrent transfer limit", lambda: scheduler.max_active),
+            Gauge("bytes_in_flight", "Expected size of the active transfers", lambda: scheduler.bytes_in_flight),
+            Gauge("download_speed_bytes", "Smoothed aggregate download speed in bytes per second", lambda: progress.speed),
+            Gauge("auto_concurrency_best_bytes", "Best throughput seen by the auto concurrency controller",
+                  lambda: controller.best_throughput if controller.running else 0),
+            Gauge("retry_policy_events", "Retry policy counters since startup", retry_events),
+            Gauge("circuit_open", "1 while a host's circuit breaker is open", open_circuits),
+            Gauge("dedup_saved_bytes", "Bytes linked from files already in the library instead of downloaded", lambda: deduplicator.saved_bytes)
+        ]
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.header())
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+metrics = Metrics()
+
+async def handle_metrics(request):
+    return web.Response(text=metrics.render(), content_type="text/plain", charset="utf-8")
+
+class MetricsExporter:
+    def __init__(self, settings=None):
+        self.settings = dict(DEFAULT_METRICS_SETTINGS)
+        self.configure(settings)
+        self.runner = None
+        self.task = None
+
+    def configure(self, settings):
+        self.settings.update({key: value for key, value in (settings or {}).items() if key in DEFAULT_METRICS_SETTINGS})
+
+    async def start(self):
+        if self.settings["listen"] and self.runner is None:
+            app = web.Application()
+            app.router.add_get('/metrics', handle_metrics)
+            self.runner = web.AppRunner(app)
+            await self.runner.setup()
+            try:
+                await web.TCPSite(self.runner, self.settings["host"], self.settings["port"]).start()
+                logging.info(f"Metrics available at http://{self.settings['host']}:{self.settings['port']}/metrics")
+            except OSError as e:
+                logging.error(f"Cannot serve metrics on port {self.settings['port']}: {e}")
+                await self.runner.cleanup()
+                self.runner = None
+        if self.settings["file"] and self.task is None:
+            self.task = asyncio.create_task(self._write_periodically())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+            self.write_file()
+        if self.runner is not None:
+            await self.runner.cleanup()
+            self.runner = None
+
+    async def _write_periodically(self):
+        while True:
+            self.write_file()
+            await asyncio.sleep(self.settings["write_interval"])
+
+    def write_file(self):
+        # Written beside the target and renamed, so a scraper never reads half a file
+        path = self.settings["file"]
+        try:
+            with open(f"{path}.tmp", 'w') as f:
+                f.write(metrics.render())
+            os.replace(f"{path}.tmp", path)
+        except OSError as e:
+            logging.error(f"Cannot write metrics file {path}: {e}")
+
+exporter = MetricsExporter()
+
+def configure_metrics(settings):
+    exporter.configure(settings)
+
+def get_metrics():
+    return metrics
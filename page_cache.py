@@ -0,0 +1,185 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import re
+import time
+from collections import OrderedDict
+
+DEFAULT_PAGE_CACHE_SETTINGS = {
+    "enabled": True,
+    "directory": ".cache/pages",
+    "memory_entries": 256,
+    "default_ttl": 600,
+    "max_age_days": 7,
+    "ttl_rules": [
+        {"pattern": "/s/", "ttl": 300}
+    ]
+}
+
+# Handed to callers waiting on a fetch whose own caller was cancelled
+ABANDONED = object()
+
+class PageCache:
+    # In-memory LRU in front of one JSON file per URL. Stale entries are
+    # revalidated with ETag / Last-Modified, and concurrent requests for the
+    # same URL share a single fetch.
+    def __init__(self, directory, memory_entries=256, default_ttl=600, ttl_rules=None, enabled=True):
+        self.directory = directory
+        self.memory_entries = memory_entries
+        self.default_ttl = default_ttl
+        self.ttl_rules = [(re.compile(rule["pattern"]), rule["ttl"]) for rule in (ttl_rules or [])]
+        self.enabled = enabled
+        self.memory = OrderedDict()
+        self.inflight = {}
+        self.hits = 0
+        self.revalidations = 0
+        self.misses = 0
+
+    def ttl_for(self, url):
+        for pattern, ttl in self.ttl_rules:
+            if pattern.search(url):
+                return ttl
+        return self.default_ttl
+
+    def _disk_path(self, url):
+        return os.path.join(self.directory, hashlib.sha1(url.encode()).hexdigest() + ".json")
+
+    def _load_from_disk(self, url):
+        try:
+            with open(self._disk_path(url), 'r') as f:
+                entry = json.load(f)
+            return entry if entry.get("url") == url else None
+        except (OSError, ValueError):
+            return None
+
+    def _save_to_disk(self, entry):
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            path = self._disk_path(entry["url"])
+            with open(f"{path}.tmp", 'w') as f:
+                json.dump(entry, f)
+            os.replace(f"{path}.tmp", path)
+        except OSError as e:
+            logging.error(f"Error writing page cache entry: {e}")
+
+    def _remember(self, url, entry):
+        self.memory[url] = entry
+        self.memory.move_to_end(url)
+        while len(self.memory) > self.memory_entries:
+            self.memory.popitem(last=False)
+
+    def get_entry(self, url):
+        entry = self.memory.get(url)
+        if entry is not None:
+            self.memory.move_to_end(url)
+            return entry
+        entry = self._load_from_disk(url)
+        if entry is not None:
+            self._remember(url, entry)
+        return entry
+
+    def is_fresh(self, entry):
+        return time.time() - entry["fetched_at"] < self.ttl_for(entry["url"])
+
+    def invalidate(self, url):
+        self.memory.pop(url, None)
+        try:
+            os.remove(self._disk_path(url))
+        except OSError:
+            pass
+
+    def prune(self, max_age_days):
+        if not os.path.isdir(self.directory):
+            return
+        cutoff = time.time() - max_age_days * 86400
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+            except OSError:
+                pass
+
+    async def fetch(self, url, fetcher):
+        # fetcher(conditional_headers) -> (status, text, response_headers), or None on failure
+        if not self.enabled:
+            result = await fetcher({})
+            return None if result is None else {"url": url, "body": result[1]}
+
+        entry = self.get_entry(url)
+        if entry is not None and self.is_fresh(entry):
+            self.hits += 1
+            return entry
+
+        while url in self.inflight:
+            shared = await asyncio.shield(self.inflight[url])
+            if shared is not ABANDONED:
+                return shared
+
+        future = asyncio.get_running_loop().create_future()
+        self.inflight[url] = future
+        try:
+            entry = await self._refresh(url, entry, fetcher)
+            future.set_result(entry)
+            return entry
+        except asyncio.CancelledError:
+            # Only this caller was cancelled; the others wake up and fetch the page themselves
+            future.set_result(ABANDONED)
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Mark the exception as retrieved in case nobody else was waiting
+            future.exception()
+            raise
+        finally:
+            del self.inflight[url]
+
+    async def _refresh(self, url, entry, fetcher):
+        conditional_headers = {}
+        if entry is not None:
+            if entry.get("etag"):
+                conditional_headers["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified"):
+                conditional_headers["If-Modified-Since"] = entry["last_modified"]
+
+        result = await fetcher(conditional_headers)
+        if result is None:
+            # Serve the stale copy rather than nothing when the site is unreachable
+            return entry
+
+        status, text, headers = result
+        if status == 304 and entry is not None:
+            self.revalidations += 1
+            entry = dict(entry, fetched_at=time.time())
+        else:
+            self.misses += 1
+            entry = {
+                "url": url,
+                "body": text,
+                "etag": headers.get("ETag"),
+                "last_modified": headers.get("Last-Modified"),
+                "fetched_at": time.time()
+            }
+        self._remember(url, entry)
+        disk_entry = {key: value for key, value in entry.items() if key != "parsed"}
+        await asyncio.get_running_loop().run_in_executor(None, self._save_to_disk, disk_entry)
+        return entry
+
+page_cache = PageCache(DEFAULT_PAGE_CACHE_SETTINGS["directory"], ttl_rules=DEFAULT_PAGE_CACHE_SETTINGS["ttl_rules"])
+
+def configure_page_cache(settings):
+    global page_cache
+    merged = dict(DEFAULT_PAGE_CACHE_SETTINGS, **(settings or {}))
+    page_cache = PageCache(
+        os.path.expanduser(merged["directory"]),
+        memory_entries=merged["memory_entries"],
+        default_ttl=merged["default_ttl"],
+        ttl_rules=merged["ttl_rules"],
+        enabled=merged["enabled"]
+    )
+    page_cache.prune(merged["max_age_days"])
+
+def get_page_cache():
+    return page_cache
@@ -0,0 +1,204 @@
+import asyncio
+import logging
+import shutil
+import sys
+import time
+
+DEFAULT_PROGRESS_SETTINGS = {
+    # "auto" draws the dashboard on a terminal and summary lines otherwise
+    "mode": "auto",
+    "refresh_interval": 0.5,
+    "summary_interval": 10,
+    "max_rows": 8
+}
+
+MODES = ("auto", "dashboard", "lines")
+
+# Weight of the newest sample in the smoothed speeds
+SPEED_SMOOTHING = 0.3
+
+def format_size(size):
+    for unit in ("B", "KB", "MB", "GB"):
+        if size < 1024 or unit == "GB":
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+
+def format_eta(seconds):
+    if seconds is None:
+        return "--"
+    seconds = int(seconds)
+    if seconds < 60:
+        return f"{seconds}s"
+    if seconds < 3600:
+        return f"{seconds // 60}m {seconds % 60:02d}s"
+    return f"{seconds // 3600}h {seconds // 60 % 60:02d}m"
+
+class Transfer:
+    # Byte counters for one file. update() only adds to an integer; all
+    # formatting and terminal output happens in the renderer.
+    def __init__(self, tracker, name, total, initial=0):
+        self.tracker = tracker
+        self.name = name
+        self.total = total or 0
+        self.done = initial
+        self.sampled = initial
+        self.speed = 0
+        self.status = ""
+        # The transfer's control handle, once attached
+        self.control = None
+
+    def update(self, amount):
+        self.done += amount
+        self.tracker.bytes += amount
+
+    def set_status(self, status):
+        self.status = status
+
+    def close(self):
+        self.tracker.finish(self)
+
+    def sample(self, elapsed):
+        rate = (self.done - self.sampled) / elapsed
+        self.sampled = self.done
+        self.speed = rate if not self.speed else SPEED_SMOOTHING * rate + (1 - SPEED_SMOOTHING) * self.speed
+
+class ProgressTracker:
+    # Collects the counters of every active transfer and redraws one compact
+    # dashboard at a fixed rate, or logs a summary line now and then when
+    # stdout is not a terminal.
+    def __init__(self, settings=None, stream=None):
+        self.settings = dict(DEFAULT_PROGRESS_SETTINGS)
+        self.configure(settings)
+        self.stream = stream or sys.stdout
+        self.transfers = []
+        self.bytes = 0
+        self.completed = 0
+        self.speed = 0
+        self.drawn_lines = 0
+        self.task = None
+
+    def configure(self, settings):
+        self.settings.update({key: value for key, value in (settings or {}).items() if key in DEFAULT_PROGRESS_SETTINGS})
+        if self.settings["mode"] not in MODES:
+            logging.warning(f"Unknown progress mode {self.settings['mode']!r}; using auto")
+            self.settings["mode"] = "auto"
+
+    @property
+    def dashboard(self):
+        if self.settings["mode"] == "auto":
+            return self.stream.isatty()
+        return self.settings["mode"] == "dashboard"
+
+    def start(self, name, total, initial=0):
+        transfer = Transfer(self, name, total, initial)
+        self.transfers.append(transfer)
+        if self.task is None or self.task.done():
+            self.task = asyncio.get_running_loop().create_task(self._run())
+        return transfer
+
+    def finish(self, transfer):
+        if transfer in self.transfers:
+            self.transfers.remove(transfer)
+            if transfer.done >= transfer.total:
+                self.completed += 1
+
+    async def _run(self):
+        # Runs while transfers are active and exits, clearing the dashboard, once they are all done
+        interval = self.settings["refresh_interval"] if self.dashboard else 1
+        last_sample = time.monotonic()
+        last_summary = last_sample
+        last_bytes = self.bytes
+        try:
+            while self.transfers:
+                await asyncio.sleep(interval)
+                now = time.monotonic()
+                elapsed = now - last_sample
+                rate = (self.bytes - last_bytes) / elapsed
+                self.speed = rate if not self.speed else SPEED_SMOOTHING * rate + (1 - SPEED_SMOOTHING) * self.speed
+                last_sample = now
+                last_bytes = self.bytes
+                for transfer in self.transfers:
+                    transfer.sample(elapsed)
+                if self.dashboard:
+                    self.draw()
+                elif now - last_summary >= self.settings["summary_interval"] and self.transfers:
+                    last_summary = now
+                    logging.info(self.summary_line())
+        finally:
+            self.clear()
+            self.speed = 0
+
+    def totals(self):
+        done = sum(transfer.done for transfer in self.transfers)
+        total = sum(max(transfer.total, transfer.done) for transfer in self.transfers)
+        eta = (total - done) / self.speed if self.speed > 0 and total else None
+        return done, total, eta
+
+    def summary_line(self):
+        done, total, eta = self.totals()
+        paused = sum(1 for transfer in self.transfers if transfer.control is not None and transfer.control.state == "paused")
+        return (f"Progress: {len(self.transfers)} active, {f'{paused} paused, ' if paused else ''}{self.completed} finished, "
+                f"{format_size(done)} / {format_size(total)}, {format_size(self.speed)}/s, ETA {format_eta(eta)}")
+
+    def row(self, transfer, width):
+        total = max(transfer.total, transfer.done)
+        fraction = transfer.done / total if total else 0
+        eta = (total - transfer.done) / transfer.speed if transfer.speed > 0 and total else None
+        stats = f" {fraction:4.0%} {format_size(transfer.done)}/{format_size(total)} {format_size(transfer.speed)}/s ETA {format_eta(eta)}"
+        if transfer.control is not None and transfer.control.state != "running":
+            stats += f" {transfer.control.state}"
+        elif transfer.status:
+            stats += f" {transfer.status}"
+        bar_width = 20 if width >= 80 else 10
+        # Numbered like the download controls expect
+        label = f"{transfer.control.id} {transfer.name}" if transfer.control is not None else transfer.name
+        name_width = max(10, width - len(stats) - bar_width - 4)
+        name = label if len(label) <= name_width else label[:name_width - 3] + "..."
+        filled = int(fraction * bar_width)
+        return f"{name:<{name_width}} [{'#' * filled}{'-' * (bar_width - filled)}]{stats}"[:width]
+
+    def render(self):
+        width = shutil.get_terminal_size((100, 20)).columns - 1
+        lines = [self.summary_line()[:width]]
+        rows = self.settings["max_rows"]
+        for transfer in self.transfers[:rows]:
+            lines.append(self.row(transfer, width))
+        if len(self.transfers) > rows:
+            lines.append(f"... and {len(self.transfers) - rows} more")
+        return lines
+
+    def draw(self):
+        lines = self.render()
+        output = self._erase() + "\n".join(lines) + "\n"
+        self.stream.write(output)
+        self.stream.flush()
+        self.drawn_lines = len(lines)
+
+    def _erase(self):
+        # Cursor up over the previous dashboard, then clear to the end of the screen
+        return f"\x1b[{self.drawn_lines}F\x1b[J" if self.drawn_lines else ""
+
+    def clear(self):
+        if self.drawn_lines:
+            self.stream.write(self._erase())
+            self.stream.flush()
+            self.drawn_lines = 0
+
+    def write(self, message):
+        # print() for messages shown while transfers run, so they scroll above the dashboard
+        self.clear()
+        print(message, file=self.stream)
+
+class ProgressLogHandler(logging.StreamHandler):
+    # Removes the dashboard before a log line is written; the next refresh draws it again below
+    def emit(self, record):
+        progress.clear()
+        super().emit(record)
+
+progress = ProgressTracker()
+
+def configure_progress(settings):
+    progress.configure(settings)
+
+def get_progress():
+    return progress
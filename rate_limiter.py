@@ -0,0 +1,141 @@
+import asyncio
+import logging
+import time
+from urllib.parse import urlparse
+
+DEFAULT_BANDWIDTH_SETTINGS = {
+    "global_limit_mbps": 0,
+    "per_host_limit_mbps": 0,
+    "schedule": []
+}
+
+SCHEDULE_CHECK_INTERVAL = 30
+
+class TokenBucket:
+    # Tokens are bytes. A consumer may overdraw the bucket by one chunk and
+    # then sleeps off the debt while holding the lock; the lock is FIFO, so
+    # concurrent transfers take turns and share the rate evenly.
+    def __init__(self, rate=0, burst=None):
+        self.rate = 0
+        self.burst = 0
+        self.tokens = 0
+        self.updated = time.monotonic()
+        self.lock = None
+        self.lock_loop = None
+        self.set_rate(rate, burst)
+
+    def set_rate(self, rate, burst=None):
+        self._refill()
+        self.rate = max(0, rate)
+        # One second of traffic at most, so an idle period cannot be spent as a burst later
+        self.burst = burst or self.rate
+        self.tokens = min(self.tokens, self.burst)
+
+    def _get_lock(self):
+        loop = asyncio.get_running_loop()
+        if self.lock is None or self.lock_loop is not loop:
+            self.lock = asyncio.Lock()
+            self.lock_loop = loop
+        return self.lock
+
+    def _refill(self):
+        now = time.monotonic()
+        if self.rate > 0:
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def consume(self, amount):
+        if self.rate <= 0:
+            return
+        async with self._get_lock():
+            self._refill()
+            self.tokens -= amount
+            # Sleep in short steps so a limit changed at runtime takes effect mid-wait
+            while self.tokens < 0 and self.rate > 0:
+                await asyncio.sleep(min(0.5, -self.tokens / self.rate))
+                self._refill()
+
+class RateLimiter:
+    def __init__(self, settings=None):
+        self.settings = dict(DEFAULT_BANDWIDTH_SETTINGS)
+        self.global_bucket = TokenBucket()
+        self.host_buckets = {}
+        self.global_limit = 0
+        self.per_host_limit = 0
+        self.next_schedule_check = 0
+        self.configure(settings)
+
+    def configure(self, settings):
+        self.settings.update({key: value for key, value in (settings or {}).items() if key in DEFAULT_BANDWIDTH_SETTINGS})
+        self.next_schedule_check = 0
+        self.apply_schedule()
+
+    def set_limits(self, global_limit_mbps=None, per_host_limit_mbps=None):
+        # Changes the base limits at runtime; an active schedule window still overrides them
+        if global_limit_mbps is not None:
+            self.settings["global_limit_mbps"] = global_limit_mbps
+        if per_host_limit_mbps is not None:
+            self.settings["per_host_limit_mbps"] = per_host_limit_mbps
+        self.next_schedule_check = 0
+        self.apply_schedule()
+
+    def active_limits(self, now=None):
+        now = now or time.localtime()
+        minute = now.tm_hour * 60 + now.tm_min
+        global_limit = self.settings["global_limit_mbps"]
+        per_host_limit = self.settings["per_host_limit_mbps"]
+        for window in self.settings["schedule"]:
+            try:
+                start = parse_clock(window["start"])
+                end = parse_clock(window["end"])
+            except (KeyError, ValueError) as e:
+                logging.warning(f"Ignoring invalid bandwidth schedule entry {window}: {e}")
+                continue
+            # Windows may wrap past midnight, e.g. 22:00-06:00
+            inside = start <= minute < end if start <= end else minute >= start or minute < end
+            if inside:
+                global_limit = window.get("global_limit_mbps", global_limit)
+                per_host_limit = window.get("per_host_limit_mbps", per_host_limit)
+                break
+        return global_limit, per_host_limit
+
+    def apply_schedule(self):
+        if time.monotonic() < self.next_schedule_check:
+            return
+        self.next_schedule_check = time.monotonic() + SCHEDULE_CHECK_INTERVAL
+        global_limit, per_host_limit = self.active_limits()
+        if (global_limit, per_host_limit) == (self.global_limit, self.per_host_limit):
+            return
+        self.global_limit = global_limit
+        self.per_host_limit = per_host_limit
+        self.global_bucket.set_rate(global_limit * 1024 * 1024)
+        for bucket in self.host_buckets.values():
+            bucket.set_rate(per_host_limit * 1024 * 1024)
+        logging.info(f"Bandwidth limits: {format_limit(global_limit)} total, {format_limit(per_host_limit)} per host")
+
+    def host_bucket(self, url):
+        host = urlparse(url).netloc
+        if host not in self.host_buckets:
+            self.host_buckets[host] = TokenBucket(self.per_host_limit * 1024 * 1024)
+        return self.host_buckets[host]
+
+    async def throttle(self, url, amount):
+        self.apply_schedule()
+        if self.per_host_limit > 0:
+            await self.host_bucket(url).consume(amount)
+        await self.global_bucket.consume(amount)
+
+def parse_clock(value):
+    hours, minutes = value.split(':')
+    return int(hours) * 60 + int(minutes)
+
+def format_limit(limit):
+    return f"{limit} MB/s" if limit else "unlimited"
+
+rate_limiter = RateLimiter()
+
+def configure_bandwidth(settings):
+    rate_limiter.configure(settings)
+
+def get_rate_limiter():
+    return rate_limiter
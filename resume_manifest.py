@@ -0,0 +1,163 @@
+import json
+import logging
+import os
+import zlib
+
+BLOCK_SIZE = 4 * 1024 * 1024
+
+class ResumeManifest:
+    # Sidecar for a partial download (`<data file>.manifest`). It records the
+    # remote file's identity and a CRC-32 for every complete block written so
+    # far, so a resume can prove the data on disk is still good and restart
+    # from the last verified block instead of trusting the file size.
+    def __init__(self, data_path, url=None, remote_size=0, etag=None, last_modified=None, offset=0, block_size=BLOCK_SIZE, blocks=None):
+        self.data_path = data_path
+        self.url = url
+        self.remote_size = remote_size
+        self.etag = etag
+        self.last_modified = last_modified
+        self.offset = offset
+        self.block_size = block_size
+        self.blocks = blocks or []
+        # CRC of the block currently being written; only complete blocks are saved
+        self.partial_crc = 0
+        self.partial_length = 0
+
+    @property
+    def path(self):
+        return f"{self.data_path}.manifest"
+
+    @classmethod
+    def load(cls, data_path):
+        try:
+            with open(f"{data_path}.manifest", 'r') as f:
+                data = json.load(f)
+            blocks = data.get("blocks", "")
+            return cls(
+                data_path,
+                url=data.get("url"),
+                remote_size=data.get("remote_size", 0),
+                etag=data.get("etag"),
+                last_modified=data.get("last_modified"),
+                offset=data.get("offset", 0),
+                block_size=data.get("block_size", BLOCK_SIZE),
+                blocks=[int(blocks[i:i + 8], 16) for i in range(0, len(blocks), 8)]
+            )
+        except (OSError, ValueError) as e:
+            if not isinstance(e, FileNotFoundError):
+                logging.warning(f"Ignoring unreadable resume manifest for {data_path}: {e}")
+            return None
+
+    def save(self):
+        data = {
+            "url": self.url,
+            "remote_size": self.remote_size,
+            "etag": self.etag,
+            "last_modified": self.last_modified,
+            "offset": self.offset,
+            "block_size": self.block_size,
+            "blocks": ''.join(f"{crc:08x}" for crc in self.blocks)
+        }
+        with open(f"{self.path}.tmp", 'w') as f:
+            json.dump(data, f)
+        os.replace(f"{self.path}.tmp", self.path)
+
+    def remove(self):
+        for path in (self.path, f"{self.path}.tmp"):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def reset(self, remote_size=0, etag=None, last_modified=None):
+        self.remote_size = remote_size
+        self.etag = etag
+        self.last_modified = last_modified
+        self.blocks = []
+        self.partial_crc = 0
+        self.partial_length = 0
+
+    def set_remote(self, response):
+        self.etag = response.headers.get('ETag') or self.etag
+        self.last_modified = response.headers.get('Last-Modified') or self.last_modified
+
+    def matches_remote(self, remote_size, etag):
+        if self.remote_size and remote_size and self.remote_size != remote_size:
+            return False
+        if self.etag and etag and self.etag != etag:
+            return False
+        return True
+
+    def if_range_header(self):
+        # Makes the server send the whole file (200) instead of a range if it changed
+        return self.etag or self.last_modified
+
+    def update(self, data):
+        view = memoryview(data)
+        while view:
+            take = min(len(view), self.block_size - self.partial_length)
+            self.partial_crc = zlib.crc32(view[:take], self.partial_crc)
+            self.partial_length += take
+            view = view[take:]
+            if self.partial_length == self.block_size:
+                self.blocks.append(self.partial_crc)
+                self.partial_crc = 0
+                self.partial_length = 0
+
+    def verified_length(self):
+        return len(self.blocks) * self.block_size
+
+    def validate(self):
+        # Torn writes show up at the tail, so check blocks from the end and stop
+        # at the first one that matches. An intact file costs a single block read.
+        size = os.path.getsize(self.data_path) if os.path.exists(self.data_path) else 0
+        if size == 0:
+            self.reset(self.remote_size, self.etag, self.last_modified)
+            return 0
+        good_blocks = min(len(self.blocks), size // self.block_size)
+        with open(self.data_path, 'r+b') as f:
+            while good_blocks > 0:
+                f.seek((good_blocks - 1) * self.block_size)
+                if zlib.crc32(f.read(self.block_size)) == self.blocks[good_blocks - 1]:
+                    break
+                logging.warning(f"Block {good_blocks - 1} of {self.data_path} failed verification")
+                good_blocks -= 1
+            self.blocks = self.blocks[:good_blocks]
+            good_length = good_blocks * self.block_size
+            if size != good_length:
+                f.truncate(good_length)
+        self.partial_crc = 0
+        self.partial_length = 0
+        return good_length
+
+    def rebuild(self):
+        # Adopt a partial file written before manifests existed: hash its complete
+        # blocks and drop the unverifiable tail
+        self.blocks = []
+        with open(self.data_path, 'r+b') as f:
+            while True:
+                block = f.read(self.block_size)
+                if len(block) < self.block_size:
+                    break
+                self.blocks.append(zlib.crc32(block))
+            f.truncate(self.verified_length())
+        self.partial_crc = 0
+        self.partial_length = 0
+        return self.verified_length()
+
+    def absorb(self, other):
+        # Stitching appends a finished segment, so its blocks continue this manifest
+        self.blocks.extend(other.blocks)
+
+def prepare_resume(data_path, url, offset=0):
+    # Returns the manifest and the number of verified bytes to keep in data_path
+    manifest = ResumeManifest.load(data_path)
+    if not os.path.exists(data_path):
+        if manifest:
+            manifest.remove()
+        return ResumeManifest(data_path, url=url, offset=offset), 0
+    if manifest is None or manifest.offset != offset:
+        manifest = ResumeManifest(data_path, url=url, offset=offset)
+        good_length = manifest.rebuild()
+    else:
+        good_length = manifest.validate()
+    manifest.save()
+    return manifest, good_length
@@ -0,0 +1,146 @@
+import asyncio
+import logging
+import random
+import time
+from collections import Counter
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+from tracing import tracer
+
+DEFAULT_RETRY_SETTINGS = {
+    "base_delay": 1,
+    "max_delay": 300,
+    # Consecutive failures against one host before its circuit opens
+    "breaker_threshold": 5,
+    "breaker_cooldown": 30
+}
+
+class HostState:
+    def __init__(self):
+        self.paused_until = 0
+        self.delay = 0
+        self.failures = 0
+        self.breaker_open = False
+        self.probing = False
+        self.probe_started = 0
+
+class RetryPolicy:
+    # Shared by listing fetches and downloads. A 429 pauses every request to
+    # that host, for Retry-After seconds when the server sends it and otherwise
+    # for a decorrelated-jitter delay that grows with each throttle. Repeated
+    # failures open the host's circuit: after the cooldown a single probe
+    # request goes through and its result closes or reopens the circuit.
+    def __init__(self, settings=None):
+        self.settings = dict(DEFAULT_RETRY_SETTINGS)
+        self.hosts = {}
+        self.counters = Counter()
+        self.configure(settings)
+
+    def configure(self, settings):
+        self.settings.update({key: value for key, value in (settings or {}).items() if key in DEFAULT_RETRY_SETTINGS})
+
+    def host_state(self, url):
+        host = urlparse(url).netloc
+        if host not in self.hosts:
+            self.hosts[host] = HostState()
+        return self.hosts[host]
+
+    def next_delay(self, previous=0, base=None):
+        # Decorrelated jitter: a random delay between the base and three times the previous one
+        base = self.settings["base_delay"] if base is None else base
+        return min(self.settings["max_delay"], random.uniform(base, max(base, previous * 3)))
+
+    def retry_after(self, response):
+        value = response.headers.get('Retry-After')
+        if not value:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+    async def before_request(self, url):
+        state = self.host_state(url)
+        started = time.monotonic()
+        try:
+            while True:
+                wait = state.paused_until - time.monotonic()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                    continue
+                if not state.breaker_open:
+                    return
+                # A probe whose caller never reported back is given up on after one cooldown
+                if not state.probing or time.monotonic() - state.probe_started > self.settings["breaker_cooldown"]:
+                    state.probing = True
+                    state.probe_started = time.monotonic()
+                    logging.info(f"Circuit half-open for {urlparse(url).netloc}, sending a probe request")
+                    return
+                # Another request is probing the host; wait for its verdict
+                await asyncio.sleep(0.5)
+        finally:
+            waited = time.monotonic() - started
+            if waited > 0.001:
+                tracer.record("host_wait", waited, host=urlparse(url).netloc)
+
+    def on_success(self, url):
+        state = self.host_state(url)
+        if state.breaker_open:
+            logging.info(f"Circuit closed for {urlparse(url).netloc}")
+        state.failures = 0
+        state.delay = 0
+        state.breaker_open = False
+        state.probing = False
+
+    def on_throttle(self, url, response):
+        state = self.host_state(url)
+        host = urlparse(url).netloc
+        self.counters["throttled"] += 1
+        self.counters[f"throttled:{host}"] += 1
+        remaining = state.paused_until - time.monotonic()
+        if remaining > 0:
+            # Sent before the host was paused; the pause already covers it
+            return remaining
+        delay = self.retry_after(response)
+        if delay is not None:
+            self.counters["retry_after_honored"] += 1
+            delay = min(delay, self.settings["max_delay"])
+        else:
+            state.delay = self.next_delay(state.delay)
+            delay = state.delay
+        self._record_failure(state, host)
+        # Only push the pause further out; a concurrent throttle may already have set a longer one
+        state.paused_until = max(state.paused_until, time.monotonic() + delay)
+        return delay
+
+    def on_failure(self, url, previous_delay=0, base=None):
+        state = self.host_state(url)
+        host = urlparse(url).netloc
+        self.counters["retries"] += 1
+        self.counters[f"retries:{host}"] += 1
+        self._record_failure(state, host)
+        return self.next_delay(previous_delay, base)
+
+    def _record_failure(self, state, host):
+        state.failures += 1
+        if state.probing or (not state.breaker_open and state.failures >= self.settings["breaker_threshold"]):
+            state.breaker_open = True
+            state.probing = False
+            state.paused_until = max(state.paused_until, time.monotonic() + self.settings["breaker_cooldown"])
+            self.counters["breaker_opened"] += 1
+            logging.warning(f"Circuit open for {host} after {state.failures} failures; pausing requests for {self.settings['breaker_cooldown']} seconds")
+
+    def stats(self):
+        return dict(self.counters)
+
+retry_policy = RetryPolicy()
+
+def configure_retry(settings):
+    retry_policy.configure(settings)
+
+def get_retry_policy():
+    return retry_policy
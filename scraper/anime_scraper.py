@@ -1,47 +1,28 @@
 from .base_scraper import BaseScraper
-from urllib.parse import quote, urljoin
+from urllib.parse import quote
 import os
 import logging
 from colorama import Fore, Style
-import time
-from file_downloader import download_file, terminate
-import aiohttp
+from http_client import shared_session
+from transfer_control import control_console
+from concurrency_controller import concurrency_control
+from metrics import metrics
+from tracing import tracer
 import asyncio
 
 class AnimeScraper(BaseScraper):
-    def extract_links(self, soup):
-        elements = soup.find_all('div', class_='centerflex name-div')
-        links = []
-
-        for element in elements:
-            link = element.find('a', href=True)
-            if link:
-                href = urljoin(self.base_url, link['href'])
-                name = link.get_text(separator=' ', strip=True)
-                if name.lower() != "parent directory":
-                    links.append({'name': name, 'url': href})
-
-        return links
-
-    def extract_file_links(self, soup):
-        elements = soup.find_all('a', class_='file-entry wrap')
-        links = []
-
-        for element in elements:
-            href = urljoin(self.base_url, element['href'])
-            name = element.get_text(separator=' ', strip=True)
-            links.append({'name': name, 'url': href})
-
-        return links
+    # Upper bounds for download_folder; the scheduler still decides how many transfer at once
+    download_workers = 32
+    file_queue_size = 256
 
     async def navigate_folders(self, session, url, path_so_far=[]):
-        soup = await self.fetch_page(session, url)
-        if not soup:
+        listing = await self.fetch_page(session, url)
+        if not listing:
             logging.error(f"Failed to fetch page: {url}")
             return None
 
-        links = self.extract_links(soup)
-        files = self.extract_file_links(soup)
+        links = self.extract_links(listing)
+        files = self.extract_file_links(listing)
 
         if files:
             return {'type': 'files', 'url': url, 'files': files, 'path': path_so_far}
@@ -65,74 +46,21 @@ class AnimeScraper(BaseScraper):
                     return {'type': 'back'}
             print(f"{Fore.RED}Invalid choice. Please try again.{Style.RESET_ALL}")
 
-    async def download_folder(self, session, url, folder_path, concurrency):
-        soup = await self.fetch_page(session, url)
-        if not soup:
-            logging.error(f"Failed to fetch folder page: {url}")
-            return
-
-        files = self.extract_file_links(soup)
-        links = self.extract_links(soup)
-
-        # Download subfolders recursively
-        subfolder_tasks = [
-            self.download_folder(session, link['url'], os.path.join(folder_path, self.sanitize_filename(link['name'])), concurrency)
-            for link in links
-        ]
-        await asyncio.gather(*subfolder_tasks)
-
-        # Download files in the current folder
-        if files:
-            os.makedirs(folder_path, exist_ok=True)
-            semaphore = asyncio.Semaphore(concurrency)
-            download_tasks = [
-                self.download_file_with_semaphore(session, file['url'], os.path.join(folder_path, self.sanitize_filename(file['name'])), semaphore)
-                for file in files
-            ]
-            await asyncio.gather(*download_tasks)
-
-    async def download_file_with_semaphore(self, session, url, path, semaphore):
-        async with semaphore:
-            await self.download_file(session, url, path)
-
-    async def download_file(self, session, url, path):
-        expected_size = await self.get_file_size(session, url)
-        result = await download_file(session, url, path, expected_size)
-        if result:
-            print(f"{Fore.GREEN}Successfully downloaded: {os.path.basename(path)}{Style.RESET_ALL}")
-        else:
-            print(f"{Fore.RED}Failed to download: {os.path.basename(path)}{Style.RESET_ALL}")
-
-    async def get_file_size(self, session, url):
-        try:
-            async with session.head(url) as response:
-                if response.status == 200:
-                    return int(response.headers.get('Content-Length', 0))
-        except aiohttp.ClientError as e:
-            logging.error(f"Error fetching file size: {e}")
-        return 0
-
-    async def download_file(self, session, url, path):
-        expected_size = await self.get_file_size(session, url)
-        result = await download_file(session, url, path, expected_size)
-        if result:
-            downloaded_path, download_time, speed_mbps = result
-            print(f"{Fore.GREEN}Successfully downloaded: {os.path.basename(path)}{Style.RESET_ALL}")
-            print(f"{Fore.GREEN}Download time: {download_time:.2f} seconds{Style.RESET_ALL}")
-            print(f"{Fore.GREEN}Average speed: {speed_mbps:.2f} MB/s{Style.RESET_ALL}")
-        else:
-            print(f"{Fore.RED}Failed to download: {os.path.basename(path)}{Style.RESET_ALL}")
+    async def download_file(self, session, url, path, listed_size=None):
+        # Files are recorded under their folder's path below the download directory
+        item_name = os.path.relpath(os.path.dirname(path), self.download_dir)
+        return await self.transfer_file(session, url, path, item_name, '', listed_size)
 
     async def search_and_download(self, search_query, concurrency=1):
         search_url = f"{self.base_url}/s/{quote(search_query)}"
         
-        async with aiohttp.ClientSession() as session:
-            soup = await self.fetch_page(session, search_url)
-            if not soup:
+        async with tracer.span("job", category="Anime", query=search_query), concurrency_control(concurrency), shared_session() as session:
+            listing = await self.fetch_page(session, search_url)
+            if not listing:
                 logging.error(f"Failed to fetch search results page: {search_url}")
                 return
 
-            anime_list = self.extract_links(soup)
+            anime_list = self.extract_links(listing)
             if not anime_list:
                 print(f"{Fore.RED}No anime found for the search query: {search_query}{Style.RESET_ALL}")
                 return
@@ -175,50 +103,72 @@ class AnimeScraper(BaseScraper):
 
                     folder_path = os.path.join(self.download_dir, *result['path'])
                     os.makedirs(folder_path, exist_ok=True)
-                    semaphore = asyncio.Semaphore(concurrency)
                     download_tasks = []
                     for file in selected_files:
                         file_path = os.path.join(folder_path, self.sanitize_filename(file['name']))
-                        task = asyncio.create_task(self.download_file_with_semaphore(session, file['url'], file_path, semaphore))
+                        task = asyncio.create_task(self.download_file(session, file['url'], file_path, file.get('size')))
                         download_tasks.append(task)
-                    await asyncio.gather(*download_tasks)
+                    # Transfers can be listed, paused, skipped or cancelled by typing while they run
+                    with control_console():
+                        await asyncio.gather(*download_tasks)
                     break
 
                 elif result['type'] == 'folder':
                     folder_path = os.path.join(self.download_dir, *result['path'])
                     print(f"{Fore.YELLOW}Downloading entire folder: {' > '.join(result['path'])}{Style.RESET_ALL}")
-                    await self.download_folder(session, result['url'], folder_path, concurrency)
+                    with control_console():
+                        await self.download_folder(session, result['url'], folder_path)
                     break
 
         print(f"{Fore.GREEN}Download process completed.{Style.RESET_ALL}")
 
-    async def download_file_with_semaphore(self, session, url, path, semaphore):
-        async with semaphore:
-            await self.download_file(session, url, path)
+    async def download_folder(self, session, url, folder_path):
+        # Breadth-first crawl: a bounded pool of listing workers feeds file entries
+        # straight to the download workers, so transfers start with the first listing
+        folders = asyncio.Queue()
+        files = asyncio.Queue(maxsize=self.file_queue_size)
+        visited = {url}
+        folders.put_nowait((url, folder_path))
 
-    async def download_folder(self, session, url, folder_path, concurrency):
-        soup = await self.fetch_page(session, url)
-        if not soup:
-            logging.error(f"Failed to fetch folder page: {url}")
-            return
-
-        files = self.extract_file_links(soup)
-        links = self.extract_links(soup)
-
-        os.makedirs(folder_path, exist_ok=True)
-
-        # Download subfolders recursively
-        subfolder_tasks = [
-            self.download_folder(session, link['url'], os.path.join(folder_path, self.sanitize_filename(link['name'])), concurrency)
-            for link in links
-        ]
-        await asyncio.gather(*subfolder_tasks)
-
-        # Download files in the current folder
-        if files:
-            semaphore = asyncio.Semaphore(concurrency)
-            download_tasks = [
-                self.download_file_with_semaphore(session, file['url'], os.path.join(folder_path, self.sanitize_filename(file['name'])), semaphore)
-                for file in files
-            ]
-            await asyncio.gather(*download_tasks)
\ No newline at end of file
+        async def list_folders():
+            while True:
+                folder_url, path = await folders.get()
+                try:
+                    listing = await self.fetch_page(session, folder_url)
+                    if not listing:
+                        logging.error(f"Failed to fetch folder page: {folder_url}")
+                        continue
+                    os.makedirs(path, exist_ok=True)
+                    for file in self.extract_file_links(listing):
+                        # Blocks while the download stage is behind, which also pauses the crawl
+                        await files.put((file['url'], os.path.join(path, self.sanitize_filename(file['name'])), file.get('size')))
+                    for link in self.extract_links(listing):
+                        if link['url'] not in visited:
+                            visited.add(link['url'])
+                            folders.put_nowait((link['url'], os.path.join(path, self.sanitize_filename(link['name']))))
+                except Exception as e:
+                    logging.error(f"Error listing folder {folder_url}: {e}")
+                finally:
+                    folders.task_done()
+
+        async def download_files():
+            while True:
+                file_url, file_path, listed_size = await files.get()
+                try:
+                    await self.download_file(session, file_url, file_path, listed_size)
+                except Exception as e:
+                    logging.error(f"Error downloading {file_url}: {e}")
+                finally:
+                    files.task_done()
+
+        # Workers are started inside the span, so their listings and downloads are traced under it
+        with metrics.item_download.time(kind="anime"), tracer.span("folder", path=folder_path):
+            workers = [asyncio.create_task(list_folders()) for _ in range(self.max_workers)]
+            workers += [asyncio.create_task(download_files()) for _ in range(self.download_workers)]
+            try:
+                await folders.join()
+                await files.join()
+            finally:
+                for worker in workers:
+                    worker.cancel()
+                await asyncio.gather(*workers, return_exceptions=True)
\ No newline at end of file
@@ -1,14 +1,26 @@
 import aiohttp
 import asyncio
-from bs4 import BeautifulSoup
-from urllib.parse import urljoin, quote
+from urllib.parse import urljoin, urlparse, quote, unquote
 import os
 import re
 import logging
-import json
 import time
 from colorama import Fore, Style
-from file_downloader import download_file, terminate
+from file_downloader import download_file
+from page_cache import get_page_cache
+from catalog import catalog
+from retry_policy import retry_policy
+from http_client import get_session
+from download_scheduler import scheduler
+from metrics import metrics
+from tracing import tracer
+from history_store import HistoryStore
+from .listing_parser import parse_listing
+
+# Folder search: folders listed at once, levels below the start, and seconds before giving up
+SEARCH_WORKERS = 4
+SEARCH_MAX_DEPTH = 3
+SEARCH_TIME_LIMIT = 30
 
 class BaseScraper:
     def __init__(self, base_url, download_dir, headers=None, max_workers=5):
@@ -18,90 +30,247 @@ class BaseScraper:
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.3'
         }
         self.max_workers = max_workers
-        self.history_file = os.path.join(self.download_dir, 'download_history.json')
+        self.file_sizes = {}
+        self.history_file = os.path.join(self.download_dir, 'download_history.db')
         self.init_history_file()
 
     def init_history_file(self):
-        if not os.path.exists(self.history_file):
-            self.save_history({})
+        self.history = HistoryStore(self.history_file)
+        self.history.migrate_json(os.path.join(self.download_dir, 'download_history.json'))
 
     async def fetch_page(self, session, url, retries=3):
+        path = urlparse(url).path
+        if path.startswith('/s/') and catalog.enabled:
+            # Searches are answered from the local catalog once one has been built
+            listing = await asyncio.to_thread(catalog.search_listing, unquote(path[3:]), self.base_url)
+            if listing is not None:
+                return listing
+        with tracer.span("listing", url=url):
+            entry = await get_page_cache().fetch(url, lambda conditional_headers: self.fetch_text(session, url, conditional_headers, retries))
+            if entry is None:
+                return None
+            # The parsed listing stays with the in-memory entry, so repeat visits skip parsing too
+            if entry.get("parsed") is None:
+                with metrics.listing_parse.time(), tracer.span("parse"):
+                    entry["parsed"] = parse_listing(entry["body"], self.base_url)
+            return entry["parsed"]
+
+    async def fetch_text(self, session, url, conditional_headers=None, retries=3):
+        delay = 0
         for attempt in range(retries):
+            await retry_policy.before_request(url)
             try:
                 logging.info(f"Fetching URL: {url}")
-                async with session.get(url, headers=self.headers) as response:
+                sent = time.monotonic()
+                async with tracer.span("fetch", attempt=attempt + 1) as span, session.get(url, headers=dict(self.headers, **(conditional_headers or {}))) as response:
+                    metrics.listing_fetch.observe(time.monotonic() - sent, status=response.status)
+                    span.set(status=response.status)
+                    if response.status == 429:
+                        wait_time = retry_policy.on_throttle(url, response)
+                        logging.warning(f"Rate limit exceeded fetching {url}. Waiting for {wait_time:.1f} seconds.")
+                        metrics.throttled.inc(kind="listing")
+                        continue
+                    if response.status == 304:
+                        retry_policy.on_success(url)
+                        logging.info(f"Not modified: {url}")
+                        return response.status, None, response.headers
                     response.raise_for_status()
+                    retry_policy.on_success(url)
                     logging.info(f"Status Code: {response.status}")
-                    return BeautifulSoup(await response.text(), 'html.parser')
-            except aiohttp.ClientError as e:
+                    return response.status, await response.text(), response.headers
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
                 logging.error(f"Error fetching URL: {e}")
                 if attempt < retries - 1:
-                    await asyncio.sleep(2 ** attempt)
+                    metrics.retries.inc(kind="listing", cause="timeout" if isinstance(e, asyncio.TimeoutError) else "client_error")
+                    delay = retry_policy.on_failure(url, delay)
+                    await asyncio.sleep(delay)
+        return None
+
+    async def get_file_size(self, session, url):
+        # Only needed when a local copy already exists; otherwise download_file learns
+        # the size from the GET itself. Answers are cached for the life of the scraper.
+        if url in self.file_sizes:
+            return self.file_sizes[url]
+        await retry_policy.before_request(url)
+        try:
+            async with tracer.span("head", url=url), session.head(url) as response:
+                if response.status == 200:
+                    size = int(response.headers.get('Content-Length', 0))
+                    if size:
+                        self.file_sizes[url] = size
+                    return size
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logging.error(f"Error fetching file size: {e!r}")
+        return 0
+
+    def remember_file_size(self, url, path):
+        if os.path.exists(path):
+            self.file_sizes[url] = os.path.getsize(path)
+
+    async def transfer_file(self, session, url, path, item_name, season_name, listed_size=None):
+        # The one download sequence behind every scraper and the batch runner:
+        # a complete local copy is skipped, anything else is downloaded in a
+        # scheduler slot, then its size is remembered and it goes into the
+        # history. listed_size, as shown on the listing, only sizes the slot.
+        # Returns a dict with url, path and a status of downloaded,
+        # skipped or failed, plus the timings of a download.
+        file_name = os.path.basename(path)
+        result = {"url": url, "path": path, "status": "failed"}
+        session = session or get_session()
+        try:
+            expected_size = self.file_sizes.get(url, 0)
+            if os.path.exists(path):
+                expected_size = await self.get_file_size(session, url)
+                local_size = os.path.getsize(path)
+                if expected_size == 0 or local_size == expected_size:
+                    logging.info(f"Skipping completed file: {file_name}")
+                    result["status"] = "skipped"
+                    return result
+                if local_size < expected_size:
+                    logging.info(f"Resuming incomplete download: {file_name} ({local_size / expected_size:.0%} completed)")
                 else:
-                    return None
+                    logging.warning(f"Local file larger than expected. Re-downloading: {file_name}")
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            async with scheduler.slot(expected_size or listed_size):
+                start_time = time.time()
+                outcome = await download_file(session, url, path, expected_size)
+                download_time = time.time() - start_time
+            if outcome == "skipped":
+                logging.info(f"Skipped: {file_name}")
+                result["status"] = "skipped"
+            elif outcome:
+                self.remember_file_size(url, path)
+                size_mb = os.path.getsize(path) / (1024 * 1024)
+                record = {
+                    "download_time": download_time,
+                    "size_mb": size_mb,
+                    "speed_mbps": size_mb / download_time if download_time > 0 else 0
+                }
+                self.record_download(item_name, season_name, file_name, record)
+                logging.info(f"Downloaded {file_name}: {size_mb:.1f} MB in {download_time:.2f} seconds ({record['speed_mbps']:.2f} MB/s)")
+                result.update(record, status="downloaded")
+            else:
+                logging.error(f"Failed to download: {file_name}")
+        except Exception as e:
+            logging.error(f"Failed to download {url}: {e}")
+            result["error"] = str(e)
+        return result
 
     def sanitize_filename(self, name):
         return re.sub(r'[^a-zA-Z0-9_\-\.]', '_', name)
 
-    def load_history(self):
-        if os.path.exists(self.history_file):
-            try:
-                with open(self.history_file, 'r') as f:
-                    return json.load(f)
-            except json.JSONDecodeError:
-                logging.error(f"Invalid JSON in history file: {self.history_file}")
-                logging.info("Creating a new history file.")
-                return {}
-            except Exception as e:
-                logging.error(f"Error reading history file: {self.history_file}. Error: {str(e)}")
-                logging.info("Creating a new history file.")
-                return {}
-        return {}
-
-    def save_history(self, history):
-        try:
-            with open(self.history_file, 'w') as f:
-                json.dump(history, f, indent=2)
-        except Exception as e:
-            logging.error(f"Error saving history to file: {self.history_file}. Error: {str(e)}")
+    def record_download(self, item_name, season_name, file_name, result):
+        with tracer.span("history_write"):
+            self.history.record(item_name, season_name, file_name, result["size_mb"], result["download_time"], result["speed_mbps"])
 
-    def display_download_history(self):
-        history = self.load_history()
-        if not history:
+    def display_download_history(self, page_size=20):
+        total = self.history.count()
+        if not total:
             print(f"{Fore.YELLOW}No download history available.{Style.RESET_ALL}")
             return
 
-        print(f"\n{Fore.GREEN}Download History:{Style.RESET_ALL}")
-        for item_name, item_data in history.items():
-            print(f"\n{Fore.CYAN}Item: {item_name}{Style.RESET_ALL}")
-            if isinstance(item_data, dict) and 'last_download' in item_data:
-                print(f"  Last download: {item_data['last_download']}")
-                if 'files' in item_data:
-                    print(f"  Files:")
-                    for file_name, file_data in item_data['files'].items():
-                        print(f"    - {file_name}")
-                        print(f"      Size: {file_data['size_mb']:.2f} MB")
-                        print(f"      Download time: {file_data['download_time']:.2f} seconds")
-                        print(f"      Speed: {file_data['speed_mbps']:.2f} MB/s")
-            elif isinstance(item_data, dict):
-                for season_name, season_data in item_data.items():
-                    print(f"  Season: {season_name}")
-                    print(f"    Last download: {season_data.get('last_download', 'N/A')}")
-                    if 'episodes' in season_data:
-                        print(f"    Episodes:")
-                        for episode_name, episode_data in season_data['episodes'].items():
-                            print(f"      - {episode_name}")
-                            print(f"        Size: {episode_data['size_mb']:.2f} MB")
-                            print(f"        Download time: {episode_data['download_time']:.2f} seconds")
-                            print(f"        Speed: {episode_data['speed_mbps']:.2f} MB/s")
+        print(f"\n{Fore.GREEN}Download History ({total} files):{Style.RESET_ALL}")
+        current_item = current_season = None
+        for offset in range(0, total, page_size):
+            for row in self.history.page(offset, page_size):
+                if row['item'] != current_item:
+                    current_item, current_season = row['item'], None
+                    print(f"\n{Fore.CYAN}Item: {current_item}{Style.RESET_ALL}")
+                if row['season'] and row['season'] != current_season:
+                    current_season = row['season']
+                    print(f"  Season: {current_season}")
+                indent = "    " if row['season'] else "  "
+                print(f"{indent}- {row['file']}")
+                print(f"{indent}  Downloaded: {row['downloaded_at']}")
+                print(f"{indent}  Size: {row['size_mb'] or 0:.2f} MB")
+                print(f"{indent}  Download time: {row['download_time'] or 0:.2f} seconds")
+                print(f"{indent}  Speed: {row['speed_mbps'] or 0:.2f} MB/s")
+            if offset + page_size < total:
+                choice = input(f"\n{Fore.YELLOW}Showing {offset + page_size}/{total}. Press Enter for more or 'q' to stop: {Style.RESET_ALL}").strip().lower()
+                if choice == 'q':
+                    break
 
-    # To be implemented by subclasses
-    def extract_links(self, soup):
-        raise NotImplementedError
+    async def fetch_directory_contents(self, path):
+        # One folder for the folder navigator: subfolders, then files, as dicts
+        # with name, url, path (the URL path), is_dir and size (None if unknown)
+        if catalog.enabled:
+            rows = await asyncio.to_thread(catalog.children, path)
+            if rows is not None:
+                return [{'name': row['name'], 'url': urljoin(self.base_url, row['path']), 'path': row['path'],
+                         'is_dir': bool(row['is_dir']), 'size': row['size']} for row in rows]
+        listing = await self.fetch_page(get_session(), urljoin(self.base_url, path))
+        if not listing:
+            logging.error(f"Failed to fetch directory: {path}")
+            return []
+        entries = [{'name': link['name'], 'url': link['url'], 'is_dir': True, 'size': None} for link in self.extract_links(listing)]
+        entries += [{'name': file['name'], 'url': file['url'], 'is_dir': False, 'size': file.get('size')} for file in self.extract_file_links(listing)]
+        for entry in entries:
+            entry['path'] = urlparse(entry['url']).path
+        # Links back to the folder itself are not entries
+        return [entry for entry in entries if entry['path'] != path]
 
-    # To be implemented by subclasses
-    def extract_file_links(self, soup):
-        raise NotImplementedError
+    async def search_in_directory(self, path, query, max_depth=SEARCH_MAX_DEPTH, workers=SEARCH_WORKERS, time_limit=SEARCH_TIME_LIMIT):
+        # Yields entries below path whose names contain the query as soon as the
+        # folder holding them is listed. A pool of workers lists folders in
+        # parallel, each folder once however many links lead to it, down to
+        # max_depth levels; whatever has not been reached after time_limit
+        # seconds is skipped. Closing the generator early stops the crawl.
+        # Each entry's 'crumbs' are the (path, name) of the folders leading to
+        # it from path, so a hit deep down can be opened or saved in place.
+        if catalog.enabled and await asyncio.to_thread(catalog.entry, path):
+            for row in await asyncio.to_thread(catalog.search, query, path):
+                yield {'name': row['name'], 'url': urljoin(self.base_url, row['path']), 'path': row['path'],
+                       'is_dir': bool(row['is_dir']), 'size': row['size'],
+                       'crumbs': await asyncio.to_thread(catalog.trail, row['id'], path)}
+            return
+        wanted = query.lower()
+        folders = asyncio.Queue()
+        matches = asyncio.Queue()
+        visited = {path}
+        folders.put_nowait((path, 0, []))
+
+        async def worker():
+            while True:
+                folder, depth, crumbs = await folders.get()
+                try:
+                    for entry in await self.fetch_directory_contents(folder):
+                        if wanted in entry['name'].lower():
+                            matches.put_nowait(dict(entry, crumbs=crumbs))
+                        if entry['is_dir'] and depth + 1 < max_depth and entry['path'] not in visited:
+                            visited.add(entry['path'])
+                            folders.put_nowait((entry['path'], depth + 1, crumbs + [(entry['path'], entry['name'])]))
+                except Exception as e:
+                    logging.error(f"Error searching {folder}: {e}")
+                finally:
+                    folders.task_done()
+
+        async def finish():
+            await folders.join()
+            matches.put_nowait(None)
+
+        tasks = [asyncio.create_task(worker()) for _ in range(max(1, workers))]
+        tasks.append(asyncio.create_task(finish()))
+        deadline = time.monotonic() + time_limit
+        try:
+            while True:
+                try:
+                    entry = await asyncio.wait_for(matches.get(), max(0, deadline - time.monotonic()))
+                except asyncio.TimeoutError:
+                    logging.warning(f"Search for '{query}' stopped after {time_limit}s with {folders.qsize()} folders left")
+                    break
+                if entry is None:
+                    break
+                yield entry
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    def extract_links(self, listing):
+        return listing.links
+
+    def extract_file_links(self, listing):
+        return listing.files
 
     # To be implemented by subclasses
     async def download_item(self, session, item_name, item_files, item_path):
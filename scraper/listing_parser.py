@@ -0,0 +1,64 @@
+import re
+from urllib.parse import urljoin
+from lxml import etree
+
+# Folder rows are <div class="centerflex name-div"><a href=...>, file rows are
+# <a class="file-entry wrap" href=...>. Both are pulled with compiled XPath
+# queries over lxml's C parser instead of a BeautifulSoup tree.
+FOLDER_ROWS = etree.XPath('//div[@class="centerflex name-div"]')
+FILE_ANCHORS = etree.XPath('//a[@class="file-entry wrap"][@href]')
+
+SIZE_PATTERN = re.compile(r'(\d+(?:\.\d+)?)\s*([KMGT]?)i?B\b', re.IGNORECASE)
+SIZE_UNITS = {"": 1, "k": 1024, "m": 1024 ** 2, "g": 1024 ** 3, "t": 1024 ** 4}
+
+_parser = etree.HTMLParser(encoding='utf-8', remove_comments=True, remove_pis=True)
+
+class Listing:
+    def __init__(self, links, files):
+        self.links = links
+        self.files = files
+
+def element_text(element):
+    # Same result as BeautifulSoup's get_text(separator=' ', strip=True)
+    return ' '.join(text.strip() for text in element.itertext() if text.strip())
+
+def parse_document(html):
+    if isinstance(html, str):
+        html = html.encode('utf-8')
+    if not html.strip():
+        return None
+    return etree.fromstring(html, _parser)
+
+def extract_links(document, base_url):
+    links = []
+    for row in FOLDER_ROWS(document):
+        anchor = row.find('.//a[@href]')
+        if anchor is None:
+            continue
+        name = element_text(anchor)
+        if name.lower() != "parent directory":
+            links.append({'name': name, 'url': urljoin(base_url, anchor.get('href'))})
+    return links
+
+def parse_size(text):
+    # "1.2 GB" and the like, in bytes; None when the text has no size
+    match = SIZE_PATTERN.search(text)
+    if match is None:
+        return None
+    return int(float(match.group(1)) * SIZE_UNITS[match.group(2).lower()])
+
+def extract_file_links(document, base_url):
+    # The size comes from the text beside the link in its row, where the page shows one
+    files = []
+    for anchor in FILE_ANCHORS(document):
+        name = element_text(anchor)
+        row = anchor.getparent()
+        size = parse_size(element_text(row).replace(name, '', 1)) if row is not None else None
+        files.append({'name': name, 'url': urljoin(base_url, anchor.get('href')), 'size': size})
+    return files
+
+def parse_listing(html, base_url):
+    document = parse_document(html)
+    if document is None:
+        return Listing([], [])
+    return Listing(extract_links(document, base_url), extract_file_links(document, base_url))
@@ -1,136 +1,41 @@
 from .base_scraper import BaseScraper
-from urllib.parse import quote, urljoin
+from urllib.parse import quote
 import os
 import logging
 from colorama import Fore, Style
-import time
-from file_downloader import download_file, terminate
-import aiohttp
+from transfer_control import transfers, control_console
+from http_client import shared_session
+from concurrency_controller import concurrency_control
+from progress import progress
+from metrics import metrics
+from tracing import tracer
 import asyncio
 
 class TVShowScraper(BaseScraper):
-    def extract_links(self, soup):
-        elements = soup.find_all('div', class_='centerflex name-div')
-        links = []
-
-        for element in elements:
-            link = element.find('a', href=True)
-            if link:
-                href = urljoin(self.base_url, link['href'])
-                name = link.get_text(separator=' ', strip=True)
-                if name.lower() != "parent directory":
-                    links.append({'name': name, 'url': href})
-
-        return links
-
-    def extract_file_links(self, soup):
-        elements = soup.find_all('a', class_='file-entry wrap')
-        links = []
-
-        for element in elements:
-            href = urljoin(self.base_url, element['href'])
-            name = element.get_text(separator=' ', strip=True)
-            links.append({'name': name, 'url': href})
-
-        return links
-
-    async def get_file_size(self, session, url):
-        try:
-            async with session.head(url) as response:
-                if response.status == 200:
-                    return int(response.headers.get('Content-Length', 0))
-        except aiohttp.ClientError as e:
-            logging.error(f"Error fetching file size: {e}")
-        return 0
-
-    async def download_episode(self, session, show_name, season, episode, season_path, i, total_episodes):
-        episode_name = self.sanitize_filename(episode['name'])
-        episode_url = episode['url']
-        episode_path = os.path.join(season_path, episode_name)
-        
-        expected_size = await self.get_file_size(session, episode_url)
-        
-        if os.path.exists(episode_path):
-            local_size = os.path.getsize(episode_path)
-            if expected_size == 0 or local_size == expected_size:
-                print(f"{Fore.CYAN}Skipping completed episode: {episode_name}{Style.RESET_ALL}")
-                return None
-            elif local_size < expected_size:
-                print(f"{Fore.YELLOW}Resuming incomplete download: {Fore.CYAN}{episode_name}{Style.RESET_ALL}")
-                print(f"{Fore.YELLOW}Progress: {Fore.CYAN}{local_size/expected_size*100:.2f}% completed{Style.RESET_ALL}")
-            else:
-                print(f"{Fore.RED}Local file larger than expected. Re-downloading: {Fore.CYAN}{episode_name}{Style.RESET_ALL}")
-        else:
-            print(f"\n{Fore.YELLOW}Starting new download: {Fore.CYAN}{episode_name}{Style.RESET_ALL}")
-        
-        print(f"{Fore.YELLOW}Progress: {Fore.CYAN}{i}/{total_episodes} episodes{Style.RESET_ALL}")
-        try:
-            start_time = time.time()
-            result = await download_file(session, episode_url, episode_path, expected_size)
-            end_time = time.time()
-            if result:
-                download_time = end_time - start_time
-                size_mb = os.path.getsize(episode_path) / (1024 * 1024)
-                speed_mbps = size_mb / download_time if download_time > 0 else 0
-                logging.info(f"{Fore.GREEN}Successfully downloaded: {Fore.CYAN}{episode_name}{Style.RESET_ALL}")
-                logging.info(f"{Fore.GREEN}Download time: {Fore.CYAN}{download_time:.2f} seconds{Style.RESET_ALL}")
-                logging.info(f"{Fore.GREEN}Average speed: {Fore.CYAN}{speed_mbps:.2f} MB/s{Style.RESET_ALL}")
-                return {
-                    "episode_name": episode_name,
-                    "download_time": download_time,
-                    "size_mb": size_mb,
-                    "speed_mbps": speed_mbps
-                }
-            else:
-                logging.error(f"{Fore.RED}Failed to download episode: {Fore.CYAN}{episode_name}{Style.RESET_ALL}")
-                return None
-        except Exception as e:
-            logging.error(f"Failed to download episode: {episode_name}. Error: {e}")
-            logging.error(f"Error details: {str(e)}")
-            print(f"{Fore.RED}Failed to download episode: {Fore.CYAN}{episode_name}{Fore.RED}. Error: {e}{Style.RESET_ALL}")
-            return None
-
-    async def download_item(self, session, show_name, season, episodes, season_path, concurrency=1):
-        history = self.load_history()
-        show_history = history.setdefault(show_name, {})
-        season_history = show_history.setdefault(season['name'], {"episodes": {}, "last_download": ""})
-        
-        total_episodes = len(episodes)
-        
-        semaphore = asyncio.Semaphore(concurrency)
-        
-        async def download_with_semaphore(episode, i):
-            async with semaphore:
-                return await self.download_episode(session, show_name, season, episode, season_path, i, total_episodes)
-        
-        tasks = [asyncio.create_task(download_with_semaphore(episode, i)) 
-                 for i, episode in enumerate(episodes, 1)]
-        
-        results = await asyncio.gather(*tasks)
-        
-        for result in results:
-            if result:
-                season_history["episodes"][result["episode_name"]] = {
-                    "download_time": result["download_time"],
-                    "size_mb": result["size_mb"],
-                    "speed_mbps": result["speed_mbps"]
-                }
-        
-        season_history["last_download"] = time.strftime("%Y-%m-%d %H:%M:%S")
-        self.save_history(history)
+    async def download_episode(self, session, show_name, season, episode, season_path):
+        episode_path = os.path.join(season_path, self.sanitize_filename(episode['name']))
+        return await self.transfer_file(session, episode['url'], episode_path, show_name, season['name'], episode.get('size'))
+
+    async def download_item(self, session, show_name, season, episodes, season_path):
+        with metrics.item_download.time(kind="tv_show"), tracer.span("season", season=season['name']):
+            tasks = [asyncio.create_task(self.download_episode(session, show_name, season, episode, season_path))
+                     for episode in episodes]
+
+            # Each episode is recorded in the history as soon as it completes
+            await asyncio.gather(*tasks)
         
-        print(f"\n{Fore.GREEN}Download process completed for {show_name} - {season['name']}.{Style.RESET_ALL}")
+        progress.write(f"\n{Fore.GREEN}Download process completed for {show_name} - {season['name']}.{Style.RESET_ALL}")
 
     async def search_and_download(self, search_query, concurrency=1):
         search_url = f"{self.base_url}/s/{quote(search_query)}"
         
-        async with aiohttp.ClientSession() as session:
-            soup = await self.fetch_page(session, search_url)
-            if not soup:
+        async with tracer.span("job", category="TV Shows", query=search_query), concurrency_control(concurrency), shared_session() as session:
+            listing = await self.fetch_page(session, search_url)
+            if not listing:
                 logging.error(f"Failed to fetch search results page: {search_url}")
                 return
 
-            shows = self.extract_links(soup)
+            shows = self.extract_links(listing)
             if not shows:
                 print(f"{Fore.RED}No TV shows found for the search query: {search_query}{Style.RESET_ALL}")
                 return
@@ -148,12 +53,12 @@ class TVShowScraper(BaseScraper):
                     break
                 print(f"{Fore.RED}Invalid choice. Please try again.{Style.RESET_ALL}")
 
-            show_soup = await self.fetch_page(session, selected_show['url'])
-            if not show_soup:
+            show_listing = await self.fetch_page(session, selected_show['url'])
+            if not show_listing:
                 logging.error(f"Failed to fetch TV show page: {selected_show['url']}")
                 return
 
-            seasons = self.extract_links(show_soup)
+            seasons = self.extract_links(show_listing)
             if not seasons:
                 print(f"{Fore.RED}No seasons found for {selected_show['name']}{Style.RESET_ALL}")
                 return
@@ -172,30 +77,38 @@ class TVShowScraper(BaseScraper):
                 print(f"{Fore.RED}Invalid choice. Exiting.{Style.RESET_ALL}")
                 return
 
-            for season in selected_seasons:
-                if terminate:
-                    break
+            # Transfers can be listed, paused, skipped or cancelled by typing while they run
+            with control_console():
+                # Each season is handed to the scheduler as soon as its listing is in,
+                # so transfers keep flowing across season boundaries
+                season_tasks = []
+                for season in selected_seasons:
+                    # Checked on the registry, so a 'stop' typed during downloads is seen here
+                    if transfers.stopping:
+                        break
                 
-                season_soup = await self.fetch_page(session, season['url'])
-                if not season_soup:
-                    logging.error(f"Failed to fetch season page: {season['url']}")
-                    continue
-
-                episodes = self.extract_file_links(season_soup)
-                if not episodes:
-                    print(f"{Fore.RED}No episodes found for {season['name']}{Style.RESET_ALL}")
-                    continue
-
-                show_name = self.sanitize_filename(selected_show['name'])
-                season_name = self.sanitize_filename(season['name'])
-                season_path = os.path.join(self.download_dir, show_name, season_name)
-                try:
-                    os.makedirs(season_path, exist_ok=True)
-                    logging.info(f"Created directory: {Fore.CYAN}{season_path}{Style.RESET_ALL}")
-                except Exception as e:
-                    logging.error(f"Failed to create directory: {season_path}. Error: {e}")
-                    continue
-
-                await self.download_item(session, show_name, season, episodes, season_path, concurrency)
+                    season_listing = await self.fetch_page(session, season['url'])
+                    if not season_listing:
+                        logging.error(f"Failed to fetch season page: {season['url']}")
+                        continue
+
+                    episodes = self.extract_file_links(season_listing)
+                    if not episodes:
+                        print(f"{Fore.RED}No episodes found for {season['name']}{Style.RESET_ALL}")
+                        continue
+
+                    show_name = self.sanitize_filename(selected_show['name'])
+                    season_name = self.sanitize_filename(season['name'])
+                    season_path = os.path.join(self.download_dir, show_name, season_name)
+                    try:
+                        os.makedirs(season_path, exist_ok=True)
+                        logging.info(f"Created directory: {Fore.CYAN}{season_path}{Style.RESET_ALL}")
+                    except Exception as e:
+                        logging.error(f"Failed to create directory: {season_path}. Error: {e}")
+                        continue
+
+                    season_tasks.append(asyncio.create_task(self.download_item(session, show_name, season, episodes, season_path)))
+
+                await asyncio.gather(*season_tasks)
 
         print(f"{Fore.GREEN}Download process completed.{Style.RESET_ALL}")
\ No newline at end of file
@@ -0,0 +1,92 @@
+import asyncio
+import os
+import sys
+import threading
+
+import pytest
+from aiohttp import web
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, "benchmarks")]
+
+from fake_site import FakeSite
+from http_client import close_session
+from page_cache import configure_page_cache
+from content_index import configure_dedup
+from retry_policy import retry_policy
+from transfer_control import transfers
+
+class SiteThread:
+    # Serves a FakeSite from its own thread and event loop, so a test can run
+    # its client side with asyncio.run and still reach the site
+    def __init__(self, site):
+        self.site = site
+        self.loop = asyncio.new_event_loop()
+        self.ready = threading.Event()
+        self.thread = threading.Thread(target=self.serve, daemon=True)
+        self.runner = None
+        self.port = None
+
+    def serve(self):
+        asyncio.set_event_loop(self.loop)
+        self.runner = web.AppRunner(self.site.app(), access_log=None)
+        self.loop.run_until_complete(self.runner.setup())
+        self.loop.run_until_complete(web.TCPSite(self.runner, '127.0.0.1', 0).start())
+        self.port = self.runner.addresses[0][1]
+        self.ready.set()
+        self.loop.run_forever()
+        self.loop.run_until_complete(self.runner.cleanup())
+        self.loop.close()
+
+    def start(self):
+        self.thread.start()
+        self.ready.wait(10)
+        return self
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(10)
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.port}"
+
+@pytest.fixture
+def fake_site():
+    # Call with FakeSite options; the returned server has .url and .site
+    servers = []
+
+    def start(**options):
+        options.setdefault("latency_ms", 0)
+        options.setdefault("file_size_mb", 2)
+        server = SiteThread(FakeSite(**options)).start()
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.stop()
+
+@pytest.fixture
+def run():
+    # Runs a coroutine on a fresh loop and closes the shared session it opened
+    def run_coroutine(coroutine):
+        async def main():
+            try:
+                return await coroutine
+            finally:
+                await close_session()
+        return asyncio.run(main())
+    return run_coroutine
+
+@pytest.fixture(autouse=True)
+def isolated(tmp_path, monkeypatch):
+    # Caches, indexes and history files land in the test's own directory, and
+    # no host pause or 'stop' carries over from an earlier test
+    monkeypatch.chdir(tmp_path)
+    configure_page_cache({"directory": str(tmp_path / "pages")})
+    configure_dedup({"enabled": False, "index_file": str(tmp_path / "content_index.db")}, roots=[])
+    retry_policy.hosts.clear()
+    retry_policy.counters.clear()
+    transfers.reset()
+    yield
@@ -0,0 +1,75 @@
+import json
+import os
+
+import pytest
+
+from batch_runner import (run_batch, load_job_file, parse_selector, pick_result, JobFileError,
+                          EXIT_OK, EXIT_FAILURES)
+from scraper.base_scraper import BaseScraper
+
+def config_for(server, tmp_path):
+    return {"base_url": server.url, "download_paths": {category: str(tmp_path / category) for category in ("TV Shows", "Movies", "Anime")}}
+
+def batch(run, server, tmp_path, jobs):
+    summary_path = str(tmp_path / "summary.json")
+    code = run(run_batch(config_for(server, tmp_path), {"jobs": jobs}, str(tmp_path / "downloads"), None, summary_path))
+    with open(summary_path) as f:
+        return code, json.load(f)
+
+def test_successful_batch_exits_ok_and_rerun_skips(tmp_path, fake_site, run):
+    server = fake_site(files=2)
+    jobs = [{"category": "TV Shows", "query": "show", "seasons": "1"}]
+
+    code, summary = batch(run, server, tmp_path, jobs)
+    assert code == EXIT_OK
+    assert summary["ok"] and summary["transfers"] == {"downloaded": 2, "skipped": 0, "failed": 0}
+    assert os.path.exists(tmp_path / "downloads" / "TV Shows" / "show_0" / "Season_1" / "E001.mkv")
+
+    code, summary = batch(run, server, tmp_path, jobs)
+    assert code == EXIT_OK
+    assert summary["transfers"] == {"downloaded": 0, "skipped": 2, "failed": 0}
+
+def test_unresolved_job_exits_with_failures(tmp_path, fake_site, run):
+    server = fake_site(files=1)
+    jobs = [
+        {"category": "Movies", "query": "film"},
+        {"category": "Movies", "query": "film", "select": "no such film"}
+    ]
+    code, summary = batch(run, server, tmp_path, jobs)
+    assert code == EXIT_FAILURES
+    assert [job["status"] for job in summary["jobs"]] == ["resolved", "failed"]
+    assert summary["transfers"]["downloaded"] == 1
+
+def test_failed_transfer_exits_with_failures(tmp_path, fake_site, run, monkeypatch):
+    server = fake_site(files=1)
+
+    async def fail(self, session, url, path, item_name, season_name, listed_size=None):
+        return {"url": url, "path": path, "status": "failed"}
+
+    monkeypatch.setattr(BaseScraper, "transfer_file", fail)
+    code, summary = batch(run, server, tmp_path, [{"category": "Movies", "query": "film"}])
+    assert code == EXIT_FAILURES
+    assert not summary["ok"] and summary["transfers"]["failed"] == 1
+
+@pytest.mark.parametrize("content", ['{"jobs": []}', '[{"category": "Books", "query": "x"}]', '{"jobs": [{"query": "x"}], "concurrency": 0}', '{not json'])
+def test_bad_job_file_is_rejected(tmp_path, content):
+    path = tmp_path / "job.json"
+    path.write_text(content)
+    with pytest.raises(JobFileError):
+        load_job_file(str(path))
+
+def test_job_file_may_be_a_bare_list(tmp_path):
+    path = tmp_path / "job.json"
+    path.write_text('[{"query": "x"}]')
+    assert load_job_file(str(path)) == {"jobs": [{"query": "x"}]}
+
+def test_parse_selector():
+    assert parse_selector(None, 3) == [0, 1, 2]
+    assert parse_selector("1-2,2,5", 4) == [0, 1]
+    assert parse_selector([3, 1], 3) == [2, 0]
+
+def test_pick_result_prefers_exact_name():
+    results = [{"name": "Show Extra"}, {"name": "Show"}]
+    assert pick_result(results, "show") == results[1]
+    assert pick_result(results, "extra") == results[0]
+    assert pick_result(results, 3) is None
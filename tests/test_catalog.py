@@ -0,0 +1,72 @@
+import pytest
+
+from catalog import Catalog
+from http_client import get_session
+from scraper.tv_show_scraper import TVShowScraper
+
+# With two folders, depth two and two files: the root, 2 seasons and 4 subfolders
+FOLDERS = 7
+
+@pytest.fixture
+def site(fake_site):
+    return fake_site(folders=2, depth=2, files=2)
+
+@pytest.fixture
+def catalog(tmp_path):
+    return Catalog({"database": str(tmp_path / "catalog.db"), "root": "/d/", "concurrency": 2})
+
+@pytest.fixture
+def crawl(site, catalog, tmp_path, run):
+    scraper = TVShowScraper(site.url, str(tmp_path / "downloads"))
+
+    def crawl_once():
+        async def main():
+            return await catalog.crawl(get_session(), scraper.fetch_text, site.url)
+        return run(main())
+    return crawl_once
+
+def test_first_crawl_stores_the_tree(catalog, crawl):
+    stats = crawl()
+    assert (stats["folders"], stats["changed"], stats["failed"]) == (FOLDERS, FOLDERS, 0)
+    assert stats["added"] == FOLDERS - 1 + FOLDERS * 2
+    assert stats["entries"] == stats["added"] + 1
+    assert catalog.entry("/f/s1/s2/E002.mkv")["name"] == "E002.mkv"
+
+def test_refresh_of_unchanged_tree_costs_only_revalidations(crawl):
+    first = crawl()
+    stats = crawl()
+    assert (stats["requests"], stats["unchanged"], stats["changed"]) == (FOLDERS, FOLDERS, 0)
+    assert (stats["added"], stats["removed"], stats["entries"]) == (0, 0, first["entries"])
+
+def test_refresh_picks_up_added_and_removed_files(site, crawl):
+    first = crawl()
+    site.site.options["files"] = 3
+    stats = crawl()
+    assert (stats["changed"], stats["added"], stats["removed"]) == (FOLDERS, FOLDERS, 0)
+
+    site.site.options["files"] = 1
+    stats = crawl()
+    assert (stats["added"], stats["removed"]) == (0, FOLDERS * 2)
+    assert stats["entries"] == first["entries"] - FOLDERS
+
+def test_removed_folder_takes_its_subtree(site, catalog, crawl):
+    crawl()
+    site.site.options["folders"] = 1
+    stats = crawl()
+    # Every folder now has a single subfolder, so the second ones go with everything under them
+    assert catalog.entry("/d/s2/") is None
+    assert catalog.entry("/f/s2/E001.mkv") is None
+    assert catalog.entry("/d/s1/s2/") is None
+    assert catalog.entry("/d/s1/s1/") is not None
+    assert stats["removed"] > 0
+
+def test_recently_checked_folders_are_not_refetched(catalog, crawl):
+    crawl()
+    catalog.configure({"refresh_hours": 1})
+    stats = crawl()
+    assert (stats["requests"], stats["fresh"], stats["folders"]) == (0, FOLDERS, FOLDERS)
+
+def test_trail_lists_folders_between_root_and_entry(catalog, crawl):
+    crawl()
+    entry = catalog.entry("/f/s1/s2/E001.mkv")
+    assert [path for path, _ in catalog.trail(entry["id"], "/d/")] == ["/d/s1/", "/d/s1/s2/"]
@@ -0,0 +1,83 @@
+import asyncio
+
+import pytest
+
+import concurrency_controller
+from concurrency_controller import ConcurrencyController
+
+MB = 1024 * 1024
+
+class FakeScheduler:
+    def __init__(self):
+        self.active = 0
+        self.max_active = 2
+        self.waiting = []
+
+    async def set_limits(self, max_active=None):
+        self.max_active = max_active
+
+@pytest.fixture
+def scheduler(monkeypatch):
+    fake = FakeScheduler()
+    monkeypatch.setattr(concurrency_controller, "scheduler", fake)
+    return fake
+
+@pytest.fixture
+def controller(scheduler):
+    controller = ConcurrencyController({"start_active": 2, "max_active": 8, "smoothing": 1.0})
+    controller.limit = scheduler.max_active
+    return controller
+
+def saturate(scheduler):
+    scheduler.active = scheduler.max_active
+    scheduler.waiting = [object()]
+
+def step(controller, scheduler, throughput):
+    saturate(scheduler)
+    asyncio.run(controller.adjust(throughput))
+    return controller.limit
+
+def test_holds_without_queued_work(controller):
+    assert controller.decide(10 * MB, saturated=False) == (2, "no queued transfers")
+
+def test_additive_increase_while_throughput_improves(controller, scheduler):
+    assert step(controller, scheduler, 10 * MB) == 3
+    assert step(controller, scheduler, 15 * MB) == 4
+    assert controller.best_limit == 3
+
+def test_returns_to_best_limit_when_extra_slot_adds_nothing(controller, scheduler):
+    step(controller, scheduler, 10 * MB)
+    step(controller, scheduler, 15 * MB)
+    assert step(controller, scheduler, 15 * MB) == 3
+    assert scheduler.max_active == 3
+
+def test_multiplicative_decrease_on_congestion(controller, scheduler):
+    controller.limit = scheduler.max_active = 8
+    controller.task = object()
+    controller.record_congestion("429")
+    assert step(controller, scheduler, 10 * MB) == 4
+    assert controller.congestion is None
+
+def test_decrease_when_throughput_falls(controller, scheduler):
+    controller.limit = scheduler.max_active = 6
+    controller.best_throughput = 20 * MB
+    controller.best_limit = 6
+    assert controller.decide(10 * MB, saturated=True) == (3, "throughput fell")
+
+def test_never_below_min_active(controller):
+    controller.limit = 1
+    controller.task = object()
+    controller.record_congestion("stall")
+    assert controller.decide(MB, saturated=True)[0] == 1
+
+def test_probes_after_flat_intervals(controller, scheduler):
+    step(controller, scheduler, 10 * MB)
+    step(controller, scheduler, 10 * MB)
+    assert controller.limit == 2
+    assert step(controller, scheduler, 10 * MB) == 2
+    assert step(controller, scheduler, 10 * MB) == 2
+    assert step(controller, scheduler, 10 * MB) == 3
+
+def test_congestion_only_recorded_while_running(controller):
+    controller.record_congestion("429")
+    assert controller.congestion is None
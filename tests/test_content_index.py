@@ -0,0 +1,122 @@
+import os
+
+import pytest
+
+from content_index import ContentIndex, configure_dedup, deduplicator, sample_offsets, local_digest, link_file
+from fake_site import file_pattern, PATTERN_SIZE
+from file_downloader import download_file, DOWNLOAD_HEADERS
+from http_client import get_session
+
+MB = 1024 * 1024
+
+def write_file(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(data)
+    return path
+
+def test_sample_offsets_span_first_to_last_byte():
+    offsets = sample_offsets(1000, 4, 10)
+    assert offsets[0] == (0, 10)
+    assert offsets[-1][0] + offsets[-1][1] <= 1000
+    assert offsets[-1][0] >= 1000 - 10 - 3
+    assert sample_offsets(30, 4, 10) == [(0, 30)]
+
+def test_digest_changes_with_sampled_content(tmp_path):
+    data = bytes(1000)
+    a = write_file(str(tmp_path / "a"), data)
+    b = write_file(str(tmp_path / "b"), data[:-1] + b"x")
+    c = write_file(str(tmp_path / "c"), data)
+    assert local_digest(a, 1000, 4, 10) == local_digest(c, 1000, 4, 10)
+    assert local_digest(a, 1000, 4, 10) != local_digest(b, 1000, 4, 10)
+    # The sampling parameters are part of the key
+    assert local_digest(a, 1000, 4, 10) != local_digest(a, 1000, 2, 10)
+
+def test_index_finds_same_size_and_digest(tmp_path):
+    root = str(tmp_path / "library")
+    same = write_file(os.path.join(root, "show", "E01.mkv"), b"a" * 2000)
+    write_file(os.path.join(root, "other", "E01.mkv"), b"b" * 2000)
+    write_file(os.path.join(root, "show", "E02.mkv.tmp"), b"a" * 2000)
+    index = ContentIndex(str(tmp_path / "index.db"))
+    index.scan([root], min_size=1000)
+
+    assert index.has_size(2000) and not index.has_size(2001)
+    assert index.find(2000, local_digest(same, 2000, 4, 10), 4, 10) == same
+    assert index.find(2000, "4x10:nothing", 4, 10) is None
+
+def test_index_drops_files_that_changed_or_vanished(tmp_path):
+    root = str(tmp_path / "library")
+    path = write_file(os.path.join(root, "a.mkv"), b"a" * 2000)
+    digest = local_digest(path, 2000, 4, 10)
+    index = ContentIndex(str(tmp_path / "index.db"))
+    index.scan([root], min_size=0)
+
+    write_file(path, b"a" * 2500)
+    assert index.find(2000, digest, 4, 10) is None
+    assert not index.has_size(2000)
+
+    index.scan([root], min_size=0)
+    os.remove(path)
+    index.scan([root], min_size=0)
+    assert not index.has_size(2500)
+
+def test_link_file_copy_mode(tmp_path):
+    source = write_file(str(tmp_path / "a"), b"data")
+    target = str(tmp_path / "b")
+    assert link_file(source, target, "copy") == "copy"
+    assert open(target, 'rb').read() == b"data"
+    assert not os.path.exists(f"{target}.link")
+
+@pytest.fixture
+def library(tmp_path):
+    root = str(tmp_path / "library")
+    configure_dedup({"enabled": True, "link": "copy", "min_size_mb": 1, "rescan_minutes": 60}, [root])
+    return root
+
+def served(path, size):
+    # What the fake site sends for /f/<path>
+    pattern = file_pattern(path)
+    return (pattern * (size // PATTERN_SIZE + 1))[:size]
+
+async def link(url, path, size):
+    return await deduplicator.link_existing(get_session(), url, path, size, DOWNLOAD_HEADERS)
+
+def test_link_existing_links_matching_remote_file(library, fake_site, run):
+    server = fake_site(file_size_mb=2)
+    write_file(os.path.join(library, "old", "E001.mkv"), served("show/E001.mkv", 2 * MB))
+    path = os.path.join(library, "new", "E001.mkv")
+
+    linked = run(link(f"{server.url}/f/show/E001.mkv", path, 2 * MB))
+    assert linked == path
+    assert os.path.getsize(path) == 2 * MB
+    # Four sampled range requests and no transfer
+    assert server.site.requests["file"] == 4
+
+def test_link_existing_rejects_same_size_different_content(library, fake_site, run):
+    server = fake_site(file_size_mb=2)
+    write_file(os.path.join(library, "old", "E001.mkv"), served("show/E002.mkv", 2 * MB))
+    path = os.path.join(library, "new", "E001.mkv")
+
+    assert run(link(f"{server.url}/f/show/E001.mkv", path, 2 * MB)) is None
+    assert not os.path.exists(path)
+
+def test_link_existing_without_size_or_match_sends_nothing(library, fake_site, run):
+    server = fake_site(file_size_mb=2)
+    url = f"{server.url}/f/show/E001.mkv"
+    path = os.path.join(library, "new", "E001.mkv")
+    assert run(link(url, path, None)) is None
+    assert run(link(url, path, 3 * MB)) is None
+    assert server.site.requests["file"] == 0
+
+def test_download_of_new_file_costs_one_request(library, fake_site, run):
+    server = fake_site(file_size_mb=2)
+    url = f"{server.url}/f/show/E001.mkv"
+
+    assert run(download_file(None, url, os.path.join(library, "one", "E001.mkv"), 0))
+    assert server.site.requests["file"] == 1
+
+    # Same content under another name: found from the first response's size, then linked
+    deduplicator.scanned_at = None
+    result = run(download_file(None, url, os.path.join(library, "two", "E001.mkv"), 0))
+    assert result == (os.path.join(library, "two", "E001.mkv"), 0, 0)
+    assert deduplicator.linked >= 1
@@ -0,0 +1,97 @@
+import asyncio
+import io
+import threading
+
+import pytest
+
+from disk_writer import AsyncFileWriter, disk_settings
+
+MB = 1024 * 1024
+
+class Manifest:
+    # Records what the writer hashed and how much of it had been hashed at each save
+    def __init__(self):
+        self.hashed = 0
+        self.saves = []
+
+    def update(self, data):
+        self.hashed += len(data)
+
+    def save(self):
+        self.saves.append(self.hashed)
+
+def chunks(count, size=256 * 1024):
+    return [bytes([i % 256]) * size for i in range(count)]
+
+def test_writes_in_order_and_appends(tmp_path, run):
+    path = str(tmp_path / "file")
+    with open(path, 'wb') as f:
+        f.write(b"head")
+
+    async def main():
+        async with AsyncFileWriter(path, 'ab') as file:
+            assert file.tell() == 4
+            for chunk in chunks(6):
+                await file.write(chunk)
+            return file.tell()
+
+    assert run(main()) == 4 + 6 * 256 * 1024
+    with open(path, 'rb') as f:
+        assert f.read() == b"head" + b"".join(chunks(6))
+
+def test_manifest_is_saved_after_each_fsync(tmp_path, run, monkeypatch):
+    monkeypatch.setitem(disk_settings, "coalesce_mb", 1)
+    monkeypatch.setitem(disk_settings, "fsync_interval_mb", 1)
+    manifest = Manifest()
+
+    async def main():
+        async with AsyncFileWriter(str(tmp_path / "file"), 'ab', manifest=manifest) as file:
+            for chunk in chunks(12):
+                await file.write(chunk)
+                # Lets the writer keep up, so batches stay at the coalesce size
+                await asyncio.sleep(0.01)
+
+    run(main())
+    assert manifest.hashed == 3 * MB
+    assert len(manifest.saves) >= 3
+    assert manifest.saves[-1] == 3 * MB
+    assert manifest.saves == sorted(manifest.saves)
+
+def test_write_error_is_raised_to_the_caller(tmp_path, run):
+    path = str(tmp_path / "file")
+    open(path, 'wb').close()
+
+    async def main():
+        # A file opened for reading fails on its first write
+        async with AsyncFileWriter(path, 'rb') as file:
+            await file.write(b"data")
+
+    with pytest.raises(io.UnsupportedOperation):
+        run(main())
+
+def test_full_queue_blocks_the_reader(tmp_path, run, monkeypatch):
+    monkeypatch.setitem(disk_settings, "queue_size_mb", 1)
+    release = threading.Event()
+
+    async def main():
+        async with AsyncFileWriter(str(tmp_path / "file"), 'ab') as file:
+            write_batch = file._write_batch
+
+            def slow_write_batch(batch, sync):
+                release.wait(10)
+                write_batch(batch, sync)
+
+            file._write_batch = slow_write_batch
+            # One chunk is with the stuck writer thread, the next fills the queue
+            await file.write(b"a" * MB)
+            await asyncio.sleep(0.05)
+            await file.write(b"b" * MB)
+            blocked = asyncio.create_task(file.write(b"c" * MB))
+            await asyncio.sleep(0.1)
+            assert not blocked.done()
+            release.set()
+            await blocked
+        return file.tell()
+
+    assert run(main()) == 3 * MB
+    assert (tmp_path / "file").stat().st_size == 3 * MB
@@ -0,0 +1,131 @@
+import sqlite3
+
+import pytest
+
+from http_client import get_session
+from download_daemon import JobQueue, DownloadDaemon, PENDING, LISTING, DOWNLOADING, VERIFYING, DONE, FAILED, CANCELLED
+
+@pytest.fixture
+def queue(tmp_path):
+    return JobQueue(str(tmp_path / "queue.db"))
+
+def add_job(queue, tmp_path, files=2, priority=0):
+    job_id = queue.enqueue({"query": "show"}, priority)
+    assert queue.next_job_to_list()[0] == job_id
+    queue.add_files(job_id, "TV Shows", [
+        {"url": f"http://site/f/{job_id}/E{i}.mkv", "path": str(tmp_path / f"{job_id}-E{i}.mkv"), "item": "show", "season": "S1", "file": f"E{i}.mkv", "size": 1000 + i}
+        for i in range(files)
+    ])
+    return job_id
+
+def file_states(queue, job_id):
+    return queue.job(job_id)["files"]
+
+def test_recover_requeues_work_in_flight(queue, tmp_path):
+    listing = queue.enqueue({"query": "a"})
+    queue.set_state(listing, LISTING)
+    verifying = add_job(queue, tmp_path)
+    files = queue.next_files(2, set())
+    queue.set_state(verifying, VERIFYING)
+    queue.set_file_state(files[0]["id"], DOWNLOADING)
+    queue.set_file_state(files[1]["id"], DONE, size_mb=1.0)
+
+    assert queue.recover() == (2, 1)
+    assert queue.job(listing)["state"] == PENDING
+    assert queue.job(verifying)["state"] == DOWNLOADING
+    assert file_states(queue, verifying) == {PENDING: 1, DONE: 1}
+
+def test_recover_leaves_finished_jobs(queue, tmp_path):
+    job_id = add_job(queue, tmp_path)
+    queue.set_state(job_id, CANCELLED)
+    assert queue.recover() == (0, 0)
+    assert queue.job(job_id)["state"] == CANCELLED
+
+def test_add_files_ignores_duplicates(queue, tmp_path):
+    job_id = add_job(queue, tmp_path)
+    queue.add_files(job_id, "TV Shows", [{"url": f"http://site/f/{job_id}/E0.mkv", "path": "x", "item": "show", "season": "S1", "file": "E0.mkv"}])
+    assert file_states(queue, job_id) == {PENDING: 2}
+
+def test_next_files_by_priority_skips_paused_and_excluded(queue, tmp_path):
+    low = add_job(queue, tmp_path)
+    high = add_job(queue, tmp_path, priority=5)
+    paused = add_job(queue, tmp_path, priority=9)
+    queue.update(paused, paused=1)
+
+    files = queue.next_files(3, set())
+    assert [file["job_id"] for file in files] == [high, high, low]
+    assert queue.next_files(1, {files[0]["id"]})[0]["id"] == files[1]["id"]
+
+def test_finish_jobs_verifies_files_on_disk(queue, tmp_path):
+    job_id = add_job(queue, tmp_path)
+    files = queue.next_files(2, set())
+    for file in files:
+        queue.set_file_state(file["id"], DONE)
+    open(files[0]["path"], 'wb').close()
+
+    # The second file was reported done but is gone from disk
+    assert queue.finish_jobs() == []
+    assert queue.job(job_id)["state"] == DOWNLOADING
+    assert file_states(queue, job_id) == {DONE: 1, PENDING: 1}
+
+    open(files[1]["path"], 'wb').close()
+    queue.set_file_state(files[1]["id"], DONE)
+    assert queue.finish_jobs() == [(job_id, DONE)]
+
+def test_finish_jobs_reports_failed_files(queue, tmp_path):
+    job_id = add_job(queue, tmp_path)
+    files = queue.next_files(2, set())
+    open(files[0]["path"], 'wb').close()
+    queue.set_file_state(files[0]["id"], DONE)
+    queue.set_file_state(files[1]["id"], FAILED, error="boom")
+    assert queue.finish_jobs() == [(job_id, FAILED)]
+    assert queue.job(job_id)["error"] == "1 files failed"
+
+def test_unfinished_jobs_listing(queue, tmp_path):
+    done = add_job(queue, tmp_path)
+    queue.set_state(done, DONE)
+    pending = queue.enqueue({"query": "b"})
+    assert [job["id"] for job in queue.jobs(include_finished=False)] == [pending]
+    assert queue.job(pending)["spec"] == {"query": "b"}
+
+def test_listed_size_is_kept_and_passed_to_the_transfer(tmp_path, fake_site, run):
+    server = fake_site(folders=1, files=2)
+    daemon = DownloadDaemon({"base_url": server.url, "download_paths": {}}, {"database": str(tmp_path / "queue.db")}, str(tmp_path / "downloads"))
+    job_id = daemon.queue.enqueue({"category": "TV Shows", "query": "show"})
+    daemon.queue.next_job_to_list()
+
+    async def list_and_download():
+        session = get_session()
+        await daemon.list_job(session, job_id, {"category": "TV Shows", "query": "show"})
+        files = daemon.queue.next_files(2, set())
+        sizes = []
+
+        async def run_transfer(session, transfer):
+            sizes.append(transfer["size"])
+            return {"status": "failed"}
+
+        daemon.runner.run_transfer = run_transfer
+        await daemon.download(session, files[0])
+        return files, sizes
+
+    files, sizes = run(list_and_download())
+    # The fake site lists every file as 1.2 GB
+    assert [file["size"] for file in files] == [int(1.2 * 1024 ** 3)] * 2
+    assert sizes == [files[0]["size"]]
+
+def test_queue_created_without_sizes_is_upgraded(tmp_path):
+    path = str(tmp_path / "queue.db")
+    conn = sqlite3.connect(path)
+    conn.executescript("""
+        CREATE TABLE jobs (id INTEGER PRIMARY KEY, spec TEXT NOT NULL, state TEXT NOT NULL DEFAULT 'pending',
+            priority INTEGER NOT NULL DEFAULT 0, paused INTEGER NOT NULL DEFAULT 0, error TEXT,
+            created_at TEXT NOT NULL, updated_at TEXT NOT NULL);
+        CREATE TABLE files (id INTEGER PRIMARY KEY, job_id INTEGER NOT NULL, category TEXT NOT NULL, url TEXT NOT NULL,
+            path TEXT NOT NULL, item TEXT NOT NULL, season TEXT NOT NULL DEFAULT '', file TEXT NOT NULL,
+            state TEXT NOT NULL DEFAULT 'pending', size_mb REAL, error TEXT, UNIQUE (job_id, url));
+    """)
+    conn.close()
+
+    queue = JobQueue(path)
+    add_job(queue, tmp_path, files=1)
+    assert queue.next_files(1, set())[0]["size"] == 1000
@@ -0,0 +1,118 @@
+import asyncio
+
+from download_scheduler import DownloadScheduler
+
+async def start(scheduler, started, name, size):
+    # Takes a slot and holds it until the returned event is set
+    done = asyncio.Event()
+
+    async def transfer():
+        async with scheduler.slot(size):
+            started.append(name)
+            await done.wait()
+
+    task = asyncio.create_task(transfer())
+    await asyncio.sleep(0.01)
+    return task, done
+
+def test_byte_budget_holds_back_what_does_not_fit(run):
+    async def main():
+        scheduler = DownloadScheduler(max_active=4, max_bytes_in_flight=100)
+        started = []
+        first, first_done = await start(scheduler, started, "a", 60)
+        second, second_done = await start(scheduler, started, "b", 60)
+        assert started == ["a"] and scheduler.bytes_in_flight == 60
+
+        first_done.set()
+        await first
+        await asyncio.sleep(0.01)
+        assert started == ["a", "b"]
+        second_done.set()
+        await second
+        assert (scheduler.active, scheduler.bytes_in_flight) == (0, 0)
+
+    run(main())
+
+def test_file_larger_than_the_budget_runs_alone(run):
+    async def main():
+        scheduler = DownloadScheduler(max_active=4, max_bytes_in_flight=100)
+        started = []
+        large, large_done = await start(scheduler, started, "large", 500)
+        small, small_done = await start(scheduler, started, "small", 10)
+        assert started == ["large"]
+        large_done.set()
+        await large
+        await asyncio.sleep(0.01)
+        assert started == ["large", "small"]
+        small_done.set()
+        await small
+
+    run(main())
+
+def test_waiting_large_file_is_not_overtaken_by_small_ones(run):
+    async def main():
+        scheduler = DownloadScheduler(max_active=4, max_bytes_in_flight=100)
+        started = []
+        first, first_done = await start(scheduler, started, "a", 60)
+        large, large_done = await start(scheduler, started, "large", 60)
+        # Would fit next to the first transfer, but was submitted after the large one
+        small, small_done = await start(scheduler, started, "small", 10)
+        assert started == ["a"]
+
+        first_done.set()
+        await first
+        await asyncio.sleep(0.01)
+        assert started == ["a", "large", "small"]
+        large_done.set()
+        small_done.set()
+        await asyncio.gather(large, small)
+
+    run(main())
+
+def test_unknown_size_counts_as_the_estimate(run):
+    async def main():
+        scheduler = DownloadScheduler(max_active=4, max_bytes_in_flight=100, size_estimate=80)
+        started = []
+        unknown, unknown_done = await start(scheduler, started, "unknown", None)
+        assert scheduler.bytes_in_flight == 80
+        known, known_done = await start(scheduler, started, "known", 30)
+        assert started == ["unknown"]
+        unknown_done.set()
+        known_done.set()
+        await asyncio.gather(unknown, known)
+
+    run(main())
+
+def test_raised_limits_wake_waiting_transfers(run):
+    async def main():
+        scheduler = DownloadScheduler(max_active=1)
+        started = []
+        first, first_done = await start(scheduler, started, "a", 10)
+        second, second_done = await start(scheduler, started, "b", 10)
+        assert started == ["a"]
+        await scheduler.set_limits(max_active=2)
+        await asyncio.sleep(0.01)
+        assert started == ["a", "b"]
+        first_done.set()
+        second_done.set()
+        await asyncio.gather(first, second)
+
+    run(main())
+
+def test_cancelled_waiter_leaves_the_queue(run):
+    async def main():
+        scheduler = DownloadScheduler(max_active=1)
+        started = []
+        first, first_done = await start(scheduler, started, "a", 10)
+        cancelled, _ = await start(scheduler, started, "b", 10)
+        third, third_done = await start(scheduler, started, "c", 10)
+        cancelled.cancel()
+        await asyncio.sleep(0.01)
+        first_done.set()
+        await first
+        await asyncio.sleep(0.01)
+        assert started == ["a", "c"] and list(scheduler.waiting) == []
+        third_done.set()
+        await third
+
+    run(main())
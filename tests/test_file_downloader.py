@@ -0,0 +1,85 @@
+import os
+
+import pytest
+
+import file_downloader
+from file_downloader import plan_segments, find_segment_parts, stitch_segments, download_file
+from resume_manifest import ResumeManifest, BLOCK_SIZE
+
+MB = 1024 * 1024
+
+@pytest.fixture
+def min_segment_size(monkeypatch):
+    monkeypatch.setattr(file_downloader, "min_segment_size", 16 * MB)
+
+def test_plan_segments_cover_file_on_block_boundaries(min_segment_size):
+    total = 100 * MB + 123
+    ranges = plan_segments(total, 4)
+    assert len(ranges) == 4
+    assert ranges[0][0] == 0 and ranges[-1][1] == total - 1
+    for (_, end), (start, _) in zip(ranges, ranges[1:]):
+        assert start == end + 1
+    for start, _ in ranges:
+        assert start % BLOCK_SIZE == 0
+
+def test_plan_segments_never_below_min_segment_size(min_segment_size):
+    assert len(plan_segments(40 * MB, 8)) == 2
+    assert plan_segments(10 * MB, 4) == [(0, 10 * MB - 1)]
+
+def test_find_segment_parts_sorted_by_start(tmp_path):
+    temp_path = str(tmp_path / "file.mkv.tmp")
+    for name in ("file.mkv.tmp.part20-29", "file.mkv.tmp.part10-19", "file.mkv.tmp.part10-19.manifest"):
+        (tmp_path / name).write_bytes(b"")
+    assert [(start, end) for start, end, _ in find_segment_parts(temp_path)] == [(10, 19), (20, 29)]
+
+def write_segment(path, data, offset=0):
+    with open(path, 'wb') as f:
+        f.write(data)
+    manifest = ResumeManifest(path, offset=offset, block_size=4)
+    manifest.update(data)
+    manifest.save()
+
+def test_stitch_segments_joins_parts_and_manifests(tmp_path):
+    data = bytes(range(24))
+    temp_path = str(tmp_path / "file.tmp")
+    write_segment(temp_path, data[:8])
+    ranges = [(0, 7, temp_path)]
+    for start, end in ((8, 15), (16, 23)):
+        part_path = f"{temp_path}.part{start}-{end}"
+        write_segment(part_path, data[start:end + 1], offset=start)
+        ranges.append((start, end, part_path))
+
+    stitch_segments(temp_path, ranges)
+
+    assert open(temp_path, 'rb').read() == data
+    assert find_segment_parts(temp_path) == []
+    manifest = ResumeManifest.load(temp_path)
+    assert len(manifest.blocks) == 6
+    assert manifest.validate() == len(data)
+
+def test_stitch_segments_redoes_an_interrupted_stitch(tmp_path):
+    data = bytes(range(16))
+    temp_path = str(tmp_path / "file.tmp")
+    # The first part was half copied before the process died
+    write_segment(temp_path, data[:8] + data[8:11])
+    part_path = f"{temp_path}.part8-15"
+    write_segment(part_path, data[8:], offset=8)
+
+    stitch_segments(temp_path, [(0, 7, temp_path), (8, 15, part_path)])
+
+    assert open(temp_path, 'rb').read() == data
+
+def test_segmented_download_matches_single_stream(tmp_path, fake_site, run, monkeypatch):
+    monkeypatch.setattr(file_downloader, "min_segment_size", MB)
+    server = fake_site(file_size_mb=6)
+    url = f"{server.url}/f/show/E001.mkv"
+    single = str(tmp_path / "single" / "E001.mkv")
+    segmented = str(tmp_path / "segmented" / "E001.mkv")
+
+    assert run(download_file(None, url, single, 0, segments=1))
+    assert run(download_file(None, url, segmented, 0, segments=3))
+
+    assert open(single, 'rb').read() == open(segmented, 'rb').read()
+    assert os.path.getsize(segmented) == 6 * MB
+    assert not os.path.exists(f"{segmented}.tmp")
+    assert find_segment_parts(f"{segmented}.tmp") == []
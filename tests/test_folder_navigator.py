@@ -0,0 +1,112 @@
+import asyncio
+import os
+
+import pytest
+
+import folder_navigator
+from folder_navigator import FolderNavigator
+from scraper.anime_scraper import AnimeScraper
+
+GB = 1024 ** 3
+
+@pytest.fixture
+def site(fake_site):
+    return fake_site(folders=2, depth=2, files=2)
+
+@pytest.fixture
+def navigator(site, tmp_path):
+    navigator = FolderNavigator(AnimeScraper(site.url, str(tmp_path / "downloads")), "/d/show/")
+    # Counts the folder listings the navigator asks the scraper for
+    navigator.listed = []
+    fetch = navigator.scraper.fetch_directory_contents
+
+    async def fetch_directory_contents(path):
+        navigator.listed.append(path)
+        return await fetch(path)
+
+    navigator.scraper.fetch_directory_contents = fetch_directory_contents
+    return navigator
+
+def test_directory_contents_are_folders_then_files(site, navigator, run):
+    contents = run(navigator.scraper.fetch_directory_contents("/d/show/"))
+    assert [(entry['name'], entry['path'], entry['is_dir']) for entry in contents] == [
+        ("Season 1", "/d/show/s1/", True),
+        ("Season 2", "/d/show/s2/", True),
+        ("E001.mkv", "/f/show/E001.mkv", False),
+        ("E002.mkv", "/f/show/E002.mkv", False)
+    ]
+    assert contents[0]['url'] == f"{site.url}/d/show/s1/"
+    assert [entry['size'] for entry in contents] == [None, None, int(1.2 * GB), int(1.2 * GB)]
+
+def test_unreachable_folder_lists_nothing(navigator, run, monkeypatch):
+    async def fail(session, url, retries=3):
+        return None
+
+    monkeypatch.setattr(navigator.scraper, "fetch_page", fail)
+    assert run(navigator.scraper.fetch_directory_contents("/d/show/")) == []
+
+def test_subfolders_are_prefetched_while_the_listing_is_shown(navigator, run):
+    async def main():
+        await navigator.list_contents()
+        await asyncio.gather(*navigator.prefetching.values())
+        navigator.change_directory("/d/show/s1/", "Season 1")
+        return await navigator.list_contents()
+
+    contents = run(main())
+    assert [entry['name'] for entry in contents] == ["E001.mkv", "E002.mkv"]
+    # Entering the folder was answered from the prefetch cache
+    assert sorted(navigator.listed) == ["/d/show/", "/d/show/s1/", "/d/show/s2/"]
+    assert navigator.prefetching == {}
+
+def test_entering_a_folder_joins_its_running_prefetch(navigator, run):
+    async def main():
+        await navigator.list_contents()
+        return await navigator.get_contents("/d/show/s2/")
+
+    assert [entry['name'] for entry in run(main())] == ["E001.mkv", "E002.mkv"]
+    assert navigator.listed.count("/d/show/s2/") == 1
+
+def test_prefetches_for_folders_no_longer_shown_are_cancelled(navigator, run):
+    async def main():
+        await navigator.list_contents()
+        tasks = list(navigator.prefetching.values())
+        navigator.prefetch([])
+        await asyncio.gather(*tasks, return_exceptions=True)
+        return tasks
+
+    assert all(task.cancelled() for task in run(main()))
+    assert navigator.cache.keys() == {"/d/show/"}
+
+def test_cache_keeps_the_latest_folders(navigator, run, monkeypatch):
+    monkeypatch.setattr(folder_navigator, "PREFETCH_CACHE_SIZE", 2)
+
+    async def main():
+        for path in ("/d/show/s1/", "/d/show/s2/", "/d/show/"):
+            await navigator.get_contents(path)
+
+    run(main())
+    assert list(navigator.cache) == ["/d/show/s2/", "/d/show/"]
+
+def test_up_and_back_follow_the_crumbs(navigator):
+    navigator.change_directory("/d/show/s1/", "Season 1")
+    navigator.change_directory("/d/show/s1/x/", "X")
+    navigator.go_up()
+    assert (navigator.current_path, navigator.crumbs) == ("/d/show/s1/", [("/d/show/s1/", "Season 1")])
+    navigator.go_up()
+    assert (navigator.current_path, navigator.crumbs) == ("/d/show/", [])
+    navigator.go_back()
+    assert navigator.current_path == "/d/show/s1/"
+    navigator.go_back()
+    assert navigator.current_path == "/d/show/s1/x/"
+
+def test_selected_file_is_saved_under_its_folders(navigator, run, tmp_path):
+    answers = iter(["y"])
+
+    async def prompt(text):
+        return next(answers)
+
+    navigator.prompt = prompt
+    navigator.change_directory("/d/show/s1/", "Season 1")
+    contents = run(navigator.get_contents("/d/show/s1/"))
+    run(navigator.handle_file_selection(contents[0]))
+    assert os.path.getsize(tmp_path / "downloads" / "Season_1" / "E001.mkv") == 2 * 1024 * 1024
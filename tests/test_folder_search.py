@@ -0,0 +1,114 @@
+import os
+import re
+from contextlib import aclosing
+
+import pytest
+
+from catalog import catalog, DEFAULT_CATALOG_SETTINGS
+from folder_navigator import FolderNavigator
+from http_client import get_session
+from scraper.anime_scraper import AnimeScraper
+
+# With two folders and depth three: the start folder, 2 below it and 4 below those
+FOLDERS = 7
+
+@pytest.fixture
+def site(fake_site):
+    return fake_site(folders=2, depth=3, files=2)
+
+@pytest.fixture
+def scraper(site, tmp_path):
+    return AnimeScraper(site.url, str(tmp_path / "downloads"))
+
+def search(run, scraper, query, limit=None, **options):
+    async def main():
+        results = []
+        async with aclosing(scraper.search_in_directory("/d/show/", query, **options)) as matches:
+            async for entry in matches:
+                results.append(entry)
+                if len(results) == limit:
+                    break
+        return results
+    return run(main())
+
+def test_matches_below_the_folder_with_crumbs(scraper, run):
+    results = search(run, scraper, "e002")
+    assert len(results) == FOLDERS
+    hit = next(entry for entry in results if entry['path'] == "/f/show/s1/s2/E002.mkv")
+    assert not hit['is_dir'] and hit['size'] == int(1.2 * 1024 ** 3)
+    assert hit['crumbs'] == [("/d/show/s1/", "Season 1"), ("/d/show/s1/s2/", "Season 2")]
+    assert next(entry for entry in results if entry['path'] == "/f/show/E002.mkv")['crumbs'] == []
+
+def test_folders_match_too(scraper, run):
+    results = search(run, scraper, "season 2")
+    assert sorted(entry['path'] for entry in results) == ["/d/show/s1/s2/", "/d/show/s2/", "/d/show/s2/s2/"]
+    assert all(entry['is_dir'] for entry in results)
+
+def test_depth_limit(site, scraper, run):
+    assert len(search(run, scraper, "e002", max_depth=2)) == 3
+    assert len(search(run, scraper, "e002", max_depth=1)) == 1
+
+def test_each_folder_is_listed_once(site, scraper, run):
+    search(run, scraper, "e001", workers=3)
+    assert site.site.requests["listing"] == FOLDERS
+
+def test_first_hit_arrives_before_the_crawl_ends(fake_site, tmp_path, run):
+    server = fake_site(folders=2, depth=3, files=2, latency_ms=50)
+    scraper = AnimeScraper(server.url, str(tmp_path / "downloads"))
+    results = search(run, scraper, "e001", limit=1, workers=1)
+    assert len(results) == 1
+    # Closing the stream stopped the crawl
+    assert server.site.requests["listing"] < FOLDERS
+
+def test_time_limit_returns_what_was_found(fake_site, tmp_path, run):
+    server = fake_site(folders=2, depth=3, files=2, latency_ms=200)
+    scraper = AnimeScraper(server.url, str(tmp_path / "downloads"))
+    results = search(run, scraper, "e001", workers=1, time_limit=0.3)
+    assert 1 <= len(results) < FOLDERS
+
+def test_failed_folder_does_not_end_the_search(scraper, run, monkeypatch):
+    fetch = scraper.fetch_directory_contents
+
+    async def fetch_directory_contents(path):
+        if path == "/d/show/s1/":
+            raise ValueError("broken listing")
+        return await fetch(path)
+
+    monkeypatch.setattr(scraper, "fetch_directory_contents", fetch_directory_contents)
+    # Season 1 and its two subfolders are missing
+    assert len(search(run, scraper, "e002")) == FOLDERS - 3
+
+def test_catalog_answers_without_listing_requests(site, scraper, run, tmp_path, monkeypatch):
+    monkeypatch.setattr(catalog, "settings", dict(DEFAULT_CATALOG_SETTINGS, enabled=True, root="/d/"))
+    monkeypatch.setattr(catalog, "db_path", str(tmp_path / "catalog.db"))
+    monkeypatch.setattr(catalog, "fts", None)
+
+    async def crawl():
+        return await catalog.crawl(get_session(), scraper.fetch_text, site.url)
+
+    run(crawl())
+    listed = site.site.requests["listing"]
+
+    async def search_subtree():
+        return [entry async for entry in scraper.search_in_directory("/d/s1/", "e002")]
+
+    results = run(search_subtree())
+    assert site.site.requests["listing"] == listed
+    assert len(results) == FOLDERS
+    hit = next(entry for entry in results if entry['path'] == "/f/s1/s2/s1/E002.mkv")
+    assert hit['crumbs'] == [("/d/s1/s2/", "Season 2"), ("/d/s1/s2/s1/", "Season 1")]
+
+def test_navigator_saves_a_deep_hit_under_its_folders(scraper, run, tmp_path, capsys):
+    navigator = FolderNavigator(scraper, "/d/show/")
+    answers = iter(["y"])
+
+    async def prompt(text):
+        # The hits come in crawl order, so the number is read from the printed list
+        printed = capsys.readouterr().out
+        if "Enter number" in text:
+            return re.search(r"(\d+)\. \S+ E002\.mkv .*\(/f/show/s2/s1/E002\.mkv\)", printed).group(1)
+        return next(answers)
+
+    navigator.prompt = prompt
+    run(navigator.search("e002"))
+    assert os.path.exists(tmp_path / "downloads" / "Season_2" / "Season_1" / "E002.mkv")
@@ -0,0 +1,88 @@
+import pytest
+
+from follow_sync import FollowSync, FollowStore, PENDING, BASELINE
+
+def test_merge_episodes_returns_only_new_urls(tmp_path):
+    store = FollowStore(str(tmp_path / "follows.db"))
+    show_id = store.add_show("Show", "http://site/d/show/")
+    episodes = [{"url": "http://site/f/show/E1.mkv", "name": "E1.mkv"}, {"url": "http://site/f/show/E2.mkv", "name": "E2.mkv"}]
+    assert store.merge_episodes(show_id, "s1", episodes, BASELINE) == episodes
+
+    # A re-uploaded episode has a new URL and counts as new, even with the same name
+    reuploaded = {"url": "http://site/f/show/E2-v2.mkv", "name": "E2.mkv"}
+    assert store.merge_episodes(show_id, "s1", episodes + [reuploaded], PENDING) == [reuploaded]
+    assert [episode["url"] for episode in store.pending(show_id)] == [reuploaded["url"]]
+
+def test_add_show_is_idempotent(tmp_path):
+    store = FollowStore(str(tmp_path / "follows.db"))
+    assert store.add_show("Show", "http://site/d/show/") == store.add_show("Show", "http://site/d/show/")
+    assert len(store.shows()) == 1
+
+@pytest.fixture
+def follower(tmp_path, fake_site):
+    server = fake_site(folders=2, files=2)
+    config = {"base_url": server.url, "download_paths": {}}
+    follow_sync = FollowSync(config, {"database": str(tmp_path / "follows.db"), "recheck_seasons": 1}, str(tmp_path / "downloads"))
+    return server, follow_sync
+
+def test_follow_without_backfill_downloads_nothing(follower, run):
+    server, follow_sync = follower
+    show = run(follow_sync.follow("show"))
+    assert show["name"] == "show 0"
+    summary = run(follow_sync.sync())
+    assert summary["ok"] and summary["transfers"] == {"downloaded": 0, "skipped": 0, "failed": 0}
+    # The show page and the latest season, both answered with 304
+    assert summary["listing_requests"] == 2
+
+def test_sync_downloads_new_episodes_once(follower, run):
+    server, follow_sync = follower
+    run(follow_sync.follow("show"))
+    server.site.options["files"] = 3
+
+    summary = run(follow_sync.sync())
+    assert summary["transfers"]["downloaded"] == 1
+    assert [(result["show"], result["path"].rsplit("/", 2)[-2:]) for result in summary["files"]] == [("show 0", ["Season_2", "E003.mkv"])]
+    show_id = follow_sync.store.shows()[0]["id"]
+    assert follow_sync.store.pending(show_id) == []
+
+    summary = run(follow_sync.sync())
+    assert summary["transfers"]["downloaded"] == 0
+
+def test_new_season_is_fetched_in_full(follower, run):
+    server, follow_sync = follower
+    run(follow_sync.follow("show"))
+    server.site.options["folders"] = 3
+
+    summary = run(follow_sync.sync())
+    assert sorted(result["path"].rsplit("/", 2)[-2] for result in summary["files"]) == ["Season_3", "Season_3"]
+    show = follow_sync.store.shows()[0]
+    assert (show["seasons"], show["downloaded"]) == (3, 2)
+
+def test_backfill_downloads_everything_listed(follower, run):
+    server, follow_sync = follower
+    run(follow_sync.follow("show", backfill=True))
+    summary = run(follow_sync.sync())
+    assert summary["transfers"]["downloaded"] == 4
+    show_id = follow_sync.store.shows()[0]["id"]
+    assert follow_sync.store.pending(show_id) == []
+    assert follow_sync.store.shows()[0]["downloaded"] == 4
+
+def test_season_that_failed_is_retried_by_the_next_sync(follower, run, monkeypatch):
+    server, follow_sync = follower
+    run(follow_sync.follow("show"))
+    server.site.options["folders"] = 4
+    fetch = follow_sync.fetch
+
+    async def fail_season_3(session, url, etag=None, last_modified=None):
+        if url.endswith("/s3/"):
+            return None
+        return await fetch(session, url, etag, last_modified)
+
+    monkeypatch.setattr(follow_sync, "fetch", fail_season_3)
+    summary = run(follow_sync.sync())
+    assert sorted(result["path"].rsplit("/", 2)[-2] for result in summary["files"]) == ["Season_4", "Season_4"]
+
+    # Season 3 is no longer among the latest, but the show page was not marked as seen
+    monkeypatch.setattr(follow_sync, "fetch", fetch)
+    summary = run(follow_sync.sync())
+    assert sorted(result["path"].rsplit("/", 2)[-2] for result in summary["files"]) == ["Season_3", "Season_3"]
@@ -0,0 +1,81 @@
+import json
+import os
+
+from history_store import HistoryStore
+
+OLD_HISTORY = {
+    "Some Show": {
+        "Season 1": {
+            "episodes": {
+                "E01.mkv": {"size_mb": 700.0, "download_time": 10.0, "speed_mbps": 70.0},
+                "E02.mkv": {"size_mb": 710.0, "download_time": 11.0, "speed_mbps": 64.5}
+            },
+            "last_download": "2024-01-02 03:04:05"
+        }
+    },
+    "Some Movie": {
+        "files": {
+            "movie.mkv": {"size_mb": 1400.0, "download_time": 20.0, "speed_mbps": 70.0}
+        },
+        "last_download": "2024-02-03 04:05:06"
+    },
+    "broken": "not a dict"
+}
+
+def write_json(path, data):
+    with open(path, 'w') as f:
+        json.dump(data, f)
+
+def test_migrate_json_imports_shows_and_movies(tmp_path):
+    json_path = str(tmp_path / "download_history.json")
+    write_json(json_path, OLD_HISTORY)
+    store = HistoryStore(str(tmp_path / "download_history.db"))
+
+    assert store.migrate_json(json_path) == 3
+    assert store.count() == 3
+    episode = store.lookup("Some Show", "Season 1", "E02.mkv")[0]
+    assert (episode["size_mb"], episode["speed_mbps"], episode["downloaded_at"]) == (710.0, 64.5, "2024-01-02 03:04:05")
+    movie = store.lookup("Some Movie")[0]
+    assert (movie["season"], movie["file"]) == ("", "movie.mkv")
+
+def test_migrate_json_renames_file_so_it_runs_once(tmp_path):
+    json_path = str(tmp_path / "download_history.json")
+    write_json(json_path, OLD_HISTORY)
+    store = HistoryStore(str(tmp_path / "download_history.db"))
+    store.migrate_json(json_path)
+
+    assert not os.path.exists(json_path)
+    assert os.path.exists(f"{json_path}.migrated")
+    assert store.migrate_json(json_path) == 0
+
+def test_migrate_json_keeps_existing_rows(tmp_path):
+    json_path = str(tmp_path / "download_history.json")
+    write_json(json_path, OLD_HISTORY)
+    store = HistoryStore(str(tmp_path / "download_history.db"))
+    store.record("Some Show", "Season 1", "E01.mkv", 1.0, 2.0, 3.0, "2025-01-01 00:00:00")
+
+    store.migrate_json(json_path)
+
+    assert store.lookup("Some Show", "Season 1", "E01.mkv")[0]["size_mb"] == 1.0
+    assert store.count() == 3
+
+def test_migrate_json_leaves_unreadable_file_alone(tmp_path):
+    json_path = str(tmp_path / "download_history.json")
+    with open(json_path, 'w') as f:
+        f.write("{truncated")
+    store = HistoryStore(str(tmp_path / "download_history.db"))
+
+    assert store.migrate_json(json_path) == 0
+    assert os.path.exists(json_path)
+    assert store.count() == 0
+
+def test_record_replaces_and_pages_in_order(tmp_path):
+    store = HistoryStore(str(tmp_path / "history.db"))
+    store.record("B", None, "b.mkv", 1, 1, 1)
+    store.record("A", "S1", "a.mkv", 1, 1, 1)
+    store.record("A", "S1", "a.mkv", 2, 1, 1)
+
+    assert store.count() == 2
+    assert store.has_file("A", "S1", "a.mkv")
+    assert [row["item"] for row in store.page(0, 10)] == ["A", "B"]
+    assert store.lookup("A")[0]["size_mb"] == 2
@@ -0,0 +1,47 @@
+import asyncio
+
+from aiohttp import web
+
+import http_client
+from http_client import configure_http, get_session, close_session
+
+def test_shared_session_keeps_overall_and_read_limits(monkeypatch):
+    monkeypatch.setattr(http_client, "http_settings", dict(http_client.DEFAULT_HTTP_SETTINGS))
+    configure_http({"request_timeout": 120, "read_timeout": 15, "connect_timeout": 5})
+
+    async def main():
+        session = get_session()
+        try:
+            return session.timeout, get_session() is session
+        finally:
+            await close_session()
+
+    timeout, shared = asyncio.run(main())
+    assert shared
+    assert (timeout.total, timeout.sock_connect, timeout.sock_read) == (120, 5, 15)
+
+def test_stalled_server_times_out(monkeypatch):
+    monkeypatch.setattr(http_client, "http_settings", dict(http_client.DEFAULT_HTTP_SETTINGS))
+    configure_http({"read_timeout": 0.2})
+
+    async def stall(request):
+        await asyncio.sleep(1)
+        return web.Response(text="late")
+
+    async def main():
+        app = web.Application()
+        app.router.add_get('/', stall)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        await web.TCPSite(runner, '127.0.0.1', 0).start()
+        try:
+            async with get_session().get(f"http://127.0.0.1:{runner.addresses[0][1]}/") as response:
+                await response.text()
+        except asyncio.TimeoutError:
+            return "timed out"
+        finally:
+            await close_session()
+            await runner.cleanup()
+        return "answered"
+
+    assert asyncio.run(main()) == "timed out"
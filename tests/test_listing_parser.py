@@ -0,0 +1,47 @@
+import pytest
+
+from scraper.listing_parser import parse_listing, parse_size
+from fake_site import listing_html
+
+BASE = "http://site.test"
+
+def test_folders_and_files_with_sizes():
+    listing = parse_listing(listing_html([("Season 1", "/d/show/s1/")], [("E001.mkv", "/f/show/E001.mkv")]), BASE)
+    # The parent directory link is not a folder
+    assert listing.links == [{"name": "Season 1", "url": f"{BASE}/d/show/s1/"}]
+    assert listing.files == [{"name": "E001.mkv", "url": f"{BASE}/f/show/E001.mkv", "size": int(1.2 * 1024 ** 3)}]
+
+def test_names_are_stripped_and_urls_resolved():
+    html = (
+        '<div class="centerflex name-div"><a href="s%201/">\n  Season One </a></div>'
+        '<div class="centerflex name-div"><span>no link</span></div>'
+        '<a class="file-entry wrap" href="http://cdn.test/E1.mkv"><b>E1</b>.mkv</a>'
+    )
+    listing = parse_listing(html, f"{BASE}/d/show/")
+    assert listing.links == [{"name": "Season One", "url": f"{BASE}/d/show/s%201/"}]
+    assert listing.files == [{"name": "E1 .mkv", "url": "http://cdn.test/E1.mkv", "size": None}]
+
+def test_file_without_size_or_href():
+    html = '<div><a class="file-entry wrap" href="/f/a">a</a></div><a class="file-entry wrap">b</a>'
+    assert parse_listing(html, BASE).files == [{"name": "a", "url": f"{BASE}/f/a", "size": None}]
+
+@pytest.mark.parametrize("html", ["", "   ", b"", "<p>nothing here</p>"])
+def test_empty_pages_give_an_empty_listing(html):
+    listing = parse_listing(html, BASE)
+    assert (listing.links, listing.files) == ([], [])
+
+def test_bytes_and_non_ascii_input():
+    html = listing_html([("Saison été", "/d/été/")], []).encode('utf-8')
+    assert parse_listing(html, BASE).links == [{"name": "Saison été", "url": f"{BASE}/d/été/"}]
+
+@pytest.mark.parametrize("text, size", [
+    ("1.2 GB", int(1.2 * 1024 ** 3)),
+    ("700 MiB", 700 * 1024 ** 2),
+    ("12kb", 12 * 1024),
+    ("512 B", 512),
+    ("2 TB", 2 * 1024 ** 4),
+    ("size unknown", None),
+    ("E01 2024", None)
+])
+def test_parse_size(text, size):
+    assert parse_size(text) == size
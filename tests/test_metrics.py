@@ -0,0 +1,85 @@
+import socket
+
+import aiohttp
+
+from metrics import Counter, Histogram, Gauge, MetricsExporter, metrics
+from file_downloader import download_file
+
+MB = 1024 * 1024
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def test_counter_series_and_totals():
+    counter = Counter("things_total", "Things")
+    counter.inc(kind="a", cause="x")
+    counter.inc(2, cause="y", kind="a")
+    counter.inc(kind="b", cause="x")
+    assert (counter.total(), counter.total(kind="a"), counter.total(cause="x")) == (4, 3, 2)
+    assert counter.samples() == [
+        'vadscrape_things_total{cause="x",kind="a"} 1',
+        'vadscrape_things_total{cause="x",kind="b"} 1',
+        'vadscrape_things_total{cause="y",kind="a"} 2'
+    ]
+
+def test_histogram_buckets_are_cumulative():
+    histogram = Histogram("wait_seconds", "Waits", buckets=(0.1, 1))
+    for value in (0.05, 0.5, 0.7, 3):
+        histogram.observe(value, kind="x")
+    assert histogram.samples() == [
+        'vadscrape_wait_seconds_bucket{kind="x",le="0.1"} 1',
+        'vadscrape_wait_seconds_bucket{kind="x",le="1"} 3',
+        'vadscrape_wait_seconds_bucket{kind="x",le="+Inf"} 4',
+        'vadscrape_wait_seconds_sum{kind="x"} 4.25',
+        'vadscrape_wait_seconds_count{kind="x"} 4'
+    ]
+    with histogram.time():
+        pass
+    assert histogram.totals()[0] == 5
+
+def test_gauge_reads_its_value_when_rendered():
+    values = {(("host", 'a"b'),): 1}
+    gauge = Gauge("open", "Open", lambda: values)
+    assert gauge.samples() == ['vadscrape_open{host="a\\"b"} 1']
+    values[(("host", "c"),)] = 0
+    assert len(gauge.samples()) == 2
+
+def test_render_lists_every_metric():
+    text = metrics.render()
+    assert text.endswith("\n")
+    for metric in metrics.metrics:
+        assert f"# TYPE {metric.name} {metric.kind}" in text
+    assert "vadscrape_transfers_active 0" in text
+
+def test_download_updates_the_transfer_metrics(tmp_path, fake_site, run):
+    server = fake_site(file_size_mb=2)
+    downloaded = metrics.bytes_downloaded.total()
+    finished = metrics.downloads.total(result="ok")
+    first_bytes = metrics.first_byte.totals()[0]
+
+    assert run(download_file(None, f"{server.url}/f/show/E001.mkv", str(tmp_path / "E001.mkv"), 0, segments=1))
+    assert metrics.bytes_downloaded.total() - downloaded == 2 * MB
+    assert metrics.downloads.total(result="ok") - finished == 1
+    assert metrics.first_byte.totals()[0] - first_bytes == 1
+
+def test_exporter_serves_and_writes_metrics(tmp_path, run):
+    path = str(tmp_path / "metrics.prom")
+    port = free_port()
+    exporter = MetricsExporter({"listen": True, "port": port, "file": path, "write_interval": 60})
+
+    async def main():
+        await exporter.start()
+        try:
+            async with aiohttp.ClientSession() as session:
+                async with session.get(f"http://127.0.0.1:{port}/metrics") as response:
+                    return response.status, await response.text()
+        finally:
+            await exporter.stop()
+
+    status, text = run(main())
+    assert status == 200 and "# TYPE vadscrape_downloads_total counter" in text
+    with open(path) as f:
+        assert "# TYPE vadscrape_downloads_total counter" in f.read()
+    assert exporter.runner is None and exporter.task is None
@@ -0,0 +1,136 @@
+import asyncio
+
+from page_cache import PageCache
+
+URL = "http://site.test/d/show/"
+
+class Fetcher:
+    # Stands in for BaseScraper.fetch_text; each call can be held open until released
+    def __init__(self):
+        self.calls = []
+        self.release = asyncio.Event()
+
+    async def __call__(self, conditional_headers):
+        self.calls.append(conditional_headers)
+        await self.release.wait()
+        return 200, f"body {len(self.calls)}", {"ETag": f'"{len(self.calls)}"'}
+
+class Site:
+    # Answers at once, with a 304 when the caller's ETag matches the current page
+    def __init__(self):
+        self.calls = []
+        self.version = 1
+        self.down = False
+
+    async def __call__(self, conditional_headers):
+        self.calls.append(conditional_headers)
+        if self.down:
+            return None
+        etag = f'"{self.version}"'
+        if conditional_headers.get("If-None-Match") == etag:
+            return 304, None, {"ETag": etag}
+        return 200, f"body {self.version}", {"ETag": etag}
+
+def expire(cache, url=URL):
+    cache.memory[url] = dict(cache.get_entry(url), fetched_at=0)
+
+def test_fresh_entry_is_served_without_a_request(tmp_path):
+    cache = PageCache(str(tmp_path))
+    site = Site()
+    assert asyncio.run(cache.fetch(URL, site))["body"] == "body 1"
+    assert asyncio.run(cache.fetch(URL, site))["body"] == "body 1"
+    assert (len(site.calls), cache.misses, cache.hits) == (1, 1, 1)
+
+def test_stale_entry_is_revalidated(tmp_path):
+    cache = PageCache(str(tmp_path))
+    site = Site()
+    asyncio.run(cache.fetch(URL, site))
+    expire(cache)
+    entry = asyncio.run(cache.fetch(URL, site))
+    assert site.calls[-1] == {"If-None-Match": '"1"'}
+    assert entry["body"] == "body 1" and cache.is_fresh(entry)
+    assert cache.revalidations == 1
+
+    site.version = 2
+    expire(cache)
+    assert asyncio.run(cache.fetch(URL, site))["body"] == "body 2"
+
+def test_entries_survive_a_restart(tmp_path):
+    site = Site()
+    asyncio.run(PageCache(str(tmp_path)).fetch(URL, site))
+    cache = PageCache(str(tmp_path))
+    assert asyncio.run(cache.fetch(URL, site))["body"] == "body 1"
+    assert len(site.calls) == 1
+
+def test_stale_copy_is_served_when_the_site_is_down(tmp_path):
+    cache = PageCache(str(tmp_path))
+    site = Site()
+    asyncio.run(cache.fetch(URL, site))
+    expire(cache)
+    site.down = True
+    assert asyncio.run(cache.fetch(URL, site))["body"] == "body 1"
+    assert asyncio.run(cache.fetch("http://site.test/d/other/", site)) is None
+
+def test_ttl_rules_match_by_pattern(tmp_path):
+    cache = PageCache(str(tmp_path), default_ttl=600, ttl_rules=[{"pattern": "/s/", "ttl": 0}])
+    site = Site()
+    search = "http://site.test/s/show"
+    asyncio.run(cache.fetch(search, site))
+    asyncio.run(cache.fetch(search, site))
+    assert cache.ttl_for(URL) == 600
+    assert len(site.calls) == 2
+
+def test_disabled_cache_always_fetches(tmp_path):
+    cache = PageCache(str(tmp_path), enabled=False)
+    site = Site()
+    for _ in range(2):
+        assert asyncio.run(cache.fetch(URL, site)) == {"url": URL, "body": "body 1"}
+    assert site.calls == [{}, {}]
+    assert list(tmp_path.iterdir()) == []
+
+def test_memory_keeps_only_the_latest_entries(tmp_path):
+    cache = PageCache(str(tmp_path), memory_entries=2)
+    site = Site()
+    for name in ("a", "b", "c"):
+        asyncio.run(cache.fetch(f"http://site.test/d/{name}/", site))
+    assert list(cache.memory) == ["http://site.test/d/b/", "http://site.test/d/c/"]
+    # The evicted page is still on disk
+    assert asyncio.run(cache.fetch("http://site.test/d/a/", site))["body"] == "body 1"
+    assert len(site.calls) == 3
+
+def test_concurrent_requests_share_one_fetch(tmp_path):
+    cache = PageCache(str(tmp_path))
+
+    async def main():
+        fetcher = Fetcher()
+        callers = [asyncio.create_task(cache.fetch(URL, fetcher)) for _ in range(5)]
+        await asyncio.sleep(0)
+        fetcher.release.set()
+        return await asyncio.gather(*callers), fetcher
+
+    entries, fetcher = asyncio.run(main())
+    assert len(fetcher.calls) == 1
+    assert all(entry is entries[0] for entry in entries)
+    assert cache.inflight == {}
+
+def test_cancelled_leader_does_not_cancel_waiting_callers(tmp_path):
+    cache = PageCache(str(tmp_path))
+
+    async def main():
+        fetcher = Fetcher()
+        leader = asyncio.create_task(cache.fetch(URL, fetcher))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(cache.fetch(URL, fetcher))
+        await asyncio.sleep(0)
+        leader.cancel()
+        await asyncio.sleep(0)
+        fetcher.release.set()
+        entry = await asyncio.wait_for(follower, 2)
+        return leader, entry, fetcher
+
+    leader, entry, fetcher = asyncio.run(main())
+    assert leader.cancelled()
+    # The follower fetched the page itself
+    assert entry["body"] == "body 2"
+    assert len(fetcher.calls) == 2
+    assert URL not in cache.inflight
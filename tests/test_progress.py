@@ -0,0 +1,95 @@
+import asyncio
+import io
+
+from progress import ProgressTracker, Transfer, format_size, format_eta
+
+MB = 1024 * 1024
+
+class Control:
+    def __init__(self, id, state):
+        self.id = id
+        self.state = state
+
+def tracker(mode, **settings):
+    return ProgressTracker(dict(settings, mode=mode), stream=io.StringIO())
+
+def test_format_size_and_eta():
+    assert [format_size(size) for size in (512, 1536, 5 * MB, 3 * 1024 * MB, 4096 * 1024 * MB)] == ["512 B", "1.5 KB", "5.0 MB", "3.0 GB", "4096.0 GB"]
+    assert [format_eta(seconds) for seconds in (None, 42.9, 125, 7384)] == ["--", "42s", "2m 05s", "2h 03m"]
+
+def test_counters_and_summary_line(run):
+    progress = tracker("lines")
+
+    async def main():
+        first = progress.start("E001.mkv", 10 * MB)
+        second = progress.start("E002.mkv", 10 * MB, initial=4 * MB)
+        first.update(10 * MB)
+        first.close()
+        second.update(MB)
+        second.control = Control(2, "paused")
+        progress.speed = MB
+        return progress.summary_line()
+
+    line = run(main())
+    assert line == "Progress: 1 active, 1 paused, 1 finished, 5.0 MB / 10.0 MB, 1.0 MB/s, ETA 5s"
+    assert progress.bytes == 11 * MB
+
+def test_unfinished_transfer_is_not_counted_as_completed(run):
+    progress = tracker("lines")
+
+    async def main():
+        progress.start("E001.mkv", 10 * MB).close()
+
+    run(main())
+    assert (progress.completed, progress.transfers) == (0, [])
+
+def test_rows_fit_the_terminal_and_show_state(monkeypatch):
+    monkeypatch.setenv("COLUMNS", "81")
+    progress = tracker("dashboard", max_rows=2)
+    progress.transfers = [Transfer(progress, name, 10 * MB) for name in ("a" * 200, "E002.mkv", "E003.mkv")]
+    progress.transfers[0].done = 5 * MB
+    progress.transfers[1].control = Control(7, "paused")
+
+    lines = progress.render()
+    assert len(lines) == 4 and lines[-1] == "... and 1 more"
+    assert all(len(line) <= 80 for line in lines)
+    # A long name is cut short, not the bar
+    assert "a" * 20 + "... [##########----------]  50%" in lines[1]
+    assert lines[2].startswith("7 E002.mkv") and lines[2].endswith("paused")
+
+def test_dashboard_is_redrawn_in_place_and_cleared():
+    progress = tracker("dashboard")
+    progress.draw()
+    progress.draw()
+    output = progress.stream.getvalue()
+    assert output.count("Progress:") == 2
+    # The second frame moves up over the first one
+    assert output.split("\n", 1)[1].startswith("\x1b[1F\x1b[J")
+
+    progress.write("message")
+    assert progress.stream.getvalue().endswith("\x1b[1F\x1b[Jmessage\n")
+    assert progress.drawn_lines == 0
+
+def test_auto_mode_follows_the_stream():
+    assert not tracker("auto").dashboard
+    assert tracker("dashboard").dashboard
+    # An unknown mode falls back to auto
+    assert tracker("fancy").settings["mode"] == "auto"
+
+def test_renderer_runs_while_transfers_are_active(run):
+    progress = tracker("dashboard", refresh_interval=0.01)
+
+    async def main():
+        transfer = progress.start("E001.mkv", MB)
+        for _ in range(4):
+            transfer.update(MB // 4)
+            await asyncio.sleep(0.02)
+        transfer.close()
+        await asyncio.wait_for(progress.task, 1)
+
+    run(main())
+    output = progress.stream.getvalue()
+    assert "E001.mkv" in output
+    # Exiting clears the last frame
+    assert output.endswith("\x1b[J") and progress.drawn_lines == 0
+    assert progress.speed == 0
@@ -0,0 +1,52 @@
+import time
+
+import pytest
+
+from rate_limiter import RateLimiter, TokenBucket, parse_clock
+
+def at(clock):
+    return time.struct_time((2024, 1, 1, *map(int, clock.split(':')), 0, 0, 1, -1))
+
+@pytest.fixture
+def limiter():
+    return RateLimiter({
+        "global_limit_mbps": 10,
+        "per_host_limit_mbps": 4,
+        "schedule": [
+            {"start": "22:00", "end": "06:00", "global_limit_mbps": 0, "per_host_limit_mbps": 0},
+            {"start": "09:00", "end": "17:30", "global_limit_mbps": 2}
+        ]
+    })
+
+def test_parse_clock():
+    assert parse_clock("00:00") == 0
+    assert parse_clock("22:30") == 22 * 60 + 30
+
+@pytest.mark.parametrize("clock", ["22:00", "23:59", "00:00", "05:59"])
+def test_window_wrapping_past_midnight_applies(limiter, clock):
+    assert limiter.active_limits(at(clock)) == (0, 0)
+
+@pytest.mark.parametrize("clock", ["06:00", "08:59", "17:30", "21:59"])
+def test_outside_windows_uses_base_limits(limiter, clock):
+    assert limiter.active_limits(at(clock)) == (10, 4)
+
+def test_daytime_window_overrides_only_what_it_sets(limiter):
+    assert limiter.active_limits(at("09:00")) == (2, 4)
+    assert limiter.active_limits(at("17:29")) == (2, 4)
+
+def test_invalid_window_is_skipped():
+    limiter = RateLimiter({"global_limit_mbps": 5, "schedule": [{"start": "late"}, {"start": "00:00", "end": "23:59", "global_limit_mbps": 1}]})
+    assert limiter.active_limits(at("12:00")) == (1, 0)
+
+def test_bucket_burst_is_capped_at_one_second():
+    bucket = TokenBucket(rate=1000)
+    bucket.tokens = 1000
+    bucket.updated -= 60
+    bucket._refill()
+    assert bucket.tokens == 1000
+
+def test_lowering_rate_caps_saved_tokens():
+    bucket = TokenBucket(rate=1000)
+    bucket.tokens = 1000
+    bucket.set_rate(100)
+    assert bucket.tokens <= 100
@@ -0,0 +1,96 @@
+import os
+
+from resume_manifest import ResumeManifest, prepare_resume
+
+BLOCK = 4
+
+def write_partial(path, data, url="http://site/f/a.mkv"):
+    with open(path, 'wb') as f:
+        f.write(data)
+    manifest = ResumeManifest(path, url=url, remote_size=100, etag='"a"', block_size=BLOCK)
+    manifest.update(data)
+    manifest.save()
+    return manifest
+
+def test_update_hashes_only_complete_blocks(tmp_path):
+    manifest = ResumeManifest(str(tmp_path / "a.tmp"), block_size=BLOCK)
+    manifest.update(b"abcdef")
+    manifest.update(b"gh")
+    manifest.update(b"i")
+    assert len(manifest.blocks) == 2
+    assert manifest.verified_length() == 8
+
+def test_save_and_load_round_trip(tmp_path):
+    path = str(tmp_path / "a.tmp")
+    saved = write_partial(path, b"0123456789")
+    loaded = ResumeManifest.load(path)
+    assert (loaded.url, loaded.remote_size, loaded.etag, loaded.block_size) == ("http://site/f/a.mkv", 100, '"a"', BLOCK)
+    assert loaded.blocks == saved.blocks
+
+def test_load_ignores_unreadable_manifest(tmp_path):
+    path = str(tmp_path / "a.tmp")
+    with open(f"{path}.manifest", 'w') as f:
+        f.write("{not json")
+    assert ResumeManifest.load(path) is None
+
+def test_validate_keeps_intact_blocks_and_drops_partial_tail(tmp_path):
+    path = str(tmp_path / "a.tmp")
+    write_partial(path, b"0123456789")
+    manifest = ResumeManifest.load(path)
+    assert manifest.validate() == 8
+    assert os.path.getsize(path) == 8
+
+def test_validate_truncates_back_to_last_good_block(tmp_path):
+    path = str(tmp_path / "a.tmp")
+    write_partial(path, b"0123456789ab")
+    # A torn write corrupted the last block on disk
+    with open(path, 'r+b') as f:
+        f.seek(9)
+        f.write(b"X")
+    manifest = ResumeManifest.load(path)
+    assert manifest.validate() == 8
+    assert len(manifest.blocks) == 2
+    assert open(path, 'rb').read() == b"01234567"
+
+def test_validate_of_empty_file_starts_over(tmp_path):
+    path = str(tmp_path / "a.tmp")
+    write_partial(path, b"01234567")
+    open(path, 'wb').close()
+    manifest = ResumeManifest.load(path)
+    assert manifest.validate() == 0
+    assert manifest.blocks == []
+    assert manifest.remote_size == 100
+
+def test_rebuild_adopts_file_without_manifest(tmp_path):
+    path = str(tmp_path / "a.tmp")
+    with open(path, 'wb') as f:
+        f.write(b"0123456789")
+    manifest = ResumeManifest(path, block_size=BLOCK)
+    assert manifest.rebuild() == 8
+    assert os.path.getsize(path) == 8
+    assert len(manifest.blocks) == 2
+
+def test_matches_remote_compares_known_size_and_etag(tmp_path):
+    manifest = ResumeManifest(str(tmp_path / "a.tmp"), remote_size=100, etag='"a"')
+    assert manifest.matches_remote(100, '"a"')
+    assert manifest.matches_remote(0, None)
+    assert not manifest.matches_remote(101, '"a"')
+    assert not manifest.matches_remote(100, '"b"')
+
+def test_prepare_resume_without_data_removes_stale_manifest(tmp_path):
+    path = str(tmp_path / "a.tmp")
+    write_partial(path, b"01234567")
+    os.remove(path)
+    manifest, length = prepare_resume(path, "http://site/f/a.mkv")
+    assert length == 0
+    assert not os.path.exists(f"{path}.manifest")
+    assert manifest.url == "http://site/f/a.mkv"
+
+def test_prepare_resume_rebuilds_when_offset_differs(tmp_path):
+    path = str(tmp_path / "a.tmp.part8-15")
+    write_partial(path, b"89abcdef")
+    manifest, length = prepare_resume(path, "http://site/f/a.mkv", offset=8)
+    assert manifest.offset == 8
+    # Rebuilt with the default block size, larger than the data on disk
+    assert length == 0
+    assert ResumeManifest.load(path).offset == 8
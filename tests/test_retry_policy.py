@@ -0,0 +1,93 @@
+import asyncio
+import time
+from email.utils import formatdate
+
+import pytest
+
+from retry_policy import RetryPolicy
+
+URL = "http://site.test/f/a.mkv"
+
+class Response:
+    def __init__(self, retry_after=None):
+        self.headers = {} if retry_after is None else {"Retry-After": retry_after}
+
+@pytest.fixture
+def policy():
+    return RetryPolicy({"base_delay": 1, "max_delay": 60, "breaker_threshold": 3, "breaker_cooldown": 30})
+
+def test_retry_after_seconds(policy):
+    assert policy.retry_after(Response("12")) == 12.0
+    assert policy.retry_after(Response("-5")) == 0.0
+
+def test_retry_after_http_date(policy):
+    delay = policy.retry_after(Response(formatdate(time.time() + 20, usegmt=True)))
+    assert 18 <= delay <= 20
+
+def test_retry_after_missing_or_garbled(policy):
+    assert policy.retry_after(Response()) is None
+    assert policy.retry_after(Response("soon")) is None
+
+def test_throttle_honours_retry_after_up_to_max_delay(policy):
+    assert policy.on_throttle(URL, Response("5")) == 5
+    assert policy.stats()["retry_after_honored"] == 1
+    state = policy.host_state(URL)
+    assert state.paused_until - time.monotonic() == pytest.approx(5, abs=0.5)
+
+    other = "http://other.test/x"
+    assert policy.on_throttle(other, Response("3600")) == 60
+
+def test_throttle_while_paused_returns_remaining_pause(policy):
+    policy.on_throttle(URL, Response("10"))
+    assert policy.on_throttle(URL, Response("1")) == pytest.approx(10, abs=0.5)
+    assert policy.host_state(URL).failures == 1
+
+def test_throttle_without_retry_after_backs_off_with_jitter(policy):
+    delays = []
+    for _ in range(3):
+        policy.host_state(URL).paused_until = 0
+        delays.append(policy.on_throttle(URL, Response()))
+    assert all(1 <= delay <= 60 for delay in delays)
+    assert delays[1] <= max(1, delays[0] * 3) and delays[2] <= max(1, delays[1] * 3)
+
+def test_breaker_opens_after_threshold_and_closes_on_success(policy):
+    for _ in range(2):
+        policy.on_failure(URL)
+    assert not policy.host_state(URL).breaker_open
+    policy.on_failure(URL)
+    state = policy.host_state(URL)
+    assert state.breaker_open
+    assert state.paused_until - time.monotonic() == pytest.approx(30, abs=0.5)
+    assert policy.stats()["breaker_opened"] == 1
+
+    policy.on_success(URL)
+    assert not state.breaker_open and state.failures == 0
+
+def test_half_open_lets_one_probe_through(policy):
+    for _ in range(3):
+        policy.on_failure(URL)
+    state = policy.host_state(URL)
+    state.paused_until = 0
+
+    async def probe_then_wait():
+        await policy.before_request(URL)
+        assert state.probing
+        # A second request waits for the probe's verdict
+        second = asyncio.create_task(policy.before_request(URL))
+        await asyncio.sleep(0.1)
+        assert not second.done()
+        policy.on_success(URL)
+        await asyncio.wait_for(second, 2)
+
+    asyncio.run(probe_then_wait())
+
+def test_failed_probe_reopens_breaker(policy):
+    for _ in range(3):
+        policy.on_failure(URL)
+    state = policy.host_state(URL)
+    state.paused_until = 0
+    asyncio.run(policy.before_request(URL))
+    policy.on_failure(URL)
+    assert state.breaker_open and not state.probing
+    assert state.paused_until > time.monotonic()
+    assert policy.stats()["breaker_opened"] == 2
@@ -0,0 +1,101 @@
+import asyncio
+import json
+import os
+from collections import defaultdict
+
+import pytest
+
+from tracing import Tracer, NULL_SPAN, load_spans, critical_path, analyze_trace
+
+@pytest.fixture
+def trace_file(tmp_path):
+    return str(tmp_path / "trace.jsonl")
+
+def read_events(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f]
+
+def span(id, name, start, end, parent=None, **attrs):
+    return dict({"id": id, "parent": parent, "name": name, "start": start, "end": end}, **attrs)
+
+def write_trace(path, events):
+    with open(path, 'w') as f:
+        f.write("".join(json.dumps(event) + "\n" for event in events))
+
+def test_disabled_tracer_writes_nothing(trace_file):
+    tracer = Tracer({"file": trace_file})
+    assert not tracer.enabled
+    assert tracer.span("item") is NULL_SPAN
+    tracer.record("wait", 1.0)
+    assert not os.path.exists(trace_file)
+
+def test_spans_nest_across_tasks(trace_file, run):
+    tracer = Tracer({"enabled": True, "file": trace_file})
+
+    async def main():
+        async with tracer.span("item", query="show") as item:
+            async def transfer(i):
+                with tracer.span("transfer", file=i) as span:
+                    span.add("disk_wait", 0.5)
+                    span.add("disk_wait", 0.25)
+            await asyncio.gather(*[transfer(i) for i in range(2)])
+            tracer.record("queue_wait", 0.1)
+            item.set(files=2)
+        with pytest.raises(KeyError):
+            with tracer.span("broken"):
+                raise KeyError("x")
+
+    run(main())
+    tracer.close()
+    events = {event["name"] + str(event.get("file", "")): event for event in read_events(trace_file)}
+    item = events["item"]
+    assert (item["parent"], item["query"], item["files"]) == (None, "show", 2)
+    assert events["transfer0"]["parent"] == events["transfer1"]["parent"] == item["id"]
+    assert events["transfer0"]["disk_wait"] == 0.75
+    assert events["queue_wait"]["parent"] == item["id"]
+    assert events["queue_wait"]["end"] - events["queue_wait"]["start"] == pytest.approx(0.1, abs=0.001)
+    assert events["broken"]["error"] == "KeyError"
+
+def test_load_spans_builds_the_tree_and_skips_bad_lines(trace_file):
+    write_trace(trace_file, [span("1", "item", 0, 10), span("2", "season", 0, 5, parent="1"), span("3", "orphan", 0, 1, parent="gone")])
+    with open(trace_file, 'a') as f:
+        f.write("{not json\n\n")
+    spans, roots = load_spans(trace_file)
+    assert len(spans) == 3
+    assert [root["id"] for root in roots] == ["1", "3"]
+    assert [child["id"] for child in spans["1"]["children"]] == ["2"]
+
+def test_critical_path_follows_the_last_finishing_children(trace_file):
+    # Two overlapping transfers: the one finishing last counts in full, the other only until it began
+    write_trace(trace_file, [
+        span("1", "item", 0, 10),
+        span("2", "listing", 0, 2, parent="1"),
+        span("3", "transfer", 2, 6, parent="1"),
+        span("4", "transfer", 3, 9, parent="1")
+    ])
+    spans, roots = load_spans(trace_file)
+    breakdown = defaultdict(float)
+    critical_path(roots[0], roots[0]["end"], breakdown)
+    assert dict(breakdown) == {"item": 1, "transfer": 7, "listing": 2}
+
+    write_trace(trace_file, [span("1", "transfer", 0, 4, disk_wait=1.5)])
+    spans, roots = load_spans(trace_file)
+    breakdown = defaultdict(float)
+    critical_path(roots[0], roots[0]["end"], breakdown)
+    assert dict(breakdown) == {"transfer.disk_wait": 1.5, "transfer": 2.5}
+
+def test_analyze_trace_reports_phases(trace_file, capsys):
+    write_trace(trace_file, [span("1", "item", 0, 10, query="show"), span("2", "transfer", 1, 9, parent="1")])
+    assert analyze_trace(trace_file) == 0
+    output = capsys.readouterr().out
+    assert "Critical path over 1 root spans (10.00s total)" in output
+    assert "transfer" in output and "80.0%" in output
+    assert "show" in output
+
+def test_analyze_trace_fails_on_missing_or_empty_files(trace_file, tmp_path):
+    assert analyze_trace(str(tmp_path / "missing.jsonl")) == 1
+    open(trace_file, 'w').close()
+    assert analyze_trace(trace_file) == 1
+    with open(trace_file, 'wb') as f:
+        f.write(b"\xff\xfe\x00binary")
+    assert analyze_trace(trace_file) == 1
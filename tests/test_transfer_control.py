@@ -0,0 +1,119 @@
+import asyncio
+import io
+
+import pytest
+
+from transfer_control import TransferHandle, TransferRegistry, ControlConsole, control_console, transfers, RUNNING, PAUSED, SKIPPED, CANCELLED
+from file_downloader import download_file
+from progress import progress
+
+def test_handle_states():
+    handle = TransferHandle(1, "http://site/f/E001.mkv", "/tmp/E001.mkv")
+    assert handle.name == "E001.mkv" and handle.state == RUNNING
+    assert not handle.resume()
+    assert handle.pause() and not handle.pause()
+    assert handle.state == PAUSED
+    assert handle.resume() and handle.state == RUNNING
+    assert handle.skip() and handle.stopped and handle.result == "skipped"
+    # A stopped transfer stays stopped
+    assert not handle.cancel() and not handle.pause()
+    assert handle.state == SKIPPED
+
+    cancelled = TransferHandle(2, "http://site/f/E002.mkv", "/tmp/E002.mkv")
+    assert cancelled.cancel() and cancelled.result is None
+
+def test_checkpoint_waits_while_paused(run):
+    async def main():
+        handle = TransferHandle(1, "url", "/tmp/E001.mkv")
+        assert not await handle.checkpoint()
+        handle.pause()
+        waiting = asyncio.create_task(handle.checkpoint())
+        await asyncio.sleep(0.01)
+        assert not waiting.done()
+        handle.resume()
+        assert not await waiting
+
+        handle.pause()
+        waiting = asyncio.create_task(handle.checkpoint())
+        await asyncio.sleep(0.01)
+        # Stopping a paused transfer wakes it up
+        handle.cancel()
+        return await waiting
+
+    assert run(main())
+
+def test_registry_finds_transfers_by_number_name_or_all():
+    registry = TransferRegistry()
+    with registry.track("url1", "/tmp/Show E001.mkv") as first, registry.track("url2", "/tmp/Show E002.mkv") as second:
+        assert registry.find("all") == [first, second]
+        assert registry.find(f" {second.id} ") == [second]
+        assert registry.find("99") == []
+        assert registry.find("e001") == [first]
+        assert registry.for_path("/tmp/Show E002.mkv") is second
+        assert registry.control("pause", "show") == [first, second]
+        assert registry.control("pause", "all") == []
+        with pytest.raises(ValueError):
+            registry.control("delete", "all")
+    assert registry.handles == {}
+
+def test_cancel_all_stops_transfers_not_started_yet():
+    registry = TransferRegistry()
+    with registry.track("url1", "/tmp/E001.mkv") as running:
+        registry.cancel_all()
+        assert running.state == CANCELLED
+        with registry.track("url2", "/tmp/E002.mkv") as later:
+            assert later.state == CANCELLED
+    registry.reset()
+    with registry.track("url3", "/tmp/E003.mkv") as after_reset:
+        assert after_reset.state == RUNNING
+
+def test_console_commands(monkeypatch):
+    monkeypatch.setattr(progress, "stream", io.StringIO())
+
+    def output():
+        text = progress.stream.getvalue()
+        progress.stream.seek(0)
+        progress.stream.truncate()
+        return text
+
+    registry = TransferRegistry()
+    console = ControlConsole(registry)
+    with registry.track("url1", "/tmp/E001.mkv") as first, registry.track("url2", "/tmp/E002.mkv") as second:
+        console.handle("pause 1\n")
+        assert first.state == PAUSED
+        console.handle("list")
+        printed = output()
+        assert "Pause: E001.mkv" in printed and "paused" in printed and "E002.mkv" in printed
+
+        console.handle("skip E009")
+        assert "No running transfer matches 'E009' for skip" in output()
+        console.handle("frobnicate")
+        assert "Download controls:" in output()
+
+        console.handle("stop")
+        assert (first.state, second.state, registry.stopping) == (CANCELLED, CANCELLED, True)
+
+def test_control_console_resets_the_registry():
+    registry = TransferRegistry()
+    # Test runs read no commands from stdin
+    with control_console(registry) as console:
+        assert console is None
+        registry.cancel_all()
+    assert not registry.stopping
+
+def test_skipping_one_download_leaves_the_others_running(fake_site, tmp_path, run):
+    server = fake_site(file_size_mb=2, bandwidth_mbps=4)
+
+    async def main():
+        downloads = [asyncio.create_task(download_file(None, f"{server.url}/f/show/E00{i}.mkv", str(tmp_path / f"E00{i}.mkv"), 0, segments=1))
+                     for i in (1, 2)]
+        while len(transfers.find("all")) < 2 or not all(handle.progress and handle.progress.done for handle in transfers.find("all")):
+            await asyncio.sleep(0.01)
+        assert [handle.name for handle in transfers.control("skip", "E001")] == ["E001.mkv"]
+        return await asyncio.gather(*downloads)
+
+    skipped, finished = run(main())
+    assert skipped == "skipped"
+    assert finished and finished[0] == str(tmp_path / "E002.mkv")
+    assert (tmp_path / "E002.mkv").stat().st_size == 2 * 1024 * 1024
+    assert not (tmp_path / "E001.mkv").exists()
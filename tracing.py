@@ -0,0 +1,247 @@
+import contextvars
+import itertools
+import json
+import logging
+import time
+import uuid
+from collections import defaultdict
+
+DEFAULT_TRACING_SETTINGS = {
+    "enabled": False,
+    "file": "trace.jsonl"
+}
+
+# Bounds of the latency histogram buckets, in seconds
+HISTOGRAM_BOUNDS = (0.001, 0.01, 0.1, 1, 10, 60, 600)
+
+current_span = contextvars.ContextVar("current_span", default=None)
+
+class Span:
+    # One timed phase. The parent is the span that was current when this one
+    # started, which is inherited by tasks created inside it; waits measured
+    # inside the phase (disk, rate limiting) are accumulated with add().
+    __slots__ = ("tracer", "id", "parent", "name", "attrs", "start", "token")
+
+    def __init__(self, tracer, name, parent, attrs):
+        self.tracer = tracer
+        self.id = tracer.next_id()
+        self.parent = parent
+        self.name = name
+        self.attrs = attrs
+        self.start = 0
+        self.token = None
+
+    def __enter__(self):
+        if self.parent is None:
+            parent = current_span.get()
+            self.parent = parent.id if parent is not None else None
+        self.start = time.time()
+        self.token = current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        current_span.reset(self.token)
+        if exc_type is not None:
+            self.attrs["error"] = exc_type.__name__
+        self.tracer.emit(self.id, self.parent, self.name, self.start, time.time(), self.attrs)
+        return False
+
+    # Also usable with async with, to share one statement with another async context manager
+    async def __aenter__(self):
+        return self.__enter__()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        return self.__exit__(exc_type, exc, tb)
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def add(self, key, amount):
+        self.attrs[key] = self.attrs.get(key, 0) + amount
+
+class NullSpan:
+    # Returned while tracing is off, so instrumented code pays for one attribute lookup
+    id = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        return False
+
+    def set(self, **attrs):
+        pass
+
+    def add(self, key, amount):
+        pass
+
+NULL_SPAN = NullSpan()
+
+class Tracer:
+    def __init__(self, settings=None):
+        self.settings = dict(DEFAULT_TRACING_SETTINGS)
+        self.file = None
+        self.run = uuid.uuid4().hex[:8]
+        self.ids = itertools.count(1)
+        self.configure(settings)
+
+    def configure(self, settings):
+        self.settings.update({key: value for key, value in (settings or {}).items() if key in DEFAULT_TRACING_SETTINGS})
+        self.close()
+        if self.settings["enabled"]:
+            try:
+                # Line buffered, so a crash loses at most the span being written
+                self.file = open(self.settings["file"], 'a', buffering=1)
+                logging.info(f"Tracing to {self.settings['file']}")
+            except OSError as e:
+                logging.error(f"Cannot open trace file {self.settings['file']}: {e}")
+
+    @property
+    def enabled(self):
+        return self.file is not None
+
+    def next_id(self):
+        return f"{self.run}-{next(self.ids)}"
+
+    def span(self, name, parent=None, **attrs):
+        if self.file is None:
+            return NULL_SPAN
+        return Span(self, name, parent, attrs)
+
+    def record(self, name, duration, **attrs):
+        # A phase that has already finished, such as the wait for response headers
+        if self.file is None:
+            return
+        parent = current_span.get()
+        end = time.time()
+        self.emit(self.next_id(), parent.id if parent is not None else None, name, end - duration, end, attrs)
+
+    def emit(self, span_id, parent, name, start, end, attrs):
+        event = {"id": span_id, "parent": parent, "name": name, "start": round(start, 6), "end": round(end, 6)}
+        event.update(attrs)
+        try:
+            self.file.write(json.dumps(event, default=str) + "\n")
+        except (OSError, ValueError) as e:
+            logging.error(f"Tracing stopped: {e}")
+            self.file = None
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+tracer = Tracer()
+
+def configure_tracing(settings):
+    tracer.configure(settings)
+
+def get_tracer():
+    return tracer
+
+# Offline analysis
+
+def load_spans(path):
+    spans = {}
+    with open(path) as f:
+        for number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                event = json.loads(line)
+            except ValueError:
+                logging.warning(f"Skipping malformed trace line {number}")
+                continue
+            event["children"] = []
+            spans[event["id"]] = event
+    for span in spans.values():
+        parent = spans.get(span.get("parent"))
+        if parent is not None:
+            parent["children"].append(span)
+    roots = [span for span in spans.values() if span.get("parent") not in spans]
+    return spans, roots
+
+def critical_path(span, limit, breakdown):
+    # Walks back from the end of the span: the child that finished last is on
+    # the critical path, then the one that finished last before it started,
+    # and so on. Time not covered by a child counts against the span itself.
+    cursor = min(span["end"], limit)
+    children = sorted(span["children"], key=lambda child: child["end"], reverse=True)
+    while cursor > span["start"]:
+        child = next((child for child in children if child["start"] < cursor), None)
+        if child is None:
+            self_time(span, cursor - span["start"], breakdown)
+            break
+        child_end = min(child["end"], cursor)
+        self_time(span, cursor - child_end, breakdown)
+        critical_path(child, child_end, breakdown)
+        cursor = max(child["start"], span["start"])
+        children.remove(child)
+
+def self_time(span, duration, breakdown):
+    if duration <= 0:
+        return
+    # Waits recorded inside a phase are split out of its own time
+    for key in ("disk_wait", "rate_wait", "pause_wait"):
+        waited = min(span.get(key, 0), duration)
+        if waited > 0:
+            breakdown[f"{span['name']}.{key}"] += waited
+            span[key] -= waited
+            duration -= waited
+    breakdown[span["name"]] += duration
+
+def percentile(values, fraction):
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+def format_seconds(seconds):
+    return f"{seconds * 1000:.1f}ms" if seconds < 1 else f"{seconds:.2f}s"
+
+def histogram_row(durations):
+    counts = [0] * (len(HISTOGRAM_BOUNDS) + 1)
+    for duration in durations:
+        counts[next((i for i, bound in enumerate(HISTOGRAM_BOUNDS) if duration <= bound), len(HISTOGRAM_BOUNDS))] += 1
+    return counts
+
+def analyze_trace(path, top=10):
+    try:
+        spans, roots = load_spans(path)
+    except (OSError, ValueError) as e:
+        logging.error(f"Cannot read trace file {path}: {e}")
+        return 1
+    if not spans:
+        print(f"No spans in {path}")
+        return 1
+
+    breakdown = defaultdict(float)
+    total = 0
+    for root in roots:
+        critical_path(root, root["end"], breakdown)
+        total += root["end"] - root["start"]
+    print(f"Critical path over {len(roots)} root spans ({format_seconds(total)} total):")
+    print(f"  {'phase':<28}{'time':>12}{'share':>8}")
+    for name, seconds in sorted(breakdown.items(), key=lambda item: item[1], reverse=True):
+        print(f"  {name:<28}{format_seconds(seconds):>12}{seconds / total if total else 0:>8.1%}")
+
+    print("\nSlowest root spans:")
+    for root in sorted(roots, key=lambda span: span["end"] - span["start"], reverse=True)[:top]:
+        label = root.get("query") or root.get("path") or root.get("url") or ""
+        print(f"  {root['name']:<12}{format_seconds(root['end'] - root['start']):>12}  {label}")
+
+    by_name = defaultdict(list)
+    for span in spans.values():
+        by_name[span["name"]].append(span["end"] - span["start"])
+    headers = [f"<={format_seconds(bound)}" for bound in HISTOGRAM_BOUNDS] + [f">{format_seconds(HISTOGRAM_BOUNDS[-1])}"]
+    print("\nPhase latency:")
+    print(f"  {'phase':<16}{'count':>7}{'p50':>10}{'p90':>10}{'p99':>10}{'max':>10}  " + "".join(f"{header:>9}" for header in headers))
+    for name, durations in sorted(by_name.items()):
+        durations.sort()
+        counts = histogram_row(durations)
+        print(f"  {name:<16}{len(durations):>7}{format_seconds(percentile(durations, 0.5)):>10}{format_seconds(percentile(durations, 0.9)):>10}"
+              f"{format_seconds(percentile(durations, 0.99)):>10}{format_seconds(durations[-1]):>10}  " + "".join(f"{count:>9}" for count in counts))
+    return 0
@@ -0,0 +1,211 @@
+import asyncio
+import itertools
+import logging
+import os
+import sys
+import time
+from contextlib import contextmanager
+from colorama import Fore, Style
+from progress import progress, format_size
+
+# Transfer states. Skipped and cancelled both end the transfer and keep its
+# partial data; a skip is reported as skipped, a cancel as interrupted.
+RUNNING = "running"
+PAUSED = "paused"
+SKIPPED = "skipped"
+CANCELLED = "cancelled"
+
+ACTIONS = ("pause", "resume", "skip", "cancel")
+
+class TransferHandle:
+    # Controls one download. The transfer loops call checkpoint() before each
+    # chunk: it returns at once while running, waits while paused and says
+    # when this transfer, and only this one, has to stop.
+    def __init__(self, handle_id, url, path):
+        self.id = handle_id
+        self.url = url
+        self.path = path
+        self.name = os.path.basename(path)
+        self.state = RUNNING
+        self.resumed = asyncio.Event()
+        self.resumed.set()
+        self.progress = None
+
+    @property
+    def stopped(self):
+        return self.state in (SKIPPED, CANCELLED)
+
+    @property
+    def result(self):
+        # What download_file returns for a transfer stopped through this handle
+        return "skipped" if self.state == SKIPPED else None
+
+    def attach(self, progress_bar):
+        # Lets the dashboard show the transfer's number and whether it is paused
+        self.progress = progress_bar
+        progress_bar.control = self
+
+    def pause(self):
+        if self.state != RUNNING:
+            return False
+        self.state = PAUSED
+        self.resumed.clear()
+        return True
+
+    def resume(self):
+        if self.state != PAUSED:
+            return False
+        self.state = RUNNING
+        self.resumed.set()
+        return True
+
+    def skip(self):
+        return self._stop(SKIPPED)
+
+    def cancel(self):
+        return self._stop(CANCELLED)
+
+    def _stop(self, state):
+        if self.stopped:
+            return False
+        self.state = state
+        # A paused transfer wakes up to notice it was stopped
+        self.resumed.set()
+        return True
+
+    async def checkpoint(self, span=None):
+        if self.state == PAUSED:
+            paused = time.perf_counter()
+            await self.resumed.wait()
+            if span is not None:
+                span.add("pause_wait", time.perf_counter() - paused)
+        return self.stopped
+
+    def describe(self):
+        done = f"{format_size(self.progress.done)}/{format_size(self.progress.total)}" if self.progress else "starting"
+        return f"{self.id:>3}  {self.state:<9} {done:<22} {self.name}"
+
+class TransferRegistry:
+    # Every download in progress, by a small number that is easy to type
+    def __init__(self):
+        self.handles = {}
+        self.ids = itertools.count(1)
+        # Set by cancel_all so that transfers and seasons not yet started stay stopped
+        self.stopping = False
+
+    @contextmanager
+    def track(self, url, path):
+        handle = TransferHandle(next(self.ids), url, path)
+        if self.stopping:
+            handle.cancel()
+        self.handles[handle.id] = handle
+        try:
+            yield handle
+        finally:
+            self.handles.pop(handle.id, None)
+
+    def find(self, key):
+        # "all", a transfer number, or part of a file name
+        key = str(key).strip()
+        if key.lower() == "all":
+            return list(self.handles.values())
+        if key.isdigit():
+            handle = self.handles.get(int(key))
+            return [handle] if handle else []
+        return [handle for handle in self.handles.values() if key.lower() in handle.name.lower()]
+
+    def for_path(self, path):
+        return next((handle for handle in self.handles.values() if handle.path == path), None)
+
+    def control(self, action, key):
+        # Returns the transfers the action applied to
+        if action not in ACTIONS:
+            raise ValueError(f"Unknown action {action!r}; expected one of {', '.join(ACTIONS)}")
+        return [handle for handle in self.find(key) if getattr(handle, action)()]
+
+    def cancel_all(self):
+        self.stopping = True
+        for handle in list(self.handles.values()):
+            handle.cancel()
+
+    def reset(self):
+        self.stopping = False
+
+transfers = TransferRegistry()
+
+def get_transfers():
+    return transfers
+
+# Console control channel
+
+CONSOLE_HELP = (
+    "Download controls: 'list', 'pause <n|name|all>', 'resume <n|name|all>', "
+    "'skip <n|name>', 'cancel <n|name|all>', 'stop' to cancel everything"
+)
+
+class ControlConsole:
+    # Reads commands from stdin while downloads run. The reader is registered
+    # with the event loop rather than run in a thread, so nothing is left
+    # waiting on stdin to steal the next menu answer once downloads finish.
+    def __init__(self, registry):
+        self.registry = registry
+        self.loop = None
+
+    def start(self):
+        self.loop = asyncio.get_running_loop()
+        self.loop.add_reader(sys.stdin.fileno(), self.on_input)
+        progress.write(f"{Fore.YELLOW}{CONSOLE_HELP}{Style.RESET_ALL}")
+
+    def stop(self):
+        if self.loop is not None:
+            self.loop.remove_reader(sys.stdin.fileno())
+            self.loop = None
+
+    def on_input(self):
+        line = sys.stdin.readline()
+        if not line:
+            self.stop()
+            return
+        self.handle(line)
+
+    def handle(self, line):
+        words = line.strip().split(maxsplit=1)
+        if not words:
+            return
+        command, key = words[0].lower(), words[1] if len(words) > 1 else ""
+        if command in ("list", "l"):
+            handles = list(self.registry.handles.values())
+            lines = [handle.describe() for handle in handles] or ["No transfers running"]
+            progress.write("\n".join(lines))
+        elif command == "stop":
+            self.registry.cancel_all()
+            progress.write(f"{Fore.YELLOW}Stopping all downloads{Style.RESET_ALL}")
+        elif command in ACTIONS and key:
+            changed = self.registry.control(command, key)
+            if changed:
+                progress.write(f"{Fore.YELLOW}{command.capitalize()}: {', '.join(handle.name for handle in changed)}{Style.RESET_ALL}")
+            else:
+                progress.write(f"{Fore.RED}No running transfer matches {key!r} for {command}{Style.RESET_ALL}")
+        else:
+            progress.write(f"{Fore.YELLOW}{CONSOLE_HELP}{Style.RESET_ALL}")
+
+@contextmanager
+def control_console(registry=None):
+    # Opened around a transfer phase only, once its prompts have been answered,
+    # so the console never competes with input() for a line. Reads only on an
+    # interactive terminal, and only where the loop can watch stdin; a 'stop'
+    # holds until the phase ends.
+    registry = registry or transfers
+    console = ControlConsole(registry) if sys.stdin.isatty() else None
+    if console is not None:
+        try:
+            console.start()
+        except (NotImplementedError, RuntimeError, OSError, ValueError) as e:
+            logging.debug(f"Download controls unavailable: {e}")
+            console = None
+    try:
+        yield console
+    finally:
+        if console is not None:
+            console.stop()
+        registry.reset()